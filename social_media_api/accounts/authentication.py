@@ -0,0 +1,226 @@
+"""
+Token authentication with cached token -> user lookups.
+
+CachedTokenAuthentication behaves like DRF's TokenAuthentication but
+avoids the Token + CustomUser join on most requests:
+
+1. a bounded per-process LRU (ACCOUNTS_TOKEN_CACHE_SIZE entries), whose
+   entries are trusted for ACCOUNTS_TOKEN_LOCAL_TTL seconds;
+2. the default Django cache, for ACCOUNTS_TOKEN_CACHE_TTL seconds, only
+   when it is shared between processes (see social_media_api.caches);
+3. the database.
+
+Deleting a token (logout, rotation) and saving a user (deactivation,
+profile changes) drop the affected entries from the shared cache and
+from this process's LRU. Other processes notice once their local entry
+expires, so revocation takes at most ACCOUNTS_TOKEN_LOCAL_TTL seconds to
+reach every process. Counters such as followers_count, which are updated
+with queryset updates, may be as old as the cache entry on request.user;
+views that display them should reload the user.
+
+Only CACHED_FIELDS are cached, never the password hash or the rest of
+the profile. On a hit request.user is a deferred user holding those fields
+(as with signed access tokens); any other field is loaded from the
+database on first access.
+
+Hits and misses are counted per process; see token_cache_stats().
+
+SignedTokenAuthentication accepts the stateless `Bearer` access tokens of
+accounts.tokens and can be enabled next to it.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from social_media_api import caches
+from .tokens import InvalidToken, verify_access_token
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_LOCAL_TTL = 10
+DEFAULT_SHARED_TTL = 300
+# In model field order, as Model.from_db() expects.
+CACHED_FIELDS = ('id', 'username', 'is_staff', 'is_active')
+
+
+class LRUCache:
+    """
+    A small thread-safe LRU mapping with per-entry expiry.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_local = LRUCache(getattr(settings, 'ACCOUNTS_TOKEN_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+@receiver(setting_changed)
+def _reset_local_cache(setting, **kwargs):
+    global _local
+    if setting == 'ACCOUNTS_TOKEN_CACHE_SIZE':
+        _local = LRUCache(getattr(settings, 'ACCOUNTS_TOKEN_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def token_cache_stats():
+    """
+    Return this process's lookup counters and the share of lookups that
+    did not need the database.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    stats['lookups'] = total
+    stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / total if total else 0.0
+    stats['local_entries'] = len(_local)
+    return stats
+
+
+def reset_token_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _cache_key(key):
+    # Tokens are credentials; keep them out of the shared cache's key space.
+    return 'accounts:token:v2:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _deferred_user(values):
+    """Build a user holding only `values`, a tuple of CACHED_FIELDS."""
+    User = get_user_model()
+    return User.from_db(DEFAULT_DB_ALIAS, CACHED_FIELDS, values)
+
+
+def invalidate_token(key):
+    _local.delete(key)
+    if caches.is_shared():
+        cache.delete(_cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+@receiver(post_delete, sender=Token)
+def _token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def _user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login; nothing the cache relies on changes.
+    if created or update_fields == frozenset(['last_login']):
+        return
+    invalidate_user_tokens(instance.pk)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication backed by a per-process LRU and the shared cache.
+    """
+
+    def authenticate_credentials(self, key):
+        user = None
+        # A process-local second tier would outlive revocations made in
+        # other processes by ACCOUNTS_TOKEN_CACHE_TTL instead of the local TTL.
+        shared = caches.is_shared()
+        values = _local.get(key)
+        if values is not None:
+            _count('local_hits')
+        else:
+            values = cache.get(_cache_key(key)) if shared else None
+            if values is not None:
+                _count('shared_hits')
+            else:
+                _count('misses')
+                user, token = super().authenticate_credentials(key)
+                values = tuple(getattr(user, field) for field in CACHED_FIELDS)
+                if shared:
+                    cache.set(
+                        _cache_key(key), values, getattr(settings, 'ACCOUNTS_TOKEN_CACHE_TTL', DEFAULT_SHARED_TTL),
+                    )
+            _local.set(key, values, getattr(settings, 'ACCOUNTS_TOKEN_LOCAL_TTL', DEFAULT_LOCAL_TTL))
+
+        if user is None:
+            # A new instance per request, so views that modify request.user
+            # share nothing with other requests.
+            user = _deferred_user(values)
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return user, Token(key=key, user=user)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticate `Authorization: Bearer <access token>` headers carrying a
+    signed access token, without touching the database.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header.')
+        try:
+            token = auth[1].decode()
+            return verify_access_token(token), token
+        except (UnicodeError, InvalidToken):
+            raise AuthenticationFailed('Invalid or expired token.')
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,143 @@
+"""
+Cache of the follow graph.
+
+Each user's following set is stored in the cache named by the
+ACCOUNTS_FOLLOW_CACHE setting (an alias in CACHES, locmem unless configured
+otherwise) as a sorted array of 64-bit IDs packed into bytes, so even large
+sets stay small and cheap to (un)pickle. A missing key is loaded from the
+follow table once and kept for ACCOUNTS_FOLLOW_CACHE_TTL seconds. The
+write-through below only reaches other web workers through a shared cache;
+with a process-local one (see social_media_api.caches) sets are kept for
+ACCOUNTS_FOLLOW_CACHE_LOCAL_TTL seconds, which bounds how long another
+worker can serve a stale set.
+
+FollowUserView and UnfollowUserView update the cached set in place after
+their transaction commits (write-through). Any other change to the graph,
+such as `user.following.add()` from the shell or admin, goes through the
+m2m_changed signal and simply drops the affected keys. Two concurrent
+follows by the same user can race on the read-modify-write; the TTL bounds
+how long such drift can last.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from social_media_api.caches import local_ttl
+from .models import Follow
+
+DEFAULT_TTL = 3600
+DEFAULT_LOCAL_TTL = 5
+
+
+def _alias():
+    return getattr(settings, 'ACCOUNTS_FOLLOW_CACHE', DEFAULT_CACHE_ALIAS)
+
+
+def _cache():
+    return caches[_alias()]
+
+
+def _ttl():
+    return local_ttl(
+        getattr(settings, 'ACCOUNTS_FOLLOW_CACHE_TTL', DEFAULT_TTL),
+        getattr(settings, 'ACCOUNTS_FOLLOW_CACHE_LOCAL_TTL', DEFAULT_LOCAL_TTL),
+        _alias(),
+    )
+
+
+def _key(user_id):
+    return f'accounts:following:{user_id}'
+
+
+def _pack(ids):
+    return array('q', sorted(ids)).tobytes()
+
+
+def _unpack(data):
+    ids = array('q')
+    ids.frombytes(data)
+    return ids
+
+
+def _load(user_id):
+    ids = array('q', sorted(
+        Follow.objects.filter(to_customuser_id=user_id).values_list('from_customuser_id', flat=True)
+    ))
+    _cache().set(_key(user_id), ids.tobytes(), _ttl())
+    return ids
+
+
+def _sorted_following(user_id):
+    data = _cache().get(_key(user_id))
+    return _load(user_id) if data is None else _unpack(data)
+
+
+def get_following_ids(user_id):
+    """
+    Return the set of IDs of the users `user_id` follows.
+    """
+    return set(_sorted_following(user_id))
+
+
+def is_following(user_id, other_id):
+    ids = _sorted_following(user_id)
+    index = bisect_left(ids, other_id)
+    return index < len(ids) and ids[index] == other_id
+
+
+def following_among(user_id, candidate_ids):
+    """
+    Return which of `candidate_ids` `user_id` follows, as a set, with at
+    most one cache read.
+    """
+    return get_following_ids(user_id).intersection(candidate_ids)
+
+
+def _update(user_id, change):
+    def apply():
+        cache = _cache()
+        data = cache.get(_key(user_id))
+        if data is None:
+            return  # loaded from the database on the next read
+        ids = set(_unpack(data))
+        change(ids)
+        cache.set(_key(user_id), _pack(ids), _ttl())
+
+    transaction.on_commit(apply)
+
+
+def add_following(user_id, followed_id):
+    """Record that `user_id` followed `followed_id`, once the transaction commits."""
+    _update(user_id, lambda ids: ids.add(followed_id))
+
+
+def remove_following(user_id, followed_id):
+    """Record that `user_id` unfollowed `followed_id`, once the transaction commits."""
+    _update(user_id, lambda ids: ids.discard(followed_id))
+
+
+def invalidate(user_ids):
+    cache = _cache()
+    keys = [_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # Also after commit, so a read in between cannot re-cache the old set.
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(m2m_changed, sender=Follow)
+def _invalidate_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # `x.followers.<op>(...)` changes the following sets of the users in
+    # pk_set; `x.following.<op>(...)` (reverse) changes x's own.
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        invalidate([instance.pk])
+    elif action == 'pre_clear':
+        invalidate(list(instance.followers.values_list('id', flat=True)))
+    else:
+        invalidate(pk_set)
@@ -0,0 +1,57 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import os
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from accounts.suggestions import recompute
+
+User = get_user_model()
+
+
+def _chunks(ids, size):
+    iterator = iter(ids)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _init_worker():
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = "Rebuild the \"who to follow\" suggestion table from the follow graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_ids', nargs='*', type=int,
+            help="Only recompute suggestions for these user IDs (default: all users).",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Number of users recomputed per aggregate query.",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help="Size of the process pool; 1 runs in this process.",
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id').values_list('id', flat=True)
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+        user_ids = list(users)
+        chunks = _chunks(user_ids, options['chunk_size'])
+
+        if options['workers'] <= 1:
+            written = sum(recompute(chunk) for chunk in chunks)
+        else:
+            # Workers open their own connections; don't let them inherit ours.
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                written = sum(pool.map(recompute, chunks))
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} suggestion(s) for {len(user_ids)} user(s)."))
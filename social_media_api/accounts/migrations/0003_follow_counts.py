@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:44
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    Follow = CustomUser.followers.through
+
+    def count_by(column):
+        rows = Follow.objects.filter(**{column: OuterRef('pk')}).order_by().values(column).annotate(n=Count('*')).values('n')
+        return Coalesce(Subquery(rows), 0)
+
+    CustomUser.objects.update(
+        followers_count=count_by('from_customuser'),
+        following_count=count_by('to_customuser'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_customuser_managers'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['date_joined', 'id'], name='accounts_user_joined_id'),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
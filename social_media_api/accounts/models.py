@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
+from django.db.models import F
 
 
 class CustomUserManager(BaseUserManager):
@@ -34,8 +35,71 @@ class CustomUser(AbstractUser):
     bio = models.TextField(blank=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
     followers = models.ManyToManyField('self', symmetrical=False, related_name='following', blank=True)
+    # Denormalized sizes of the follow graph, kept in step by the follow and
+    # unfollow views (see adjust_follow_counts).
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    following_count = models.PositiveIntegerField(default=0, editable=False)
 
     objects = CustomUserManager()  # 👈 Important for checker and user creation
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Keyset pagination of user lists (see posts.pagination).
+            models.Index(fields=['date_joined', 'id'], name='accounts_user_joined_id'),
+        ]
+
     def __str__(self):
         return self.username
+
+    @classmethod
+    def adjust_follow_counts(cls, follower_id, followed_id, delta):
+        """
+        Atomically add `delta` to the follower's following_count and the
+        followed user's followers_count after a follow (1) or unfollow (-1).
+        """
+        cls.objects.filter(pk=followed_id).update(followers_count=F('followers_count') + delta)
+        cls.objects.filter(pk=follower_id).update(following_count=F('following_count') + delta)
+
+
+# Rows of the follow graph: from_customuser is followed by to_customuser.
+Follow = CustomUser.followers.through
+
+
+class FollowSuggestion(models.Model):
+    """
+    A "who to follow" candidate: `candidate` is followed by `score` of the
+    users `user` follows, and not yet followed by `user` (see accounts.suggestions).
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='follow_suggestions')
+    candidate = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'candidate'], name='accounts_suggestion_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score', 'candidate'], name='accounts_suggestion_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate} for {self.user} ({self.score})"
+
+
+class RefreshToken(models.Model):
+    """
+    Server-side record of a refresh token for signed access tokens (see
+    accounts.tokens). Only a SHA-256 hash of the token is stored. Each
+    refresh replaces the token with a new one of the same `family`;
+    presenting a token that was already used revokes the whole family.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='refresh_tokens')
+    token_hash = models.CharField(max_length=64, unique=True)
+    family = models.UUIDField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    used_at = models.DateTimeField(null=True, blank=True)
+    revoked = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Refresh token {self.pk} for {self.user}"
@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.password_validation import validate_password
 
+from social_media_api.fieldsets import SparseFieldsetSerializerMixin
+
 User = get_user_model()
 
 
@@ -32,12 +34,35 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'username')
+
+
+class UserSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    """
+    `?expand=followers` adds the most recently joined followers, prefetched
+    into `expanded_followers` by UserListView.
+    """
+    expandable_fields = {'followers': (UserSummarySerializer, {'source': 'expanded_followers', 'many': True})}
+
     class Meta:
         model = User
-        fields = ('id', 'username', 'email', 'bio', 'profile_picture', 'followers')
+        fields = ('id', 'username', 'email', 'bio', 'profile_picture', 'followers_count', 'following_count')
+
+
+class FollowSuggestionSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='candidate.id')
+    username = serializers.CharField(source='candidate.username')
+    profile_picture = serializers.ImageField(source='candidate.profile_picture')
+    mutual_count = serializers.IntegerField(source='score')
 
 
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField(write_only=True)
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
@@ -0,0 +1,254 @@
+"""
+"Who to follow" suggestions.
+
+FollowSuggestion holds, for every user, the second-degree connections they
+do not follow yet, scored by the number of people they follow who follow
+the candidate (the mutual count). Serving suggestions is then one range
+scan on the (user, -score, candidate) index.
+
+The table is kept current incrementally: record_follow() and
+record_unfollow() adjust only the scores that the changed edge contributes
+to. The follow views do not call them in the request: schedule_follow()
+and schedule_unfollow() hand the update, once the request's transaction
+commits, to a background thread that applies updates one at a time in the
+order they were scheduled (or run it right after the commit when
+ACCOUNTS_SUGGESTIONS_BACKGROUND is off, as in tests). Updates still queued
+when a process crashes are lost, and updates scheduled by different
+processes may be applied out of order; both only leave stale scores until
+the next rebuild below. Users with more than
+ACCOUNTS_SUGGESTIONS_FANOUT_LIMIT followers (or followings) are skipped by
+the incremental path, like high-follower authors in the hybrid timeline;
+`manage.py recompute_follow_suggestions` rebuilds everything from the
+follow graph and repairs that and any other drift.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import Count, F
+
+from .models import Follow, FollowSuggestion
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FANOUT_LIMIT = 10000
+BATCH_SIZE = 1000
+
+
+def _fanout_limit():
+    return getattr(settings, 'ACCOUNTS_SUGGESTIONS_FANOUT_LIMIT', DEFAULT_FANOUT_LIMIT)
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _following_ids(user_id, limit=None):
+    ids = Follow.objects.filter(to_customuser_id=user_id).values_list('from_customuser_id', flat=True)
+    return list(ids if limit is None else ids[:limit])
+
+
+def _follower_ids(user_id, limit=None):
+    ids = Follow.objects.filter(from_customuser_id=user_id).values_list('to_customuser_id', flat=True)
+    return list(ids if limit is None else ids[:limit])
+
+
+def _bounded(ids):
+    """Return `ids` unless it was cut off by the fan-out limit."""
+    return ids if len(ids) <= _fanout_limit() else []
+
+
+def _adjust(user_ids, candidate_ids, delta):
+    """
+    Add `delta` to the score of every (user, candidate) pair. One of the
+    two ID lists is expected to hold a single ID.
+    """
+    for users in _batched(user_ids, BATCH_SIZE):
+        for candidates in _batched(candidate_ids, BATCH_SIZE):
+            rows = FollowSuggestion.objects.filter(user_id__in=users, candidate_id__in=candidates)
+            existing = set(rows.values_list('user_id', 'candidate_id'))
+            rows.update(score=F('score') + delta)
+            if delta > 0:
+                FollowSuggestion.objects.bulk_create(
+                    [
+                        FollowSuggestion(user_id=user_id, candidate_id=candidate_id, score=delta)
+                        for user_id in users for candidate_id in candidates
+                        if (user_id, candidate_id) not in existing
+                    ],
+                    ignore_conflicts=True,
+                )
+            else:
+                rows.filter(score__lte=0).delete()
+
+
+def _affected(user_id, followed_id):
+    """
+    Return who gains or loses a path through the edge user -> followed:
+    the followed user's followings (new candidates for `user_id`) and
+    `user_id`'s followers (for whom `followed_id` is a candidate).
+    """
+    following = set(_following_ids(user_id))
+    limit = _fanout_limit() + 1
+    candidates = [
+        candidate_id for candidate_id in _bounded(_following_ids(followed_id, limit))
+        if candidate_id != user_id and candidate_id not in following
+    ]
+    followers = _bounded(_follower_ids(user_id, limit))
+    already = set(
+        Follow.objects.filter(from_customuser_id=followed_id, to_customuser_id__in=followers)
+        .values_list('to_customuser_id', flat=True)
+    ) if followers else set()
+    users = [follower_id for follower_id in followers if follower_id != followed_id and follower_id not in already]
+    return following, candidates, users
+
+
+@transaction.atomic
+def record_follow(user_id, followed_id):
+    """Update suggestions after `user_id` started following `followed_id`."""
+    _, candidates, users = _affected(user_id, followed_id)
+    FollowSuggestion.objects.filter(user_id=user_id, candidate_id=followed_id).delete()
+    _adjust([user_id], candidates, 1)
+    _adjust(users, [followed_id], 1)
+
+
+@transaction.atomic
+def record_unfollow(user_id, followed_id):
+    """Update suggestions after `user_id` stopped following `followed_id`."""
+    following, candidates, users = _affected(user_id, followed_id)
+    _adjust([user_id], candidates, -1)
+    _adjust(users, [followed_id], -1)
+    # The unfollowed user is a candidate again if friends still follow them.
+    score = Follow.objects.filter(from_customuser_id=followed_id, to_customuser_id__in=following).count()
+    if score:
+        FollowSuggestion.objects.update_or_create(
+            user_id=user_id, candidate_id=followed_id, defaults={'score': score},
+        )
+
+
+class _UpdateWorker:
+    """
+    Daemon thread applying scheduled suggestion updates in FIFO order. An
+    update failing with OperationalError (a locked database) is retried
+    `max_attempts` times, `retry_delay` seconds apart, doubling each time.
+    """
+    max_attempts = 5
+    retry_delay = 0.05
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush, timeout=5)
+
+    def put(self, func, *args):
+        self._ensure_worker()
+        self._queue.put((func, args))
+
+    def flush(self, timeout=None):
+        """Block until every update put so far has been applied."""
+        with self._queue.all_tasks_done:
+            if self._queue.unfinished_tasks:
+                self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+            return not self._queue.unfinished_tasks
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(); see notifications.queue.
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='follow-suggestions', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                self._apply(func, args)
+            finally:
+                self._queue.task_done()
+
+    def _apply(self, func, args):
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                func(*args)
+                return
+            except OperationalError:
+                if attempt == self.max_attempts:
+                    logger.exception(
+                        "Failed to apply %s%r after %d attempts; recompute_follow_suggestions will repair it",
+                        func.__name__, args, attempt,
+                    )
+                    return
+                time.sleep(delay)
+                delay *= 2
+            except Exception:
+                logger.exception("Failed to apply %s%r", func.__name__, args)
+                return
+            finally:
+                close_old_connections()
+
+
+_worker = _UpdateWorker()
+
+
+def _schedule(func, *args):
+    if getattr(settings, 'ACCOUNTS_SUGGESTIONS_BACKGROUND', True):
+        transaction.on_commit(lambda: _worker.put(func, *args))
+    else:
+        transaction.on_commit(lambda: func(*args))
+
+
+def schedule_follow(user_id, followed_id):
+    """Run record_follow() off the request, after the current transaction commits."""
+    _schedule(record_follow, user_id, followed_id)
+
+
+def schedule_unfollow(user_id, followed_id):
+    """Run record_unfollow() off the request, after the current transaction commits."""
+    _schedule(record_unfollow, user_id, followed_id)
+
+
+def flush(timeout=None):
+    """Block until the scheduled background updates have been applied."""
+    return _worker.flush(timeout)
+
+
+def recompute(user_ids):
+    """
+    Rebuild the suggestions of `user_ids` from the follow graph with one
+    aggregate query. Returns the number of rows written.
+    """
+    user_ids = list(user_ids)
+    following = defaultdict(set)
+    for user_id, followed_id in Follow.objects.filter(to_customuser_id__in=user_ids).values_list(
+        'to_customuser_id', 'from_customuser_id',
+    ):
+        following[user_id].add(followed_id)
+
+    # Second hop: `user` follows m (first join) and m follows `candidate`.
+    paths = (
+        Follow.objects.filter(to_customuser__followers__in=user_ids)
+        .values('to_customuser__followers', 'from_customuser')
+        .annotate(score=Count('*'))
+        .values_list('to_customuser__followers', 'from_customuser', 'score')
+    )
+    rows = [
+        FollowSuggestion(user_id=user_id, candidate_id=candidate_id, score=score)
+        for user_id, candidate_id, score in paths.iterator()
+        if candidate_id != user_id and candidate_id not in following[user_id]
+    ]
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FollowSuggestion.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
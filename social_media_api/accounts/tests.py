@@ -1,3 +1,489 @@
-from django.test import TestCase
+import random
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APITestCase
+
+from notifications.models import Notification
+from posts.synthetic import recount_follows
+from posts.timeline import get_timeline_backend
+from social_media_api.testing import QueryBudgetTestMixin
+from . import authentication, follow_cache, suggestions
+from .authentication import SignedTokenAuthentication
+from .models import FollowSuggestion
+
+User = get_user_model()
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    ACCOUNTS_SUGGESTIONS_BACKGROUND=False,
+)
+class FollowGraphTests(APITestCase):
+    """
+    Tests for the follower counters and the paginated follow lists.
+    """
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123')
+        self.bob = User.objects.create_user(username='bob', password='password123')
+        self.client.force_authenticate(self.alice)
+
+    def test_counters_only_move_when_the_graph_changes(self):
+        for _ in range(2):
+            self.client.post(reverse('follow', args=[self.bob.id]))
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.following_count, self.bob.followers_count), (1, 1))
+
+        for _ in range(2):
+            self.client.post(reverse('unfollow', args=[self.bob.id]))
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.following_count, self.bob.followers_count), (0, 0))
+
+    def test_following_again_is_a_no_op(self):
+        statuses = []
+        with mock.patch('accounts.views.get_timeline_backend', wraps=get_timeline_backend) as backend:
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    statuses.append(self.client.post(reverse('follow', args=[self.bob.id])).status_code)
+        self.assertEqual(statuses, [201, 200])
+        self.assertEqual(backend.call_count, 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.bob).count(), 1)
+
+    def test_profile_exposes_counts_not_ids(self):
+        self.client.post(reverse('follow', args=[self.bob.id]))
+        self.alice.refresh_from_db()
+        data = self.client.get(reverse('profile')).data
+        self.assertNotIn('followers', data)
+        self.assertEqual((data['followers_count'], data['following_count']), (0, 1))
+
+    def test_followers_and_following_are_cursor_paginated(self):
+        fans = [User.objects.create_user(username=f'fan{i}') for i in range(5)]
+        self.bob.followers.add(*fans)
+        self.alice.following.add(*fans[:2])
+
+        url = reverse('user-followers', args=[self.bob.id]) + '?page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen.extend(user['username'] for user in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [fan.username for fan in reversed(fans)])
+
+        response = self.client.get(reverse('user-following', args=[self.alice.id]))
+        self.assertEqual([user['username'] for user in response.data['results']], ['fan1', 'fan0'])
+
+        response = self.client.get(reverse('user-followers', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_user_list_is_keyset_paginated(self):
+        for i in range(3):
+            User.objects.create_user(username=f'user{i}')
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-list'), {'page_size': 3})
+        self.assertEqual(
+            [user['username'] for user in response.data['results']],
+            ['alice', 'bob', 'user0'],
+        )
+        response = self.client.get(response.data['next'])
+        self.assertEqual([user['username'] for user in response.data['results']], ['user1', 'user2'])
+        self.assertIsNone(response.data['next'])
+
+    def test_user_list_fields_and_expand(self):
+        fans = [User.objects.create_user(username=f'fan{i}') for i in range(3)]
+        self.bob.followers.add(*fans)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user-list'), {'fields': 'username,id', 'page_size': 2})
+        self.assertEqual(response.data['results'], [
+            {'id': self.alice.id, 'username': 'alice'}, {'id': self.bob.id, 'username': 'bob'},
+        ])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('password', queries[0]['sql'])
+        self.assertNotIn('"bio"', queries[0]['sql'])
+        self.assertEqual(self.client.get(response.data['next']).data['results'][0], {
+            'id': fans[0].id, 'username': 'fan0',
+        })
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('user-list'), {'fields': 'username', 'expand': 'followers'})
+        bob = response.data['results'][1]
+        self.assertEqual(bob['username'], 'bob')
+        self.assertEqual([user['username'] for user in bob['followers']], ['fan2', 'fan1', 'fan0'])
+        self.assertEqual(response.data['results'][0], {'username': 'alice', 'followers': []})
+
+        response = self.client.get(reverse('user-list'), {'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    ACCOUNTS_SUGGESTIONS_BACKGROUND=False,
+)
+class FollowCacheTests(APITestCase):
+    """
+    Tests for the cached follow graph.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='password123')
+        self.others = [User.objects.create_user(username=f'user{i}') for i in range(4)]
+        self.client.force_authenticate(self.alice)
+
+    def follow(self, user, url_name='follow'):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse(url_name, args=[user.id]))
+
+    def test_follow_and_unfollow_write_through(self):
+        self.follow(self.others[0])
+        self.assertEqual(follow_cache.get_following_ids(self.alice.id), {self.others[0].id})
+
+        self.follow(self.others[1])
+        self.follow(self.others[0], 'unfollow')
+        candidate_ids = [user.id for user in self.others]
+        with self.assertNumQueries(0):
+            self.assertEqual(follow_cache.following_among(self.alice.id, candidate_ids), {self.others[1].id})
+            self.assertTrue(follow_cache.is_following(self.alice.id, self.others[1].id))
+            self.assertFalse(follow_cache.is_following(self.alice.id, self.others[0].id))
+
+    def test_ttl_is_short_without_a_shared_cache(self):
+        self.assertEqual(follow_cache._ttl(), 5)
+        with mock.patch('social_media_api.caches.is_shared', return_value=True):
+            self.assertEqual(follow_cache._ttl(), 3600)
+
+    def test_direct_graph_changes_invalidate(self):
+        follow_cache.get_following_ids(self.alice.id)
+        self.alice.following.add(self.others[2])
+        self.assertTrue(follow_cache.is_following(self.alice.id, self.others[2].id))
+
+        self.others[2].followers.clear()
+        self.assertFalse(follow_cache.is_following(self.alice.id, self.others[2].id))
+
+    def test_feed_does_not_read_the_follow_table(self):
+        self.follow(self.others[0])
+        self.client.get(reverse('feed'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('feed'))
+        self.assertFalse([q['sql'] for q in queries if 'accounts_customuser_followers' in q['sql']])
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    ACCOUNTS_SUGGESTIONS_BACKGROUND=False,
+)
+class FollowSuggestionTests(APITestCase):
+    """
+    Tests for the incrementally maintained "who to follow" table.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'user{i}') for i in range(8)]
+
+    def toggle(self, user, other, url_name):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse(url_name, args=[other.id]))
+
+    def table(self):
+        return set(FollowSuggestion.objects.values_list('user_id', 'candidate_id', 'score'))
+
+    def test_incremental_updates_match_full_recompute(self):
+        rng = random.Random(1)
+        for _ in range(80):
+            user, other = rng.sample(self.users, 2)
+            self.toggle(user, other, rng.choice(['follow', 'follow', 'unfollow']))
+
+            incremental = self.table()
+            call_command('recompute_follow_suggestions', workers=1, chunk_size=3, stdout=StringIO())
+            self.assertEqual(incremental, self.table())
+
+    def test_suggestions_endpoint(self):
+        alice, bob, carol, dave, erin = self.users[:5]
+        for friend in (bob, carol):
+            self.toggle(alice, friend, 'follow')
+        self.toggle(bob, dave, 'follow')
+        self.toggle(carol, dave, 'follow')
+        self.toggle(carol, erin, 'follow')
+        self.toggle(carol, alice, 'follow')
+
+        self.client.force_authenticate(alice)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('follow-suggestions'))
+        self.assertEqual(
+            [(item['username'], item['mutual_count']) for item in response.data],
+            [('user3', 2), ('user4', 1)],
+        )
+
+        self.toggle(alice, dave, 'follow')
+        self.client.force_authenticate(alice)
+        response = self.client.get(reverse('follow-suggestions'), {'limit': 5})
+        self.assertEqual([item['username'] for item in response.data], ['user4'])
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    ACCOUNTS_SUGGESTIONS_BACKGROUND=True,
+)
+class FollowSuggestionWorkerTests(TransactionTestCase):
+    """
+    The background worker applies follow/unfollow updates after the request.
+    """
+    client_class = APIClient
+
+    def test_worker_applies_updates_in_order(self):
+        cache.clear()
+        alice, bob, carol = (User.objects.create_user(username=name) for name in ('alice', 'bob', 'carol'))
+        bob.following.add(carol)
+        self.client.force_authenticate(alice)
+        # The in-memory test database does not wait for locks, so hold the
+        # updates until the requests are done rather than race them.
+        put = suggestions._worker.put
+        with mock.patch.object(suggestions._worker, 'put') as held:
+            for url_name, user in [('follow', bob), ('follow', carol), ('unfollow', carol)]:
+                self.client.post(reverse(url_name, args=[user.id]))
+        self.assertFalse(FollowSuggestion.objects.exists())
+        for call in held.call_args_list:
+            put(*call.args)
+        self.assertTrue(suggestions.flush(timeout=10))
+
+        self.assertEqual(
+            set(FollowSuggestion.objects.values_list('user_id', 'candidate_id', 'score')),
+            {(alice.id, carol.id, 1)},
+        )
+
+
+    def test_locked_database_is_retried(self):
+        alice, bob, carol = (User.objects.create_user(username=name) for name in ('alice', 'bob', 'carol'))
+        alice.following.add(bob)
+        bob.following.add(carol)
+        record_follow = suggestions.record_follow
+        failures = [OperationalError('database is locked')]
+
+        def flaky(*args):
+            if failures:
+                raise failures.pop()
+            return record_follow(*args)
+
+        with mock.patch.object(suggestions._worker, 'retry_delay', 0):
+            suggestions._worker.put(flaky, alice.id, bob.id)
+            self.assertTrue(suggestions.flush(timeout=10))
+        self.assertEqual(
+            set(FollowSuggestion.objects.values_list('user_id', 'candidate_id', 'score')),
+            {(alice.id, carol.id, 1)},
+        )
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CachedTokenAuthenticationTests(APITestCase):
+    """
+    Tests for cached token -> user lookups and their invalidation.
+    """
+
+    def setUp(self):
+        cache.clear()
+        authentication._local.clear()
+        authentication.reset_token_cache_stats()
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = authentication.CachedTokenAuthentication()
+
+    @mock.patch('social_media_api.caches.is_shared', lambda *args: True)
+    def test_repeated_lookups_skip_the_database(self):
+        with self.assertNumQueries(1):
+            user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.token.key)
+
+        authentication._local.clear()  # as in another process
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.token.key)
+
+        stats = authentication.token_cache_stats()
+        self.assertEqual((stats['misses'], stats['local_hits'], stats['shared_hits']), (1, 1, 1))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3)
+
+    def test_process_local_cache_is_not_a_second_tier(self):
+        # Other processes could not see revocations in it, so the lookup is
+        # only cached in the LRU and revocation stays bounded by its TTL.
+        self.auth.authenticate_credentials(self.token.key)
+        self.assertIsNone(cache.get(authentication._cache_key(self.token.key)))
+        authentication._local.clear()
+        with self.assertNumQueries(1):
+            self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(authentication.token_cache_stats()['shared_hits'], 0)
+
+    @mock.patch('social_media_api.caches.is_shared', lambda *args: True)
+    def test_cache_holds_no_credentials(self):
+        self.auth.authenticate_credentials(self.token.key)
+        cached = cache.get(authentication._cache_key(self.token.key))
+        self.assertEqual(cached, (self.user.id, 'alice', False, True))
+
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.get_deferred_fields() & {'password', 'email'}, {'password', 'email'})
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('password123'))
+
+    def test_deleted_or_rotated_token_is_rejected(self):
+        old_key = self.token.key
+        self.auth.authenticate_credentials(old_key)
+        self.token.delete()
+        new_token = Token.objects.create(user=self.user)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(old_key)
+        self.assertEqual(self.auth.authenticate_credentials(new_token.key)[0], self.user)
+
+    def test_deactivated_user_is_rejected(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_requests_use_the_cache_and_admins_see_stats(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('follow-suggestions')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('token-cache-stats')).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get(reverse('token-cache-stats')).data
+        # The save dropped the cached entry, so the last request missed again.
+        self.assertEqual((stats['misses'], stats['local_hits']), (2, 3))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SignedTokenTests(APITestCase):
+    """
+    Tests for stateless access tokens and rotating refresh tokens.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='password123')
+
+    def obtain(self):
+        response = self.client.post(reverse('token-obtain'), {'username': 'alice', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def refresh(self, token):
+        return self.client.post(reverse('token-refresh'), {'refresh': token})
+
+    def test_access_token_is_verified_without_queries(self):
+        tokens = self.obtain()
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        with self.assertNumQueries(0):
+            user, _ = SignedTokenAuthentication().authenticate(request)
+        self.assertEqual((user.pk, user.username), (self.user.pk, 'alice'))
+        self.assertEqual(user.email, '')  # deferred field, loaded on access
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get(reverse('profile')).data['username'], 'alice')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}x")
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+    @override_settings(ACCOUNTS_ACCESS_TOKEN_LIFETIME=-1)
+    def test_expired_access_token_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.obtain()['access']}")
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+    def test_refresh_rotates_and_detects_reuse(self):
+        first = self.obtain()['refresh']
+        response = self.refresh(first)
+        self.assertEqual(response.status_code, 200)
+        second = response.data['refresh']
+
+        # Reusing the retired token revokes the rotated one as well.
+        self.assertEqual(self.refresh(first).status_code, 401)
+        self.assertEqual(self.refresh(second).status_code, 401)
+
+    def test_revoke_and_deactivation(self):
+        refresh = self.obtain()['refresh']
+        self.client.post(reverse('token-revoke'), {'refresh': refresh})
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+        refresh = self.obtain()['refresh']
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+    def test_db_tokens_keep_working(self):
+        token = self.client.post(reverse('login'), {'username': 'alice', 'password': 'password123'}).data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+)
+class AccountsQueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    """
+    Every accounts route stays within the query budget its view declares.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='password123', is_staff=True)
+        self.users = [User.objects.create_user(username=f'user{i}', password='password123') for i in range(4)]
+        # alice follows everyone, and everyone follows user0.
+        for user in self.users:
+            self.alice.following.add(user)
+            if user != self.users[0]:
+                user.following.add(self.users[0])
+        self.users[1].following.add(self.users[2])
+        recount_follows([self.alice, *self.users])
+        suggestions.recompute([self.alice.id, *(user.id for user in self.users)])
+
+    def test_routes_within_budget(self):
+        check = self.assertWithinQueryBudget
+        credentials = {'username': 'alice', 'password': 'password123'}
+        check('post', reverse('register'), {
+            'username': 'carol', 'email': 'carol@example.com',
+            'password': 'Str0ng-passw0rd', 'password2': 'Str0ng-passw0rd',
+        }, status=201)
+        check('post', reverse('login'), credentials, status=200)
+        tokens = check('post', reverse('token-obtain'), credentials, status=200).data
+        tokens = check('post', reverse('token-refresh'), {'refresh': tokens['refresh']}, status=200).data
+        check('post', reverse('token-revoke'), {'refresh': tokens['refresh']}, status=204)
+
+        self.authenticate(self.alice)
+        check('get', reverse('profile'), status=200)
+        check('patch', reverse('profile'), {'bio': 'Hello'}, status=200)
+        check('get', reverse('user-list'), status=200)
+        check('get', reverse('user-followers', args=[self.users[0].id]), status=200)
+        check('get', reverse('user-following', args=[self.alice.id]), status=200)
+        check('get', reverse('token-cache-stats'), status=200)
+
+        self.authenticate(self.users[3])
+        check('get', reverse('follow-suggestions'), status=200)
+        # Suggestion updates are handed to the background worker, not run.
+        with mock.patch.object(suggestions._worker, 'put') as put:
+            check('post', reverse('follow', args=[self.users[2].id]), status=201)
+            check('post', reverse('unfollow', args=[self.users[2].id]), status=200)
+        self.assertEqual(
+            put.call_args_list,
+            [mock.call(suggestions.record_follow, self.users[3].id, self.users[2].id),
+             mock.call(suggestions.record_unfollow, self.users[3].id, self.users[2].id)],
+        )
+        self.assertRoutesBudgeted('accounts.urls')
@@ -0,0 +1,125 @@
+"""
+Stateless signed access tokens with rotating refresh tokens.
+
+An access token is a django.core.signing payload (HMAC-SHA256 with
+SECRET_KEY, timestamped) carrying the user's ID, username and staff flags.
+SignedTokenAuthentication checks it with no database access, so it stays
+valid until it expires (ACCOUNTS_ACCESS_TOKEN_LIFETIME seconds) even if the
+user is deactivated; keep the lifetime short. Rotating SECRET_KEY (with the
+old key in SECRET_KEY_FALLBACKS) works as for any other signed value.
+
+Refresh tokens are random strings stored hashed in RefreshToken and live
+ACCOUNTS_REFRESH_TOKEN_LIFETIME seconds. Each use returns a new pair and
+retires the old refresh token; reusing a retired one (a sign it was
+stolen) revokes its whole family. These endpoints work alongside the
+permanent DB tokens issued by LoginView, so clients can move over one at
+a time.
+"""
+import hashlib
+import secrets
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from .models import RefreshToken
+
+ACCESS_TOKEN_SALT = 'accounts.tokens.access'
+DEFAULT_ACCESS_TOKEN_LIFETIME = 300
+DEFAULT_REFRESH_TOKEN_LIFETIME = 14 * 24 * 3600
+
+# Claims carried by the access token and the user fields they fill in.
+CLAIMS = {'uid': 'id', 'usr': 'username', 'stf': 'is_staff', 'su': 'is_superuser'}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _access_token_lifetime():
+    return getattr(settings, 'ACCOUNTS_ACCESS_TOKEN_LIFETIME', DEFAULT_ACCESS_TOKEN_LIFETIME)
+
+
+def _refresh_token_lifetime():
+    return getattr(settings, 'ACCOUNTS_REFRESH_TOKEN_LIFETIME', DEFAULT_REFRESH_TOKEN_LIFETIME)
+
+
+def _hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_access_token(user):
+    return signing.dumps({claim: getattr(user, field) for claim, field in CLAIMS.items()}, salt=ACCESS_TOKEN_SALT)
+
+
+def verify_access_token(token):
+    """
+    Return the user an access token was issued to, without a query.
+
+    The user is built as a deferred instance holding only the signed
+    claims; any other field is loaded from the database on first access,
+    and save() only writes the loaded fields.
+    """
+    try:
+        claims = signing.loads(token, salt=ACCESS_TOKEN_SALT, max_age=_access_token_lifetime())
+        data = {field: claims[claim] for claim, field in CLAIMS.items()}
+    except (signing.BadSignature, KeyError, TypeError) as exc:
+        raise InvalidToken(str(exc))
+    data['is_active'] = True
+    User = get_user_model()
+    # from_db() expects the values in model field order.
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in data]
+    return User.from_db(DEFAULT_DB_ALIAS, fields, [data[field] for field in fields])
+
+
+def _issue_refresh_token(user, family):
+    token = secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        user=user,
+        token_hash=_hash(token),
+        family=family,
+        expires_at=timezone.now() + timedelta(seconds=_refresh_token_lifetime()),
+    )
+    return token
+
+
+def issue_token_pair(user, family=None):
+    """
+    Return a new access/refresh token pair for `user`.
+    """
+    return {
+        'access': issue_access_token(user),
+        'refresh': _issue_refresh_token(user, family or uuid.uuid4()),
+        'expires_in': _access_token_lifetime(),
+    }
+
+
+def rotate_refresh_token(token):
+    """
+    Exchange a refresh token for a new pair, retiring the old token.
+    """
+    record = RefreshToken.objects.select_related('user').filter(token_hash=_hash(token)).first()
+    if record is None or record.revoked or record.expires_at <= timezone.now() or not record.user.is_active:
+        raise InvalidToken('Refresh token is invalid or expired.')
+
+    # Only one request can retire a token; a second use means it leaked.
+    retired = RefreshToken.objects.filter(pk=record.pk, used_at__isnull=True).update(used_at=timezone.now())
+    if not retired:
+        RefreshToken.objects.filter(family=record.family).update(revoked=True)
+        raise InvalidToken('Refresh token was already used.')
+    return issue_token_pair(record.user, record.family)
+
+
+def revoke_refresh_token(token):
+    """
+    Revoke the family of `token` (logout). Returns False for unknown tokens.
+    """
+    family = RefreshToken.objects.filter(token_hash=_hash(token)).values_list('family', flat=True).first()
+    if family is None:
+        return False
+    RefreshToken.objects.filter(family=family).update(revoked=True)
+    return True
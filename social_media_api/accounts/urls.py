@@ -6,13 +6,27 @@ from .views import (
     FollowUserView,
     UnfollowUserView,
     UserListView,
+    FollowersListView,
+    FollowingListView,
+    FollowSuggestionsView,
+    TokenCacheStatsView,
+    TokenObtainView,
+    TokenRefreshView,
+    TokenRevokeView,
 )
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
+    path('token/', TokenObtainView.as_view(), name='token-obtain'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('token/revoke/', TokenRevokeView.as_view(), name='token-revoke'),
     path('profile/', ProfileView.as_view(), name='profile'),
     path('follow/<int:user_id>/', FollowUserView.as_view(), name='follow'),
     path('unfollow/<int:user_id>/', UnfollowUserView.as_view(), name='unfollow'),
     path('users/', UserListView.as_view(), name='user-list'),
+    path('users/<int:user_id>/followers/', FollowersListView.as_view(), name='user-followers'),
+    path('users/<int:user_id>/following/', FollowingListView.as_view(), name='user-following'),
+    path('suggestions/', FollowSuggestionsView.as_view(), name='follow-suggestions'),
+    path('auth/token-cache/', TokenCacheStatsView.as_view(), name='token-cache-stats'),
 ]
@@ -4,21 +4,35 @@ from django.contrib.auth import authenticate, get_user_model
 from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Prefetch
 import logging
 
-from .serializers import RegisterSerializer, LoginSerializer, UserSerializer
-from .models import CustomUser
+from .authentication import token_cache_stats
+from .serializers import (
+    RegisterSerializer, LoginSerializer, UserSerializer, FollowSuggestionSerializer, RefreshTokenSerializer,
+)
+from .tokens import InvalidToken, issue_token_pair, revoke_refresh_token, rotate_refresh_token
+from . import follow_cache, suggestions
+from .models import CustomUser, Follow, FollowSuggestion
 from notifications.utils import create_notification  # our helper
+from posts.pagination import KeysetCursorPagination
+from posts.timeline import get_timeline_backend
+from social_media_api.fieldsets import SparseFieldsetMixin
+from social_media_api.sql_budget import QueryBudgetMixin
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
-class RegisterView(generics.CreateAPIView):
+class RegisterView(QueryBudgetMixin, generics.CreateAPIView):
     serializer_class = RegisterSerializer
+    query_budget = 3
 
 
-class LoginView(APIView):
+class LoginView(QueryBudgetMixin, APIView):
+    query_budget = 5
+
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -31,70 +45,209 @@ class LoginView(APIView):
         return Response({'error': 'Invalid credentials'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ProfileView(generics.RetrieveUpdateAPIView):
+class TokenObtainView(QueryBudgetMixin, APIView):
+    """
+    Log in for a short-lived signed access token and a refresh token
+    (see accounts.tokens). LoginView keeps issuing permanent DB tokens.
+    """
+    query_budget = 2
+
+    def post(self, request):
+        serializer = LoginSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = authenticate(
+            username=serializer.validated_data['username'],
+            password=serializer.validated_data['password'],
+        )
+        if user is None:
+            return Response({'error': 'Invalid credentials'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(issue_token_pair(user), status=status.HTTP_200_OK)
+
+
+class TokenRefreshView(QueryBudgetMixin, APIView):
+    """
+    Exchange a refresh token for a new access/refresh pair.
+    """
+    query_budget = 3
+
+    def post(self, request):
+        serializer = RefreshTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            tokens = rotate_refresh_token(serializer.validated_data['refresh'])
+        except InvalidToken as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(tokens, status=status.HTTP_200_OK)
+
+
+class TokenRevokeView(QueryBudgetMixin, APIView):
+    """
+    Revoke a refresh token and every token rotated from the same login.
+    """
+    query_budget = 2
+
+    def post(self, request):
+        serializer = RefreshTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        revoke_refresh_token(serializer.validated_data['refresh'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ProfileView(QueryBudgetMixin, generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = UserSerializer
+    query_budget = {'get': 1, 'put': 3, 'patch': 3}
 
     def get_object(self):
-        return self.request.user
+        # request.user may come from the token cache (see
+        # accounts.authentication); reload it for up-to-date counters.
+        return User.objects.get(pk=self.request.user.pk)
 
 
-class FollowUserView(generics.GenericAPIView):
+class FollowUserView(QueryBudgetMixin, generics.GenericAPIView):
     """
-    Follow another user.
+    Follow another user. Answers 201 when the follow is new and 200, without
+    side effects, when it already existed.
     Using generics.GenericAPIView ensures the checker finds the exact class reference.
     """
     permission_classes = [permissions.IsAuthenticated]
     queryset = CustomUser.objects.all()  # required literal for the checker
+    # Includes the timeline backfill and the notification; suggestions are
+    # updated after the response (see accounts.suggestions).
+    query_budget = 19
 
     def post(self, request, user_id):
         target = get_object_or_404(User, pk=user_id)
         if target == request.user:
             return Response({'detail': 'You cannot follow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        request.user.following.add(target)
-
-        # Create notification for the followed user using our helper
-        try:
-            create_notification(
-                recipient=target,
-                actor=request.user,
-                verb='started following you',
-                target=request.user
-            )
-        except Exception as e:
-            logger.error(f"Error creating follow notification: {e}")
+        # Equivalent to request.user.following.add(target), but tells us
+        # whether the edge is new so the counters only move on a change.
+        with transaction.atomic():
+            _, created = Follow.objects.get_or_create(from_customuser=target, to_customuser=request.user)
+            if created:
+                CustomUser.adjust_follow_counts(request.user.pk, target.pk, 1)
+                follow_cache.add_following(request.user.pk, target.pk)
+                suggestions.schedule_follow(request.user.pk, target.pk)
+        if not created:
+            # Like PUT on a like: nothing to backfill and nobody to notify.
+            return Response({'detail': f'You already follow {target.username}.'}, status=status.HTTP_200_OK)
+        get_timeline_backend().follow(request.user, target)
+
+        # Notify the followed user using our helper (queued, see notifications.queue)
+        create_notification(
+            recipient=target,
+            actor=request.user,
+            verb='started following you',
+            target=request.user
+        )
 
         return Response({'detail': f'You are now following {target.username}.'}, status=status.HTTP_201_CREATED)
 
 
-class UnfollowUserView(generics.GenericAPIView):
+class UnfollowUserView(QueryBudgetMixin, generics.GenericAPIView):
     """
     Unfollow another user.
     """
     permission_classes = [permissions.IsAuthenticated]
     queryset = CustomUser.objects.all()  # required literal for the checker
+    query_budget = 7
 
     def post(self, request, user_id):
         target = get_object_or_404(User, pk=user_id)
         if target == request.user:
             return Response({'detail': 'You cannot unfollow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
-        request.user.following.remove(target)
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(from_customuser=target, to_customuser=request.user).delete()
+            if deleted:
+                CustomUser.adjust_follow_counts(request.user.pk, target.pk, -1)
+                follow_cache.remove_following(request.user.pk, target.pk)
+                suggestions.schedule_unfollow(request.user.pk, target.pk)
+        get_timeline_backend().unfollow(request.user, target)
         return Response({'detail': f'Unfollowed user {target.username}.'}, status=status.HTTP_200_OK)
 
 
-class UserListView(generics.GenericAPIView):
+class UserListView(QueryBudgetMixin, SparseFieldsetMixin, generics.ListAPIView):
     """
     Simple users list endpoint using CustomUser.objects.all()
     Ensures checker can find required keywords.
+    Paginated by keyset on (date_joined, id), oldest accounts first.
+    Takes `?fields=` and `?expand=followers` (see social_media_api.fieldsets).
     """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = UserSerializer
+    pagination_class = KeysetCursorPagination
+    cursor_ordering = ('date_joined', 'id')
+    max_expanded_followers = 10
+    # One more query for ?expand=followers.
+    query_budget = 2
 
     def get_queryset(self):
-        return CustomUser.objects.all()
+        queryset = self.trim_queryset(CustomUser.objects.all())
+        if 'followers' in self.get_fieldset()[1]:
+            followers = CustomUser.objects.only('id', 'username').order_by('-date_joined', '-id')
+            queryset = queryset.prefetch_related(Prefetch(
+                'followers', queryset=followers[:self.max_expanded_followers], to_attr='expanded_followers',
+            ))
+        return queryset
+
+
+class FollowersListView(QueryBudgetMixin, generics.ListAPIView):
+    """
+    Users following `user_id`, newest accounts first, cursor-paginated.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = UserSerializer
+    pagination_class = KeysetCursorPagination
+    cursor_ordering = ('-date_joined', '-id')
+    query_budget = 2
+
+    def get_queryset(self):
+        user = get_object_or_404(User, pk=self.kwargs['user_id'])
+        return user.followers.all()
+
+
+class FollowingListView(FollowersListView):
+    """
+    Users that `user_id` follows, newest accounts first, cursor-paginated.
+    """
+
+    def get_queryset(self):
+        user = get_object_or_404(User, pk=self.kwargs['user_id'])
+        return user.following.all()
+
+
+class FollowSuggestionsView(QueryBudgetMixin, generics.ListAPIView):
+    """
+    "Who to follow": users followed by the most people the current user
+    follows, read from the precomputed table (see accounts.suggestions).
+    Returns the top `limit` (default 10, at most 50) without pagination.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = FollowSuggestionSerializer
+    pagination_class = None
+    default_limit = 10
+    max_limit = 50
+    query_budget = 1
+
+    def get_queryset(self):
+        try:
+            limit = min(int(self.request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        return (
+            FollowSuggestion.objects.filter(user=self.request.user)
+            .select_related('candidate')
+            .order_by('-score', 'candidate_id')[:max(limit, 0)]
+        )
+
+
+class TokenCacheStatsView(QueryBudgetMixin, APIView):
+    """
+    Token cache hit/miss counters of the process serving the request.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    query_budget = 0
 
-    def get(self, request, *args, **kwargs):
-        users = self.get_queryset()
-        serializer = self.get_serializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get(self, request):
+        return Response(token_cache_stats(), status=status.HTTP_200_OK)
@@ -0,0 +1,157 @@
+"""
+Grouping of notifications into aggregate rows.
+
+Events with the same (recipient, verb, target) that fall in the same
+aggregation window (NOTIFICATIONS_AGGREGATION_WINDOW seconds, aligned to
+the epoch) are stored as a single unread Notification, so a popular post
+produces "Alice and 41 others liked your post" instead of 42 rows. Once the
+recipient reads an aggregate, the next event opens a new one.
+
+A partial unique constraint guarantees at most one open (unread) aggregate
+per key and window; writers fold new events into it with upsert semantics.
+"""
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import Notification
+from .unread import adjust_unread_count
+
+DEFAULT_AGGREGATION_WINDOW = 3600
+DEFAULT_ACTOR_SAMPLE_SIZE = 3
+
+
+def get_aggregation_window():
+    return getattr(settings, 'NOTIFICATIONS_AGGREGATION_WINDOW', DEFAULT_AGGREGATION_WINDOW)
+
+
+def get_window_start(timestamp, window=None):
+    """
+    Return the start of the aggregation window containing `timestamp`.
+    """
+    window = window or get_aggregation_window()
+    seconds = int(timestamp.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % window, tz=dt_timezone.utc)
+
+
+def merge_actor_sample(sample, actor_ids):
+    """
+    Prepend `actor_ids` (oldest first) to `sample` (newest first), dropping
+    duplicates and keeping at most NOTIFICATIONS_ACTOR_SAMPLE_SIZE IDs.
+    """
+    size = getattr(settings, 'NOTIFICATIONS_ACTOR_SAMPLE_SIZE', DEFAULT_ACTOR_SAMPLE_SIZE)
+    merged = list(dict.fromkeys([*reversed(actor_ids), *sample]))
+    return merged[:size]
+
+
+def _key(recipient_id, verb, target_content_type_id, target_object_id, window_start):
+    return (recipient_id, verb, target_content_type_id, target_object_id, window_start)
+
+
+def _notification_key(notification):
+    return _key(
+        notification.recipient_id, notification.verb, notification.target_content_type_id,
+        notification.target_object_id, notification.window_start,
+    )
+
+
+def _fold(notification, events):
+    """
+    Fold `events` (oldest first) into an existing aggregate in memory.
+
+    Actors already in the sample are not counted again, so a user who
+    likes, unlikes and likes again does not inflate the count; the count is
+    approximate only for repeat actors that have dropped out of the sample.
+    """
+    actor_ids = list(dict.fromkeys(event.actor_id for event in events))
+    notification.actor_count += len(set(actor_ids) - set(notification.actor_sample))
+    notification.actor_sample = merge_actor_sample(notification.actor_sample, actor_ids)
+    notification.actor_id = events[-1].actor_id
+    notification.timestamp = max(notification.timestamp, events[-1].timestamp)
+
+
+def _new(key, events):
+    recipient_id, verb, target_content_type_id, target_object_id, window_start = key
+    actor_ids = list(dict.fromkeys(event.actor_id for event in events))
+    return Notification(
+        recipient_id=recipient_id,
+        actor_id=events[-1].actor_id,
+        verb=verb,
+        target_content_type_id=target_content_type_id,
+        target_object_id=target_object_id,
+        timestamp=events[-1].timestamp,
+        window_start=window_start,
+        actor_count=len(actor_ids),
+        actor_sample=merge_actor_sample([], actor_ids),
+    )
+
+
+def upsert_notifications(events):
+    """
+    Write a batch of NotificationEvents, folding them into open aggregates.
+
+    Existing aggregates for the whole batch are loaded with one query and
+    saved with bulk_update; new ones are inserted with one bulk_create. If
+    a concurrent writer opened one of the same aggregates first, the
+    affected groups are retried one at a time. Every newly opened aggregate
+    bumps its recipient's cached unread count. Returns the written rows.
+    """
+    groups = {}
+    for event in sorted(events, key=lambda event: event.timestamp):
+        key = _key(
+            event.recipient_id, event.verb, event.target_content_type_id,
+            event.target_object_id, get_window_start(event.timestamp),
+        )
+        groups.setdefault(key, []).append(event)
+    if not groups:
+        return []
+
+    with transaction.atomic():
+        open_aggregates = {
+            _notification_key(notification): notification
+            for notification in Notification.objects.select_for_update().filter(
+                recipient_id__in={key[0] for key in groups},
+                window_start__in={key[4] for key in groups},
+                unread=True,
+            )
+        }
+        to_update, to_create = [], []
+        for key, group in groups.items():
+            notification = open_aggregates.get(key)
+            if notification is None:
+                to_create.append(_new(key, group))
+            else:
+                _fold(notification, group)
+                to_update.append(notification)
+
+        Notification.objects.bulk_update(to_update, ['actor', 'actor_count', 'actor_sample', 'timestamp'])
+        try:
+            with transaction.atomic():
+                Notification.objects.bulk_create(to_create)
+            created = to_create
+        except IntegrityError:
+            results = [_upsert_group(_notification_key(n), groups[_notification_key(n)]) for n in to_create]
+            to_create = [notification for notification, _ in results]
+            created = [notification for notification, is_new in results if is_new]
+
+        for recipient_id, count in Counter(n.recipient_id for n in created).items():
+            adjust_unread_count(recipient_id, count)
+    return to_update + to_create
+
+
+def _upsert_group(key, events):
+    recipient_id, verb, target_content_type_id, target_object_id, window_start = key
+    with transaction.atomic():
+        notification = Notification.objects.select_for_update().filter(
+            recipient_id=recipient_id, verb=verb, target_content_type_id=target_content_type_id,
+            target_object_id=target_object_id, window_start=window_start, unread=True,
+        ).first()
+        created = notification is None
+        if created:
+            notification = _new(key, events)
+        else:
+            _fold(notification, events)
+        notification.save()
+    return notification, created
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.queue import BATCH_SIZE, OutboxQueueBackend
+
+
+class Command(BaseCommand):
+    help = "Deliver pending NotificationOutbox rows as notifications, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Keep polling the outbox instead of exiting once it is empty.",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help="Seconds to sleep between polls when --loop is set.",
+        )
+
+    def handle(self, *args, **options):
+        backend = OutboxQueueBackend()
+        delivered = 0
+        while True:
+            count = backend.drain(options['batch_size'])
+            delivered += count
+            if count:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Delivered {delivered} notification(s)."))
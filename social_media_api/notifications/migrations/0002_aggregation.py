@@ -0,0 +1,76 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:37
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def aggregate_existing(apps, schema_editor):
+    """
+    Give existing rows a window and an actor sample, then fold unread rows
+    that share (recipient, verb, target, window) into the most recent one.
+    """
+    Notification = apps.get_model('notifications', 'Notification')
+    window = getattr(settings, 'NOTIFICATIONS_AGGREGATION_WINDOW', 3600)
+    sample_size = getattr(settings, 'NOTIFICATIONS_ACTOR_SAMPLE_SIZE', 3)
+
+    heads, actors, to_update, to_delete = {}, {}, [], []
+    for notification in Notification.objects.order_by('-timestamp', '-id').iterator():
+        seconds = int(notification.timestamp.timestamp())
+        notification.window_start = datetime.fromtimestamp(seconds - seconds % window, tz=timezone.utc)
+        key = (
+            notification.recipient_id, notification.verb, notification.target_content_type_id,
+            notification.target_object_id, notification.window_start,
+        )
+        head = heads.get(key) if notification.unread else None
+        if head is None:
+            notification.actor_sample = [notification.actor_id]
+            notification.actor_count = 1
+            to_update.append(notification)
+            if notification.unread:
+                heads[key] = notification
+                actors[key] = {notification.actor_id}
+            continue
+        if notification.actor_id not in actors[key]:
+            actors[key].add(notification.actor_id)
+            head.actor_count += 1
+            if len(head.actor_sample) < sample_size:
+                head.actor_sample.append(notification.actor_id)
+        to_delete.append(notification.id)
+
+    Notification.objects.bulk_update(to_update, ['window_start', 'actor_sample', 'actor_count'], batch_size=1000)
+    for start in range(0, len(to_delete), 1000):
+        Notification.objects.filter(id__in=to_delete[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('notifications', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='actor_sample',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='window_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(aggregate_existing, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('unread', True)), fields=('recipient', 'verb', 'target_content_type', 'target_object_id', 'window_start'), name='notifications_one_open_aggregate'),
+        ),
+    ]
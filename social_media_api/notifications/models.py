@@ -2,6 +2,7 @@ from django.db import models
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
 
 class Notification(models.Model):
@@ -21,10 +22,52 @@ class Notification(models.Model):
     target_object_id = models.PositiveIntegerField(null=True, blank=True)
     target = GenericForeignKey('target_content_type', 'target_object_id')
     unread = models.BooleanField(default=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set from the queued event rather than auto_now_add, so notifications
+    # written later by the queue worker keep the time the action happened.
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Aggregation (see notifications/aggregation.py): `actor` is the most
+    # recent actor, `actor_count` how many actors were folded into this row
+    # and `actor_sample` the IDs of the most recent few, newest first.
+    actor_count = models.PositiveIntegerField(default=1)
+    actor_sample = models.JSONField(default=list, blank=True)
+    window_start = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ('-timestamp',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'verb', 'target_content_type', 'target_object_id', 'window_start'],
+                condition=models.Q(unread=True),
+                name='notifications_one_open_aggregate',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipient', '-timestamp'],
+                condition=models.Q(unread=True),
+                name='notifications_unread_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'Notification for {self.recipient}: {self.actor} {self.verb} {self.target}'
+
+
+class NotificationOutbox(models.Model):
+    """
+    A pending notification written by OutboxQueueBackend in the same
+    transaction as the action that caused it. Rows are turned into
+    Notification rows and deleted by `manage.py drain_notification_outbox`.
+    """
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    verb = models.CharField(max_length=255)
+    target_content_type = models.ForeignKey(ContentType, null=True, blank=True, on_delete=models.CASCADE)
+    target_object_id = models.PositiveIntegerField(null=True, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return f'Pending notification for {self.recipient_id}: {self.verb}'
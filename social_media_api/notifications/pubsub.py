@@ -0,0 +1,101 @@
+"""
+Publish/subscribe channel that feeds the notification event stream.
+
+The default InProcessBroker only reaches subscribers connected to the same
+process, which is enough for a single ASGI worker (the Procfile's default
+WEB_CONCURRENCY). A broker backed by
+Redis or similar can be plugged in later through the NOTIFICATIONS_BROKER
+setting, as long as it implements publish(), subscribe() and
+unsubscribe(). Brokers keep no history: reconnecting streams replay what
+they missed from the database (see notifications.streams).
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_BROKER = 'notifications.pubsub.InProcessBroker'
+
+_broker = None
+
+
+def get_broker():
+    """
+    Return the configured broker instance (shared by the whole process).
+    """
+    global _broker
+    if _broker is None:
+        path = getattr(settings, 'NOTIFICATIONS_BROKER', DEFAULT_BROKER)
+        _broker = import_string(path)()
+    return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'NOTIFICATIONS_BROKER':
+        _broker = None
+
+
+@dataclass(frozen=True)
+class Message:
+    # The Notification's primary key.
+    id: int
+    data: dict
+
+
+class Subscription:
+    """
+    A single stream's mailbox: an asyncio.Queue bound to the event loop
+    that created it.
+    """
+    __slots__ = ('user_id', 'queue', 'loop')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """
+    Fan messages out to the subscriptions of one user in this process.
+
+    publish() is thread-safe: it is called from the notification queue
+    worker thread and hands messages to each subscriber's event loop with
+    call_soon_threadsafe(). Only users with an open stream are tracked.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, user_id, message_id, data):
+        message = Message(message_id, data)
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, message)
+        return message
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
@@ -0,0 +1,284 @@
+"""
+Notification delivery queue.
+
+create_notification() does not write to the Notification table inside the
+request any more. It turns the call into a NotificationEvent and hands it
+to the backend named by the NOTIFICATIONS_QUEUE_BACKEND setting:
+
+* InProcessQueueBackend (default): once the request's transaction commits,
+  the event is put on an in-memory queue that a background thread drains,
+  writing notifications in batches. Batches failing with OperationalError
+  (e.g. a locked SQLite database) are retried with backoff; events that
+  still cannot be written are moved to the outbox below.
+* OutboxQueueBackend: the event is stored as a NotificationOutbox row in
+  the same transaction as the action that caused it, so it survives a
+  crash; `manage.py drain_notification_outbox` delivers the rows.
+* ImmediateQueueBackend: writes synchronously, mainly for tests.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import setting_changed
+from django.db import OperationalError, close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .aggregation import upsert_notifications
+from .models import NotificationOutbox
+from .pubsub import get_broker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_BACKEND = 'notifications.queue.InProcessQueueBackend'
+BATCH_SIZE = 500
+
+_backend = None
+
+
+@dataclass(frozen=True)
+class NotificationEvent:
+    recipient_id: int
+    actor_id: int
+    verb: str
+    target_content_type_id: int | None = None
+    target_object_id: int | None = None
+    timestamp: datetime = field(default_factory=timezone.now)
+
+
+def write_notifications(events):
+    """
+    Persist a batch of events, folding them into aggregate Notification
+    rows (see notifications.aggregation), and publish the written rows to
+    connected event streams once committed.
+    """
+    notifications = upsert_notifications(events)
+    transaction.on_commit(lambda: publish_notifications(notifications))
+    return notifications
+
+
+def stream_payload(notification):
+    """Return the data of `notification`'s event on the notification stream."""
+    target = None
+    if notification.target_content_type_id is not None:
+        target = {
+            'object_id': notification.target_object_id,
+            'model': ContentType.objects.get_for_id(notification.target_content_type_id).model,
+        }
+    return {
+        'id': notification.id,
+        'actor_id': notification.actor_id,
+        'actor_count': notification.actor_count,
+        'verb': notification.verb,
+        'target': target,
+        'timestamp': notification.timestamp.isoformat(),
+    }
+
+
+def publish_notifications(notifications):
+    broker = get_broker()
+    for notification in notifications:
+        try:
+            broker.publish(notification.recipient_id, notification.id, stream_payload(notification))
+        except Exception:
+            logger.exception("Failed to publish notification %s", notification.id)
+
+
+def get_queue_backend():
+    """
+    Return the configured queue backend instance (cached per process).
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'NOTIFICATIONS_QUEUE_BACKEND', DEFAULT_QUEUE_BACKEND)
+        _backend = import_string(path)()
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'NOTIFICATIONS_QUEUE_BACKEND':
+        _backend = None
+
+
+class BaseQueueBackend:
+    def enqueue(self, event):
+        raise NotImplementedError
+
+    def flush(self, timeout=None):
+        """Block until every event enqueued so far has been written."""
+
+
+class ImmediateQueueBackend(BaseQueueBackend):
+    """
+    Write each notification synchronously, after the surrounding
+    transaction commits.
+    """
+
+    def enqueue(self, event):
+        transaction.on_commit(lambda: write_notifications([event]))
+
+
+class InProcessQueueBackend(BaseQueueBackend):
+    """
+    Buffer events in memory and let a daemon thread write them in batches.
+
+    The worker collects up to `batch_size` events, waiting at most
+    `flush_interval` seconds after the first one, so a burst of likes
+    becomes a handful of INSERT statements. A batch failing with
+    OperationalError is tried `max_attempts` times, `retry_delay` seconds
+    apart, doubling each time. After that, or on any other error, events
+    are written one by one, and the ones that still fail are stored in the
+    outbox for `manage.py drain_notification_outbox`. Events still queued
+    when the process exits normally are flushed by an atexit hook; events
+    lost to a crash are not recovered (use OutboxQueueBackend for that).
+    """
+    batch_size = BATCH_SIZE
+    flush_interval = 0.2
+    max_attempts = 5
+    retry_delay = 0.05
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush, timeout=5)
+
+    def enqueue(self, event):
+        transaction.on_commit(lambda: self._put(event))
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _put(self, event):
+        self._ensure_worker()
+        self._queue.put(event)
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a worker started in a parent
+        # process (e.g. with gunicorn --preload) is restarted in the child.
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name='notification-queue', daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._deliver(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, events, attempts):
+        """Write `events`, retrying on OperationalError; return whether it worked."""
+        delay = self.retry_delay
+        for attempt in range(1, attempts + 1):
+            try:
+                write_notifications(events)
+                return True
+            except OperationalError:
+                if attempt == attempts:
+                    logger.warning("Failed to write %d queued notification(s) after %d attempt(s)", len(events), attempt)
+                    return False
+                time.sleep(delay)
+                delay *= 2
+            except Exception:
+                logger.exception("Failed to write %d queued notification(s)", len(events))
+                return False
+            finally:
+                close_old_connections()
+
+    def _deliver(self, batch):
+        if self._write(batch, self.max_attempts):
+            return
+        # Keep one bad event from holding back the others.
+        for event in batch:
+            if len(batch) > 1 and self._write([event], 1):
+                continue
+            try:
+                store_in_outbox(event)
+            except Exception:
+                logger.exception("Lost queued notification %r", event)
+            finally:
+                close_old_connections()
+
+
+def store_in_outbox(event):
+    NotificationOutbox.objects.create(
+        recipient_id=event.recipient_id,
+        actor_id=event.actor_id,
+        verb=event.verb,
+        target_content_type_id=event.target_content_type_id,
+        target_object_id=event.target_object_id,
+        timestamp=event.timestamp,
+    )
+
+
+class OutboxQueueBackend(BaseQueueBackend):
+    """
+    Store events in the NotificationOutbox table, atomically with the
+    action that caused them.
+    """
+
+    def enqueue(self, event):
+        store_in_outbox(event)
+
+    def drain(self, batch_size=BATCH_SIZE):
+        """
+        Deliver one batch of outbox rows; returns how many were delivered.
+        """
+        with transaction.atomic():
+            rows = list(NotificationOutbox.objects.select_for_update(skip_locked=True)[:batch_size])
+            if not rows:
+                return 0
+            write_notifications(
+                NotificationEvent(
+                    recipient_id=row.recipient_id,
+                    actor_id=row.actor_id,
+                    verb=row.verb,
+                    target_content_type_id=row.target_content_type_id,
+                    target_object_id=row.target_object_id,
+                    timestamp=row.timestamp,
+                )
+                for row in rows
+            )
+            NotificationOutbox.objects.filter(id__in=[row.id for row in rows]).delete()
+        return len(rows)
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.drain():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+        return True
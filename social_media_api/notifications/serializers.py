@@ -1,16 +1,48 @@
+from collections import defaultdict
+
 from rest_framework import serializers
 from .models import Notification
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from social_media_api.compiled import CompiledSerializer, datetime_representation
+
+User = get_user_model()
+
+
+class NotificationListSerializer(serializers.ListSerializer):
+    """
+    Resolves the actor samples of a whole page of notifications with a
+    single query before serializing the items.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        actor_ids = {actor_id for notification in items for actor_id in notification.actor_sample}
+        self.actor_names = dict(User.objects.filter(id__in=actor_ids).values_list('id', 'username'))
+        return super().to_representation(items)
 
 
 class NotificationSerializer(serializers.ModelSerializer):
+    """
+    A notification may aggregate several actors ("Alice and 41 others liked
+    your post"): `actor` is the most recent one, `actor_count` the total and
+    `actors` the usernames of the most recent few.
+    """
     actor = serializers.StringRelatedField()
+    actors = serializers.SerializerMethodField()
     target = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
-        fields = ('id', 'recipient', 'actor', 'verb', 'target', 'unread', 'timestamp')
-        read_only_fields = ('id', 'recipient', 'actor', 'verb', 'target', 'timestamp')
+        fields = ('id', 'recipient', 'actor', 'actor_count', 'actors', 'verb', 'target', 'unread', 'timestamp')
+        read_only_fields = ('id', 'recipient', 'actor', 'actor_count', 'actors', 'verb', 'target', 'timestamp')
+        list_serializer_class = NotificationListSerializer
+
+    def get_actors(self, obj):
+        names = getattr(self.parent, 'actor_names', None)
+        if names is None:
+            names = dict(User.objects.filter(id__in=obj.actor_sample).values_list('id', 'username'))
+        return [names[actor_id] for actor_id in obj.actor_sample if actor_id in names]
 
     def get_target(self, obj):
         if obj.target is None:
@@ -21,3 +53,74 @@ class NotificationSerializer(serializers.ModelSerializer):
             'model': ct.model,
             'repr': str(obj.target)
         }
+
+
+class CompiledNotificationSerializer(CompiledSerializer):
+    """
+    NotificationSerializer for lists, from .values() rows: one query for
+    the actor names of the page and one per target type, using the
+    querysets in `target_querysets` where one matches the target model.
+    """
+    values = (
+        'id', 'recipient_id', 'actor__username', 'actor_count', 'actor_sample', 'verb',
+        'target_content_type_id', 'target_object_id', 'unread', 'timestamp',
+    )
+
+    def __init__(self, context=None, target_querysets=()):
+        super().__init__(context)
+        self.target_querysets = {queryset.model: queryset for queryset in target_querysets}
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        actor_ids = {actor_id for row in rows for actor_id in row['actor_sample']}
+        names = dict(User.objects.filter(id__in=actor_ids).values_list('id', 'username'))
+        targets = self.targets(rows)
+        return [
+            {
+                'id': row['id'],
+                'recipient': row['recipient_id'],
+                'actor': row['actor__username'],
+                'actor_count': row['actor_count'],
+                'actors': [names[actor_id] for actor_id in row['actor_sample'] if actor_id in names],
+                'verb': row['verb'],
+                'target': targets.get((row['target_content_type_id'], row['target_object_id'])),
+                'unread': row['unread'],
+                'timestamp': datetime_representation(row['timestamp']),
+            }
+            for row in rows
+        ]
+
+    def targets(self, rows):
+        """
+        Return {(content_type_id, object_id): target} for the targets that
+        still exist, rendered as NotificationSerializer.get_target() does.
+        """
+        ids_by_type = defaultdict(set)
+        for row in rows:
+            if row['target_content_type_id'] is not None and row['target_object_id'] is not None:
+                ids_by_type[row['target_content_type_id']].add(row['target_object_id'])
+
+        targets = {}
+        for content_type_id, ids in ids_by_type.items():
+            ct = ContentType.objects.get_for_id(content_type_id)
+            model = ct.model_class()
+            if model is None:
+                continue
+            queryset = self.target_querysets.get(model, model._base_manager.all())
+            for obj in queryset.filter(pk__in=ids):
+                targets[content_type_id, obj.pk] = {'object_id': obj.pk, 'model': ct.model, 'repr': str(obj)}
+        return targets
+
+
+class MarkReadSerializer(serializers.Serializer):
+    """
+    Either a list of notification `ids` or a `before` timestamp
+    (every notification up to and including it).
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    before = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('before' in attrs):
+            raise serializers.ValidationError("Provide exactly one of 'ids' or 'before'.")
+        return attrs
@@ -0,0 +1,172 @@
+"""
+Server-Sent Events stream of new notifications.
+
+GET /api/notifications/stream/ keeps the connection open and pushes every
+notification written for the user as an SSE `notification` event, so
+clients no longer need to poll NotificationListView. It is an async view
+and must be served over ASGI (see social_media_api/asgi.py); each open
+stream costs a coroutine and a queue instead of a worker thread.
+
+* Authentication uses the DRF authentication classes. Browsers'
+  EventSource cannot send headers, so `?token=<key>` is accepted too.
+* A comment line is sent every NOTIFICATIONS_STREAM_HEARTBEAT seconds to
+  keep proxies from closing idle connections.
+* Event IDs come from Notification primary keys: each event carries the
+  highest one sent so far, so they stay valid across restarts and
+  workers. Reconnecting clients send Last-Event-ID (or `?last_event_id=`)
+  and get up to NOTIFICATIONS_STREAM_REPLAY_BUFFER notifications created
+  since, read from the database. Aggregates that grew while the client
+  was away are not replayed; NotificationListView shows them.
+* At most NOTIFICATIONS_STREAM_MAX_CONNECTIONS streams are served per
+  process; beyond that the endpoint answers 503 with Retry-After. The slot
+  is taken before the response is returned, so concurrent requests cannot
+  all pass the check.
+"""
+import asyncio
+import json
+import threading
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from social_media_api.sql_budget import query_budget
+
+from .models import Notification
+from .pubsub import Message, get_broker
+from .queue import stream_payload
+
+DEFAULT_HEARTBEAT = 15
+DEFAULT_MAX_CONNECTIONS = 1000
+DEFAULT_REPLAY_BUFFER = 100
+RETRY_AFTER_SECONDS = 5
+
+# Stream slots taken in this process (see _reserve_slot()).
+active_connections = 0
+_connections_lock = threading.Lock()
+
+
+class _StreamSlot:
+    """A slot taken by _reserve_slot(); release() gives it back once."""
+
+    def __init__(self):
+        self.held = True
+
+    def release(self):
+        global active_connections
+        with _connections_lock:
+            if self.held:
+                self.held = False
+                active_connections -= 1
+
+
+def _reserve_slot(max_connections):
+    """Take a stream slot, or return None when all `max_connections` are taken."""
+    global active_connections
+    with _connections_lock:
+        if active_connections >= max_connections:
+            return None
+        active_connections += 1
+    return _StreamSlot()
+
+
+def _authenticate(request):
+    if 'HTTP_AUTHORIZATION' not in request.META and 'token' in request.GET:
+        request.META['HTTP_AUTHORIZATION'] = f"Token {request.GET['token']}"
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+
+def _last_event_id(request):
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format(event_id, message):
+    return f"id: {event_id}\nevent: notification\ndata: {json.dumps(message.data)}\n\n"
+
+
+def _missed(user_id, last_event_id):
+    """
+    Return the Messages of the latest notifications of `user_id` created
+    after `last_event_id`, oldest first.
+    """
+    size = getattr(settings, 'NOTIFICATIONS_STREAM_REPLAY_BUFFER', DEFAULT_REPLAY_BUFFER)
+    notifications = list(Notification.objects.filter(recipient_id=user_id, pk__gt=last_event_id).order_by('-pk')[:size])
+    return [Message(notification.id, stream_payload(notification)) for notification in reversed(notifications)]
+
+
+async def event_stream(user_id, last_event_id=None, heartbeat=None, slot=None):
+    """
+    Yield SSE frames for `user_id` until the client disconnects, then
+    release `slot`.
+    """
+    if heartbeat is None:
+        heartbeat = getattr(settings, 'NOTIFICATIONS_STREAM_HEARTBEAT', DEFAULT_HEARTBEAT)
+    broker = get_broker()
+    # Subscribe before replaying so nothing published in between is lost;
+    # messages already replayed are not sent again.
+    subscription = broker.subscribe(user_id)
+    try:
+        yield f"retry: {RETRY_AFTER_SECONDS * 1000}\n\n"
+        last_sent = last_event_id or 0
+        replayed = set()
+        if last_event_id is not None:
+            for message in await sync_to_async(_missed)(user_id, last_event_id):
+                replayed.add((message.id, json.dumps(message.data)))
+                last_sent = max(last_sent, message.id)
+                yield _format(last_sent, message)
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if (message.id, json.dumps(message.data)) in replayed:
+                continue
+            # Aggregates are published again under their original ID; keep
+            # the highest so a reconnect does not replay what was sent.
+            last_sent = max(last_sent, message.id)
+            yield _format(last_sent, message)
+    finally:
+        broker.unsubscribe(subscription)
+        if slot is not None:
+            slot.release()
+
+
+@query_budget(1)  # authentication
+@require_GET
+async def notification_stream(request):
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    slot = _reserve_slot(getattr(settings, 'NOTIFICATIONS_STREAM_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+    if slot is None:
+        response = JsonResponse({'detail': 'Too many open streams, retry later.'}, status=503)
+        response['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response
+
+    stream = event_stream(user.id, _last_event_id(request), slot=slot)
+    # A stream the client drops before it starts never runs its finally
+    # clause; give the slot back when it is collected instead.
+    weakref.finalize(stream, slot.release)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
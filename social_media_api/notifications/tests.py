@@ -1,3 +1,455 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import tracemalloc
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from posts.models import Comment, Post
+from social_media_api.testing import QueryBudgetTestMixin
+from . import queue, streams as streams_module, unread
+from .models import Notification, NotificationOutbox
+from .pubsub import get_broker
+from .utils import create_notification
+
+User = get_user_model()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, ACCOUNTS_SUGGESTIONS_BACKGROUND=False)
+class NotificationQueueTests(APITestCase):
+    """
+    Tests for the pluggable notification queue backends.
+    """
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123')
+        self.bob = User.objects.create_user(username='bob', password='password123')
+        self.post = Post.objects.create(author=self.alice, title='Post', content='Body')
+        self.client.force_authenticate(self.bob)
+
+    @override_settings(NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend')
+    def test_notification_is_written_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('like-post', args=[self.post.id]))
+            self.assertFalse(Notification.objects.exists())
+
+        notification = Notification.objects.get()
+        self.assertEqual(
+            (notification.recipient, notification.actor, notification.verb, notification.target),
+            (self.alice, self.bob, 'liked your post', self.post),
+        )
+
+    @override_settings(NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.OutboxQueueBackend')
+    def test_outbox_is_drained_by_command(self):
+        self.client.post(reverse('like-post', args=[self.post.id]))
+        self.client.post(reverse('follow', args=[self.alice.id]))
+        self.assertEqual(NotificationOutbox.objects.count(), 2)
+        self.assertFalse(Notification.objects.exists())
+
+        call_command('drain_notification_outbox', stdout=StringIO())
+
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(
+            set(Notification.objects.values_list('verb', flat=True)),
+            {'liked your post', 'started following you'},
+        )
+
+
+@override_settings(NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.InProcessQueueBackend')
+class InProcessQueueTests(TransactionTestCase):
+    """
+    The background worker writes bursts of events in a few batches and
+    does not drop them when a write fails.
+    """
+
+    def test_worker_coalesces_events_into_batches(self):
+        alice = User.objects.create_user(username='alice', password='password123')
+        bob = User.objects.create_user(username='bob', password='password123')
+
+        with mock.patch.object(queue, 'write_notifications', wraps=queue.write_notifications) as write:
+            for i in range(50):
+                create_notification(recipient=alice, actor=bob, verb=f'event {i}')
+            self.assertTrue(queue.get_queue_backend().flush(timeout=10))
+
+        self.assertEqual(Notification.objects.filter(recipient=alice).count(), 50)
+        self.assertLess(write.call_count, 5)
+
+    def test_failed_batches_are_retried_then_kept_in_the_outbox(self):
+        alice = User.objects.create_user(username='alice', password='password123')
+        bob = User.objects.create_user(username='bob', password='password123')
+        backend = queue.get_queue_backend()
+        write = queue.write_notifications
+        failures = [OperationalError('database is locked')]
+
+        def flaky_write(events):
+            if failures:
+                raise failures.pop()
+            return write(events)
+
+        with mock.patch.object(backend, 'retry_delay', 0), \
+                mock.patch.object(queue, 'write_notifications', side_effect=flaky_write):
+            for i in range(3):
+                create_notification(recipient=alice, actor=bob, verb=f'event {i}')
+            self.assertTrue(backend.flush(timeout=10))
+        self.assertEqual(Notification.objects.filter(recipient=alice).count(), 3)
+
+        # Retries exhausted: nothing is lost, the outbox delivers it later.
+        with mock.patch.object(backend, 'retry_delay', 0), \
+                mock.patch.object(queue, 'write_notifications', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('notifications.queue', 'WARNING'):
+                create_notification(recipient=alice, actor=bob, verb='late')
+                self.assertTrue(backend.flush(timeout=10))
+        self.assertEqual(NotificationOutbox.objects.get().verb, 'late')
+        call_command('drain_notification_outbox', stdout=StringIO())
+        self.assertTrue(Notification.objects.filter(verb='late').exists())
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    NOTIFICATIONS_ACTOR_SAMPLE_SIZE=2,
+)
+class NotificationAggregationTests(APITestCase):
+    """
+    Likes on the same post are folded into one aggregate notification.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.post = Post.objects.create(author=self.author, title='Post', content='Body')
+        self.fans = [User.objects.create_user(username=f'fan{i}') for i in range(4)]
+
+    def like(self, user):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('like-post', args=[self.post.id]))
+
+    def test_likes_are_aggregated_per_post(self):
+        for fan in self.fans:
+            self.like(fan)
+
+        self.client.force_authenticate(self.author)
+        response = self.client.get(reverse('notifications-list'))
+        self.assertEqual(response.data['count'], 1)
+        notification = response.data['results'][0]
+        self.assertEqual(notification['actor'], 'fan3')
+        self.assertEqual(notification['actor_count'], 4)
+        self.assertEqual(notification['actors'], ['fan3', 'fan2'])
+
+    def test_reading_an_aggregate_starts_a_new_one(self):
+        self.like(self.fans[0])
+        Notification.objects.update(unread=False)
+        self.like(self.fans[1])
+
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(Notification.objects.get(unread=True).actor_count, 1)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class NotificationListQueryTests(APITestCase):
+    """
+    The notification list costs the same number of queries however full the page is.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.client.force_authenticate(self.user)
+
+    def create_notifications(self, count):
+        for i in range(count):
+            actor = User.objects.create_user(username=f'actor{self.user.notifications.count()}')
+            post = Post.objects.create(author=actor, title=f'Post {i}', content='Body')
+            comment = Comment.objects.create(post=post, author=actor, content='Hi')
+            for verb, target in (('liked', post), ('commented', comment), ('followed', actor)):
+                Notification.objects.create(
+                    recipient=self.user, actor=actor, verb=verb, target=target, actor_sample=[actor.id],
+                )
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('notifications-list'))
+        for item in response.data['results']:
+            self.assertIsNotNone(item['target']['repr'])
+        return len(queries), len(response.data['results'])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        self.create_notifications(1)
+        self.count_queries()  # warm the ContentType cache
+        small, small_page = self.count_queries()
+
+        self.create_notifications(3)
+        large, large_page = self.count_queries()
+
+        self.assertEqual((small_page, large_page), (3, 10))
+        # count, page, actor names, one query per target type
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 6)
+
+    def test_compiled_serializer_matches_drf_serializer(self):
+        self.create_notifications(4)
+        deleted = Post.objects.create(author=self.user, title='Gone', content='Body')
+        Notification.objects.create(recipient=self.user, actor=self.user, verb='liked', target=deleted)
+        deleted.delete()
+        Notification.objects.create(recipient=self.user, actor=self.user, verb='welcome \u2028 \u00e9')
+        actors = list(User.objects.exclude(pk=self.user.pk)[:3])
+        Notification.objects.create(
+            recipient=self.user, actor=actors[0], verb='liked', target=actors[1], actor_count=4,
+            actor_sample=[actors[0].id, 999999, actors[2].id], unread=False,
+        )
+
+        for params in ({}, {'page': 2}):
+            with override_settings(API_COMPILED_SERIALIZERS=False):
+                expected = self.client.get(reverse('notifications-list'), params)
+            with override_settings(API_COMPILED_SERIALIZERS=True):
+                actual = self.client.get(reverse('notifications-list'), params)
+            self.assertEqual(actual.status_code, 200)
+            self.assertEqual(actual.content, expected.content)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+)
+class UnreadCountTests(APITestCase):
+    """
+    Tests for the cached unread counter and bulk mark-read.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.actor = User.objects.create_user(username='bob')
+        self.client.force_authenticate(self.user)
+
+    def notify(self, verb):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notification(recipient=self.user, actor=self.actor, verb=verb)
+
+    def unread_count(self):
+        return self.client.get(reverse('notifications-unread-count')).data['unread_count']
+
+    def test_counter_follows_creation_and_reads(self):
+        self.notify('first')
+        self.assertEqual(self.unread_count(), 1)
+
+        self.notify('second')
+        self.notify('third')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.unread_count(), 3)
+
+        first = Notification.objects.get(verb='first')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('notifications-mark-read', args=[first.id]))
+        self.assertEqual(self.unread_count(), 2)
+
+    def test_write_during_recount_is_not_lost(self):
+        self.notify('first')
+        add = cache.add
+
+        def racing_add(*args, **kwargs):
+            # Committed after the count ran, before it is cached.
+            if not Notification.objects.filter(verb='second').exists():
+                self.notify('second')
+            return add(*args, **kwargs)
+
+        with mock.patch.object(unread.cache, 'add', side_effect=racing_add):
+            self.assertEqual(unread.get_unread_count(self.user.id), 1)
+        self.assertEqual(self.unread_count(), 2)
+        self.notify('third')
+        self.assertEqual(self.unread_count(), 3)
+
+    def test_process_local_cache_keeps_counters_briefly(self):
+        with mock.patch.object(unread.cache, 'add', wraps=cache.add) as add:
+            unread.get_unread_count(self.user.id)
+        self.assertEqual(add.call_args.args[2], 5)
+
+        cache.clear()
+        with mock.patch('social_media_api.caches.is_shared', return_value=True), \
+                mock.patch.object(unread.cache, 'add', wraps=cache.add) as add:
+            unread.get_unread_count(self.user.id)
+        self.assertEqual(add.call_args.args[2], 24 * 3600)
+
+    def test_bulk_mark_read_by_ids_and_timestamp(self):
+        for verb in ('a', 'b', 'c'):
+            self.notify(verb)
+        self.assertEqual(self.unread_count(), 3)
+        url = reverse('notifications-mark-read-bulk')
+
+        ids = list(Notification.objects.filter(verb__in=['a', 'b']).values_list('id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(self.unread_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'before': timezone.now().isoformat()}, format='json')
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(self.unread_count(), 0)
+        self.assertFalse(Notification.objects.filter(unread=True).exists())
+
+    def test_bulk_mark_read_requires_exactly_one_selector(self):
+        response = self.client.post(reverse('notifications-mark-read-bulk'), {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    NOTIFICATIONS_BROKER='notifications.pubsub.InProcessBroker',
+    NOTIFICATIONS_STREAM_HEARTBEAT=60,
+)
+class NotificationStreamTests(TestCase):
+    """
+    Tests for the Server-Sent Events notification stream.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.actor = User.objects.create_user(username='bob')
+        self.token = Token.objects.create(user=self.user)
+
+    def notify(self, verb):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notification(recipient=self.user, actor=self.actor, verb=verb)
+
+    async def open_stream(self, **extra):
+        response = await self.async_client.get(reverse('notifications-stream'), {'token': self.token.key}, **extra)
+        self.assertEqual(response.status_code, 200)
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        return stream
+
+    async def next_event(self, stream):
+        frame = (await asyncio.wait_for(anext(stream), timeout=2)).decode()
+        fields = dict(line.split(': ', 1) for line in frame.strip().split('\n'))
+        return int(fields['id']), json.loads(fields['data'])
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(reverse('notifications-stream'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_pushes_new_notifications_and_resumes(self):
+        stream = await self.open_stream()
+        await sync_to_async(self.notify)('liked your post')
+        event_id, data = await self.next_event(stream)
+        self.assertEqual(data['verb'], 'liked your post')
+        await stream.aclose()
+
+        # Missed while disconnected, replayed on reconnect.
+        await sync_to_async(self.notify)('started following you')
+        stream = await self.open_stream(headers={'Last-Event-ID': str(event_id)})
+        _, data = await self.next_event(stream)
+        self.assertEqual(data['verb'], 'started following you')
+        await stream.aclose()
+
+    async def test_resumes_after_a_restart(self):
+        await sync_to_async(self.notify)('liked your post')
+        await sync_to_async(self.notify)('commented on your post')
+        first, second = await sync_to_async(list)(self.user.notifications.order_by('pk').values_list('pk', flat=True))
+
+        # A new broker, as in a restarted or different worker process.
+        with override_settings(NOTIFICATIONS_BROKER='notifications.pubsub.InProcessBroker'):
+            stream = await self.open_stream(headers={'Last-Event-ID': str(first)})
+            event_id, data = await self.next_event(stream)
+            self.assertEqual((event_id, data['id'], data['verb']), (second, second, 'commented on your post'))
+
+            # A live update of an older aggregate keeps the highest ID.
+            await sync_to_async(self.notify)('liked your post')
+            event_id, data = await self.next_event(stream)
+            self.assertEqual((event_id, data['id'], data['actor_count']), (second, first, 1))
+            await stream.aclose()
+
+    @override_settings(NOTIFICATIONS_STREAM_MAX_CONNECTIONS=2)
+    async def test_connection_cap(self):
+        streams = [await self.open_stream() for _ in range(2)]
+        response = await self.async_client.get(reverse('notifications-stream'), {'token': self.token.key})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        for stream in streams:
+            await stream.aclose()
+        del streams, stream
+        gc.collect()
+        await asyncio.sleep(0.01)
+        self.assertEqual(streams_module.active_connections, 0)
+
+        # Slots are taken when the response is returned, before it streams.
+        pending = [
+            await self.async_client.get(reverse('notifications-stream'), {'token': self.token.key})
+            for _ in range(3)
+        ]
+        self.assertEqual([response.status_code for response in pending], [200, 200, 503])
+        del pending, response
+        gc.collect()
+        self.assertEqual(streams_module.active_connections, 0)
+
+    async def test_memory_per_connection(self):
+        connections = 200
+        broker = get_broker()
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.take_snapshot()
+            streams = [await self.open_stream() for _ in range(connections)]
+            used = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(baseline, 'filename'))
+        finally:
+            tracemalloc.stop()
+
+        per_connection = used / connections
+        self.assertLess(per_connection, 64 * 1024)
+
+        broker.publish(self.user.id, 1, {'verb': 'broadcast'})
+        for stream in streams:
+            _, data = await self.next_event(stream)
+            self.assertEqual(data['verb'], 'broadcast')
+        for stream in streams:
+            await stream.aclose()
+        del streams, stream
+        # Abandoned event_stream generators are finalized by the event loop.
+        gc.collect()
+        await asyncio.sleep(0.01)
+        self.assertEqual(streams_module.active_connections, 0)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, ACCOUNTS_SUGGESTIONS_BACKGROUND=False)
+class NotificationQueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    """
+    Every notifications route stays within the query budget its view declares.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='password123')
+        for i in range(4):
+            actor = User.objects.create_user(username=f'actor{i}')
+            post = Post.objects.create(author=actor, title=f'Post {i}', content='Body')
+            comment = Comment.objects.create(post=post, author=actor, content='Hi')
+            for verb, target in (('liked', post), ('commented', comment), ('followed', actor)):
+                Notification.objects.create(
+                    recipient=self.user, actor=actor, verb=verb, target=target, actor_sample=[actor.id],
+                )
+        self.notification = self.user.notifications.first()
+
+    def test_routes_within_budget(self):
+        check = self.assertWithinQueryBudget
+        check('get', reverse('notifications-stream'), status=401)
+
+        self.authenticate(self.user)
+        check('get', reverse('notifications-list'), status=200)
+        check('get', reverse('notifications-unread-count'), status=200)
+        check('post', reverse('notifications-mark-read', args=[self.notification.id]), status=200)
+        check('post', reverse('notifications-mark-read', args=[self.notification.id]), status=200)
+        check('post', reverse('notifications-mark-read', args=[0]), status=404)
+        check('post', reverse('notifications-mark-read-bulk'), {'ids': [self.notification.id]}, status=200)
+        self.assertRoutesBudgeted('notifications.urls')
@@ -0,0 +1,86 @@
+"""
+Cached per-user unread notification counters.
+
+The count is computed once with an indexed COUNT query and then kept in
+the cache; notification writes and read updates adjust it in place with
+cache.incr/decr. A missing key is simply recomputed on the next read, and
+the NOTIFICATIONS_UNREAD_COUNT_TTL bounds how long any drift can last.
+
+Counters need a shared cache: with a process-local one (the default
+LocMemCache, see social_media_api.caches) each web worker and management
+command adjusts its own copy, so counters are only kept for
+NOTIFICATIONS_UNREAD_COUNT_LOCAL_TTL seconds there.
+
+A count computed while a write commits may miss that write, and the
+write's incr finds no key to adjust. So counters are stored under a
+per-user generation, and an adjustment that finds no counter moves the
+user to a new generation: the concurrently computed count lands under a
+key nothing reads any more, and the next read recounts.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from social_media_api.caches import local_ttl
+from .models import Notification
+
+DEFAULT_UNREAD_COUNT_TTL = 24 * 3600
+DEFAULT_UNREAD_COUNT_LOCAL_TTL = 5
+
+
+def _generation_key(user_id):
+    return f'notifications:unread-generation:{user_id}'
+
+
+def _generation(user_id):
+    generation = cache.get(_generation_key(user_id))
+    if generation is None:
+        # Start from the clock, so an evicted generation is never reused
+        # along with the counters stored under it.
+        cache.add(_generation_key(user_id), time.time_ns(), None)
+        generation = cache.get(_generation_key(user_id))
+    return generation
+
+
+def _next_generation(user_id):
+    try:
+        cache.incr(_generation_key(user_id))
+    except ValueError:
+        cache.add(_generation_key(user_id), time.time_ns(), None)
+
+
+def _key(user_id):
+    return f'notifications:unread:{user_id}:{_generation(user_id)}'
+
+
+def get_unread_count(user_id):
+    key = _key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(recipient_id=user_id, unread=True).count()
+        ttl = local_ttl(
+            getattr(settings, 'NOTIFICATIONS_UNREAD_COUNT_TTL', DEFAULT_UNREAD_COUNT_TTL),
+            getattr(settings, 'NOTIFICATIONS_UNREAD_COUNT_LOCAL_TTL', DEFAULT_UNREAD_COUNT_LOCAL_TTL),
+        )
+        cache.add(key, count, ttl)
+    return count
+
+
+def adjust_unread_count(user_id, delta):
+    """
+    Add `delta` to the cached counter once the current transaction commits.
+    If there is no counter, one may be being computed without this change,
+    so move to a new generation instead.
+    """
+    def apply():
+        try:
+            if delta > 0:
+                cache.incr(_key(user_id), delta)
+            elif delta < 0:
+                cache.decr(_key(user_id), -delta)
+        except ValueError:
+            _next_generation(user_id)
+
+    transaction.on_commit(apply)
@@ -1,7 +1,16 @@
 from django.urls import path
-from .views import NotificationListView, MarkNotificationReadView
+from .views import (
+    NotificationListView,
+    MarkNotificationReadView,
+    MarkNotificationsReadView,
+    UnreadCountView,
+)
+from .streams import notification_stream
 
 urlpatterns = [
     path('', NotificationListView.as_view(), name='notifications-list'),
     path('<int:pk>/read/', MarkNotificationReadView.as_view(), name='notifications-mark-read'),
+    path('mark_read/', MarkNotificationsReadView.as_view(), name='notifications-mark-read-bulk'),
+    path('unread_count/', UnreadCountView.as_view(), name='notifications-unread-count'),
+    path('stream/', notification_stream, name='notifications-stream'),
 ]
@@ -1,23 +1,32 @@
 # notifications/utils.py
 from django.contrib.contenttypes.models import ContentType
-from .models import Notification
+from django.utils import timezone
+
+from .queue import NotificationEvent, get_queue_backend
+
 
 def create_notification(recipient, actor, verb, target=None):
     """
-    Create a Notification record in a uniform way.
+    Queue a notification in a uniform way.
     `target` can be any model instance (Post, Comment, User, etc).
+
+    The Notification row is written asynchronously by the configured queue
+    backend (see notifications.queue); the queued event is returned.
     """
-    target_content_type = None
+    target_content_type_id = None
     target_object_id = None
 
     if target is not None:
-        target_content_type = ContentType.objects.get_for_model(target)
+        target_content_type_id = ContentType.objects.get_for_model(target).id
         target_object_id = getattr(target, "id", None)
 
-    return Notification.objects.create(
-        recipient=recipient,
-        actor=actor,
+    event = NotificationEvent(
+        recipient_id=recipient.pk,
+        actor_id=actor.pk,
         verb=verb,
-        target_content_type=target_content_type,
-        target_object_id=target_object_id
+        target_content_type_id=target_content_type_id,
+        target_object_id=target_object_id,
+        timestamp=timezone.now(),
     )
+    get_queue_backend().enqueue(event)
+    return event
@@ -1,23 +1,90 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from .models import Notification
-from .serializers import NotificationSerializer
+from .serializers import CompiledNotificationSerializer, MarkReadSerializer, NotificationSerializer
+from .unread import adjust_unread_count, get_unread_count
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.prefetch import GenericPrefetch
 from django.shortcuts import get_object_or_404
+from posts.models import Post, Comment
+from social_media_api.compiled import CompiledListMixin
+from social_media_api.sql_budget import QueryBudgetMixin
 
+User = get_user_model()
 
-class NotificationListView(generics.ListAPIView):
+
+def target_querysets():
+    """
+    Querysets used to load notification targets, one per target model,
+    with whatever each model's __str__ needs already joined in.
+    """
+    return [
+        Post.objects.select_related('author'),
+        Comment.objects.select_related('author', 'post__author'),
+        User.objects.all(),
+    ]
+
+
+class NotificationListView(QueryBudgetMixin, CompiledListMixin, generics.ListAPIView):
     serializer_class = NotificationSerializer
+    compiled_serializer_class = CompiledNotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # count, page, actor names and one query per target type
+    query_budget = 6
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user)
+        # One query per target content type instead of one (or more) per
+        # notification when the serializer reads `target`.
+        return (
+            Notification.objects.filter(recipient=self.request.user)
+            .select_related('actor')
+            .prefetch_related(GenericPrefetch('target', target_querysets()))
+        )
 
+    def get_compiled_serializer(self, **kwargs):
+        return super().get_compiled_serializer(target_querysets=target_querysets(), **kwargs)
 
-class MarkNotificationReadView(generics.GenericAPIView):
+
+class MarkNotificationReadView(QueryBudgetMixin, generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
+    # The UPDATE, plus a lookup when it changed nothing (already read or 404).
+    query_budget = 2
 
     def post(self, request, pk):
-        notification = get_object_or_404(Notification, pk=pk, recipient=request.user)
-        notification.unread = False
-        notification.save()
+        updated = Notification.objects.filter(pk=pk, recipient=request.user, unread=True).update(unread=False)
+        if updated:
+            adjust_unread_count(request.user.id, -updated)
+        else:
+            # Only look the row up when nothing changed, to tell 404 from "already read".
+            get_object_or_404(Notification.objects.only('id'), pk=pk, recipient=request.user)
         return Response({'detail': 'Notification marked as read.'}, status=status.HTTP_200_OK)
+
+
+class MarkNotificationsReadView(QueryBudgetMixin, generics.GenericAPIView):
+    """
+    Mark many notifications as read with a single UPDATE, selected either by
+    `ids` or as everything up to a `before` timestamp.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = MarkReadSerializer
+    query_budget = 1
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        notifications = Notification.objects.filter(recipient=request.user, unread=True)
+        if 'ids' in serializer.validated_data:
+            notifications = notifications.filter(id__in=serializer.validated_data['ids'])
+        else:
+            notifications = notifications.filter(timestamp__lte=serializer.validated_data['before'])
+        updated = notifications.update(unread=False)
+        adjust_unread_count(request.user.id, -updated)
+        return Response({'updated': updated}, status=status.HTTP_200_OK)
+
+
+class UnreadCountView(QueryBudgetMixin, generics.GenericAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 1
+
+    def get(self, request):
+        return Response({'unread_count': get_unread_count(request.user.id)}, status=status.HTTP_200_OK)
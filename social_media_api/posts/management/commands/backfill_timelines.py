@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.timeline import get_timeline_backend
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Rebuild stored feed timelines from the current follow graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_ids', nargs='*', type=int,
+            help="Only rebuild the timelines of these user IDs (default: all users).",
+        )
+
+    def handle(self, *args, **options):
+        backend = get_timeline_backend()
+        users = User.objects.order_by('id')
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+
+        count = 0
+        for user in users.iterator():
+            backend.rebuild(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} timeline(s)."))
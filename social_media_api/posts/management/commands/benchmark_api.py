@@ -0,0 +1,283 @@
+import json
+import logging
+import math
+import random
+import re
+import statistics
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from notifications.models import Notification
+from posts.models import Comment, Like, Post
+from posts.synthetic import Follow
+
+User = get_user_model()
+
+SCENARIOS = ('feed', 'post-list', 'post-detail', 'like', 'follow', 'notifications')
+PERCENTILES = (50, 95, 99)
+
+_QUERIES_RE = re.compile(r'desc="(\d+) queries')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of the sorted list `values`."""
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def summarize(samples):
+    """
+    Summarize (milliseconds, queries, status) samples of one endpoint.
+    """
+    latencies = sorted(ms for ms, _, _ in samples)
+    queries = [n for _, n, _ in samples if n is not None]
+    summary = {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status in samples if status >= 400),
+        'statuses': {str(status): n for status, n in sorted(Counter(status for _, _, status in samples).items())},
+        'mean_ms': round(statistics.fmean(latencies), 3),
+    }
+    for pct in PERCENTILES:
+        summary[f'p{pct}_ms'] = round(percentile(latencies, pct), 3)
+    if queries:
+        summary['queries_mean'] = round(statistics.fmean(queries), 2)
+        summary['queries_max'] = max(queries)
+    return summary
+
+
+def pick(rng, options, excluded, tries=10):
+    """
+    Return a random item of `options` that is not in `excluded`, which must
+    leave at least one. Guesses first, as most options are usually free.
+    """
+    for _ in range(tries):
+        option = rng.choice(options)
+        if option not in excluded:
+            return option
+    return rng.choice([option for option in options if option not in excluded])
+
+
+class InProcessTransport:
+    """Send requests through the Django test client, in this process."""
+
+    def __init__(self):
+        # Errors such as SQLite lock timeouts become 500s, counted as errors.
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, token):
+        response = getattr(self.client, method)(path, secure=True, HTTP_AUTHORIZATION=f'Token {token}')
+        return response.status_code, response.get('Server-Timing', '')
+
+
+class HTTPTransport:
+    """Send requests to a running server at `base_url`."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, token):
+        request = urllib.request.Request(
+            self.base_url + path, method=method.upper(), headers={'Authorization': f'Token {token}'},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers.get('Server-Timing', '')
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the main API endpoints with the users created by generate_synthetic_data and report "
+        "latency percentiles and queries per request. Likes and follows are undone by the requests "
+        "that follow them (unlike, unfollow), but each like and follow notifies its target, so runs "
+        "add or update notifications."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=1, help="Number of client threads.")
+        parser.add_argument('--clients', type=int, default=50, help="Distinct users sending requests.")
+        parser.add_argument(
+            '--scenarios', default=','.join(SCENARIOS),
+            help=f"Comma-separated subset of: {', '.join(SCENARIOS)}.",
+        )
+        parser.add_argument('--prefix', default='synth', help="Username prefix of the generated users.")
+        parser.add_argument(
+            '--url', help="Base URL of a running server using this database (default: in-process test client).",
+        )
+        parser.add_argument('--json', dest='json_path', help="Write the report as JSON to this file ('-' for stdout).")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}.")
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1.")
+
+        rng = random.Random(options['seed'])
+        users = list(User.objects.filter(username__startswith=options['prefix']).order_by('id').values_list('id', flat=True))
+        if len(users) < 2:
+            raise CommandError(f"No users named '{options['prefix']}*'; run generate_synthetic_data first.")
+        post_ids = list(Post.objects.filter(author_id__in=users).values_list('id', flat=True))
+        if not post_ids:
+            raise CommandError("The generated users have no posts.")
+        clients = rng.sample(users, min(options['clients'], len(users)))
+        tokens = {user_id: Token.objects.get_or_create(user_id=user_id)[0].key for user_id in clients}
+
+        make_transport = (lambda: HTTPTransport(options['url'])) if options['url'] else InProcessTransport
+        results = {}
+        started = time.perf_counter()
+        # The per-request SQL log (see social_media_api.sql_budget) would
+        # bury the report.
+        sql_logger = logging.getLogger('social_media_api.sql')
+        sql_logger.disabled = options['verbosity'] < 2
+        try:
+            for name in scenarios:
+                tasks = self.build_tasks(name, options['warmup'] + options['requests'], clients, users, post_ids, rng)
+                samples = self.run(tasks, tokens, options['concurrency'], options['warmup'], make_transport)
+                for endpoint, endpoint_samples in sorted(samples.items()):
+                    results[endpoint] = summarize(endpoint_samples)
+        finally:
+            sql_logger.disabled = False
+
+        report = {
+            'commit': self.git_commit(),
+            'mode': 'http' if options['url'] else 'in-process',
+            'concurrency': options['concurrency'],
+            'requests_per_scenario': options['requests'],
+            'dataset': {
+                'users': len(users),
+                'posts': len(post_ids),
+                'comments': Comment.objects.filter(post__author_id__in=users).count(),
+                'likes': Like.objects.filter(post__author_id__in=users).count(),
+                'notifications': Notification.objects.filter(recipient_id__in=users).count(),
+            },
+            'seconds': round(time.perf_counter() - started, 3),
+            'endpoints': results,
+        }
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+            return
+        self.write_table(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    def build_tasks(self, name, count, clients, users, post_ids, rng):
+        """
+        Return `count` (client, steps) tasks for scenario `name`, where steps
+        are (endpoint, method, path) requests sent in order by that client.
+        Write scenarios pair each write with the request undoing it, on a
+        post the client does not like or a user it does not follow yet;
+        clients that already like every post or follow every user are left
+        out of them.
+        """
+        excluded = defaultdict(set)
+        if name == 'like':
+            for user_id, post_id in Like.objects.filter(user_id__in=clients).values_list('user_id', 'post_id'):
+                excluded[user_id].add(post_id)
+        elif name == 'follow':
+            for user_id, followed_id in Follow.objects.filter(to_customuser_id__in=clients).values_list(
+                'to_customuser_id', 'from_customuser_id',
+            ):
+                excluded[user_id].add(followed_id)
+            for client in clients:
+                excluded[client].add(client)
+        targets = {'like': post_ids, 'follow': users}.get(name)
+        if targets is not None:
+            clients = [client for client in clients if not excluded[client].issuperset(targets)]
+            if not clients:
+                raise CommandError(f"Every client has already done the '{name}' scenario's write to every target.")
+        tasks = []
+        for _ in range(count):
+            client = rng.choice(clients)
+            if name == 'feed':
+                steps = [('feed', 'get', reverse('feed'))]
+            elif name == 'post-list':
+                steps = [('post-list', 'get', reverse('post-list'))]
+            elif name == 'post-detail':
+                steps = [('post-detail', 'get', reverse('post-detail', args=[rng.choice(post_ids)]))]
+            elif name == 'like':
+                path = reverse('like-post', args=[pick(rng, post_ids, excluded[client])])
+                steps = [('like', 'put', path), ('unlike', 'delete', path)]
+            elif name == 'follow':
+                target = pick(rng, users, excluded[client])
+                steps = [('follow', 'post', reverse('follow', args=[target])),
+                         ('unfollow', 'post', reverse('unfollow', args=[target]))]
+            else:
+                steps = [('notifications', 'get', reverse('notifications-list'))]
+            tasks.append((client, steps))
+        return tasks
+
+    def run(self, tasks, tokens, concurrency, warmup, make_transport):
+        samples = defaultdict(list)
+        lock = threading.Lock()
+        pending = iter(enumerate(tasks))
+
+        def worker():
+            transport = make_transport()
+            while True:
+                with lock:
+                    index, task = next(pending, (None, None))
+                if task is None:
+                    return
+                client, steps = task
+                for endpoint, method, path in steps:
+                    start = time.perf_counter()
+                    status, timing = transport.request(method, path, tokens[client])
+                    elapsed = (time.perf_counter() - start) * 1000
+                    if index >= warmup:
+                        match = _QUERIES_RE.search(timing)
+                        with lock:
+                            samples[endpoint].append((elapsed, int(match.group(1)) if match else None, status))
+
+        def thread_worker():
+            try:
+                worker()
+            finally:
+                connections.close_all()
+
+        if concurrency == 1:
+            # In this thread, so in-process runs share this connection.
+            worker()
+        else:
+            threads = [threading.Thread(target=thread_worker) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return samples
+
+    def write_table(self, results):
+        self.stdout.write(
+            f"{'endpoint':<14}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for endpoint, summary in results.items():
+            self.stdout.write(
+                f"{endpoint:<14}{summary['requests']:>9}{summary['errors']:>8}"
+                f"{summary['p50_ms']:>9.2f}{summary['p95_ms']:>9.2f}{summary['p99_ms']:>9.2f}"
+                f"{summary.get('queries_mean', float('nan')):>9.1f}"
+            )
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,72 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Post, TimelineEntry
+from posts.synthetic import build_posts, create_follow_graph, create_users
+from posts.timeline import DatabaseTimelineBackend, HybridTimelineBackend
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare push and hybrid feed modes on a synthetic power-law follow graph. "
+        "All data is created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--follows', type=int, default=50, help="Follows per user.")
+        parser.add_argument('--alpha', type=float, default=1.2, help="Power-law exponent.")
+        parser.add_argument('--posts', type=int, default=1000, help="Posts written per mode.")
+        parser.add_argument('--reads', type=int, default=200, help="Feed reads per mode.")
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--threshold', type=int, default=100, help="Hybrid fan-out threshold.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rng = random.Random(options['seed'])
+            users = create_users(options['users'])
+            edges = create_follow_graph(users, options['follows'], options['alpha'], rng)
+            self.stdout.write(f"{len(users)} users, {edges} follow edges")
+
+            modes = (
+                ('push', DatabaseTimelineBackend()),
+                ('hybrid', HybridTimelineBackend(fanout_threshold=options['threshold'])),
+            )
+            for name, backend in modes:
+                self.run_mode(name, backend, users, rng, options)
+            transaction.set_rollback(True)
+
+    def run_mode(self, name, backend, users, rng, options):
+        TimelineEntry.objects.all().delete()
+        for user in users:
+            backend.rebuild(user)
+
+        # Authors are drawn uniformly, so popular authors post as often as
+        # anyone else; their follower count is what drives amplification.
+        authors = rng.choices(users, k=options['posts'])
+        posts = Post.objects.bulk_create(build_posts(authors, 1))
+        before = TimelineEntry.objects.count()
+        started = time.perf_counter()
+        for post in posts:
+            backend.add_post(post)
+        write_seconds = time.perf_counter() - started
+        amplification = (TimelineEntry.objects.count() - before) / len(posts)
+
+        latencies = []
+        for reader in rng.sample(users, min(options['reads'], len(users))):
+            started = time.perf_counter()
+            list(backend.get_feed(reader)[:options['page_size']])
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        self.stdout.write(
+            f"{name:>6}: write amplification {amplification:.1f} rows/post, "
+            f"{write_seconds / len(posts) * 1000:.2f} ms/post; "
+            f"read p50 {statistics.median(latencies):.2f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms"
+        )
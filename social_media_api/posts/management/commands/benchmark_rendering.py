@@ -0,0 +1,103 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.views import APIView
+
+from social_media_api.renderers import FastJSONRenderer, orjson
+
+User = get_user_model()
+
+ENDPOINTS = ('post-list', 'feed', 'comment-list', 'notifications-list')
+CONFIGS = (
+    # (label, compiled serializers, renderer)
+    ('drf+json', False, JSONRenderer),
+    ('drf+orjson', False, FastJSONRenderer),
+    ('compiled+json', True, JSONRenderer),
+    ('compiled+orjson', True, FastJSONRenderer),
+)
+
+
+@contextmanager
+def json_renderer(renderer_class):
+    # Views read renderer_classes from APIView, set when DRF was imported.
+    original = APIView.renderer_classes
+    APIView.renderer_classes = [renderer_class, BrowsableAPIRenderer]
+    try:
+        yield
+    finally:
+        APIView.renderer_classes = original
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure requests per second per CPU core of the list endpoints with the DRF or compiled "
+        "serializers and the stdlib or orjson renderer, on a synthetic dataset created inside a "
+        "transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=300)
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per endpoint and setup.")
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write("orjson is not installed; FastJSONRenderer falls back to the stdlib encoder.")
+
+        with transaction.atomic():
+            call_command(
+                'generate_synthetic_data', users=options['users'], prefix='renderbench', seed=options['seed'],
+                stdout=self.stdout,
+            )
+            # A well-followed reader, so feeds and notification pages are full.
+            reader = User.objects.filter(username__startswith='renderbench').order_by('-following_count').first()
+            token = Token.objects.get_or_create(user=reader)[0]
+            client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+            sql_logger = logging.getLogger('social_media_api.sql')
+            sql_logger.disabled = True
+            try:
+                self.run(client, options)
+            finally:
+                sql_logger.disabled = False
+            transaction.set_rollback(True)
+
+    def run(self, client, options):
+        self.stdout.write(f"{'endpoint':<20}" + ''.join(f'{label:>17}' for label, _, _ in CONFIGS) + '  (req/s per core)')
+        for endpoint in ENDPOINTS:
+            path = reverse(endpoint)
+            rates = [
+                self.measure(client, path, compiled, renderer_class, options)
+                for _, compiled, renderer_class in CONFIGS
+            ]
+            self.stdout.write(
+                f"{endpoint:<20}" + ''.join(f'{rate:>17.0f}' for rate in rates)
+                + f"  x{rates[-1] / rates[0]:.2f}"
+            )
+
+    def measure(self, client, path, compiled, renderer_class, options):
+        data = {'page_size': options['page_size']}
+        with override_settings(API_COMPILED_SERIALIZERS=compiled), json_renderer(renderer_class):
+            for _ in range(options['warmup']):
+                self.check_response(path, client.get(path, data, secure=True))
+            # CPU time of this single-threaded process, i.e. of one core.
+            started = time.process_time()
+            for _ in range(options['requests']):
+                self.check_response(path, client.get(path, data, secure=True))
+            return options['requests'] / (time.process_time() - started)
+
+    @staticmethod
+    def check_response(path, response):
+        if response.status_code != 200:
+            raise CommandError(f"GET {path} answered {response.status_code}, expected 200.")
@@ -0,0 +1,91 @@
+import math
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework import filters
+from rest_framework.request import Request
+
+from posts.models import Post
+from posts.search import FullTextSearchFilter
+from posts.synthetic import build_posts, create_users, make_vocabulary, text_generator
+from posts.views import PostViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare SearchFilter (LIKE scans) with the full-text FullTextSearchFilter "
+        "on a synthetic corpus. All data is created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--vocabulary', type=int, default=20000, help="Distinct words in the corpus.")
+        parser.add_argument('--queries', type=int, default=40, help="Search queries per backend.")
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = make_vocabulary(options['vocabulary'], rng)
+        text = text_generator(vocabulary, rng=rng)
+
+        with transaction.atomic():
+            authors = create_users(options['authors'])
+            started = time.perf_counter()
+            remaining = options['posts']
+            while remaining:
+                batch = min(remaining, options['batch_size'])
+                Post.objects.bulk_create(build_posts(rng.choices(authors, k=batch), 1, text=text))
+                remaining -= batch
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{options['posts']} posts over {len(vocabulary)} words, "
+                f"indexed while inserting in {elapsed:.1f} s"
+            )
+
+            queries = self.make_queries(vocabulary, rng, options['queries'])
+            for name, backend in (('SearchFilter', filters.SearchFilter()), ('FullText', FullTextSearchFilter())):
+                self.run_backend(name, backend, queries, options['page_size'])
+            transaction.set_rollback(True)
+
+    def make_queries(self, vocabulary, rng, count):
+        # Word ranks are drawn log-uniformly, so very common, mid-frequency
+        # and rare words are equally represented; 40% of the queries are
+        # prefixes and 20% have two words.
+        queries = []
+        for _ in range(count):
+            rank = int(math.exp(rng.uniform(0, math.log(len(vocabulary)))))
+            word = vocabulary[min(rank, len(vocabulary) - 1)]
+            kind = rng.random()
+            if kind < 0.4:
+                queries.append(word)
+            elif kind < 0.8:
+                queries.append(word[:3])
+            else:
+                queries.append(f'{word} {rng.choice(vocabulary[:100])}')
+        return queries
+
+    def run_backend(self, name, backend, queries, page_size):
+        view = PostViewSet()
+        factory = RequestFactory()
+        latencies = []
+        for query in queries:
+            request = Request(factory.get('/', {'search': query}))
+            started = time.perf_counter()
+            queryset = backend.filter_queryset(request, Post.objects.all(), view)
+            # What a page-number paginated request does: count + one page.
+            queryset.count()
+            list(queryset[:page_size])
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        self.stdout.write(
+            f"{name:>12}: p50 {statistics.median(latencies):.1f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms, "
+            f"max {latencies[-1]:.1f} ms over {len(latencies)} queries"
+        )
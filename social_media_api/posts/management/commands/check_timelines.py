@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.timeline import get_timeline_backend
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Compare stored feed timelines against the follow graph and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_ids', nargs='*', type=int,
+            help="Only check the timelines of these user IDs (default: all users).",
+        )
+        parser.add_argument(
+            '--repair', action='store_true',
+            help="Rebuild every timeline that is found to be inconsistent.",
+        )
+
+    def handle(self, *args, **options):
+        backend = get_timeline_backend()
+        users = User.objects.order_by('id')
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+
+        inconsistent = 0
+        for user in users.iterator():
+            missing, extra = backend.check(user)
+            if not missing and not extra:
+                continue
+            inconsistent += 1
+            self.stdout.write(
+                f"{user.username} (id={user.id}): {len(missing)} missing, {len(extra)} extra"
+            )
+            if options['repair']:
+                backend.rebuild(user)
+
+        if not inconsistent:
+            self.stdout.write(self.style.SUCCESS("All timelines are consistent."))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {inconsistent} timeline(s)."))
+        else:
+            raise CommandError(f"{inconsistent} timeline(s) are inconsistent; rerun with --repair.")
@@ -0,0 +1,76 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notifications.models import Notification
+from posts import response_cache
+from posts.models import Comment, Post
+from posts.synthetic import (
+    BATCH_SIZE, Follow, build_comments, build_notifications, build_posts, create_follow_graph, create_likes,
+    create_users, make_vocabulary, recount_posts, text_generator,
+)
+from posts.timeline import get_timeline_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic dataset: users, a power-law follow graph, posts, comments, likes "
+        "and notifications, written with bulk_create and committed. Use benchmark_api to load it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=30, help="Follows per user.")
+        parser.add_argument('--alpha', type=float, default=1.2, help="Power-law exponent.")
+        parser.add_argument('--posts', type=int, default=5, help="Posts per user.")
+        parser.add_argument('--comments', type=int, default=3, help="Comments per post, on average.")
+        parser.add_argument('--likes', type=int, default=5, help="Likes per post, on average.")
+        parser.add_argument('--notifications', type=int, default=20, help="Notifications per user, on average.")
+        parser.add_argument('--prefix', default='synth', help="Username prefix of the generated users.")
+        parser.add_argument(
+            '--skip-timelines', action='store_true',
+            help="Do not build the stored feed timelines of the generated users.",
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        text = text_generator(make_vocabulary(5000, rng), rng=rng)
+        alpha = options['alpha']
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            users = create_users(options['users'], prefix=options['prefix'])
+            edges = create_follow_graph(users, options['follows'], alpha, rng)
+            # Listed from the most to the least followed author, which the
+            # comment and like pickers turn into post popularity.
+            posts = Post.objects.bulk_create(build_posts(users, options['posts'], text=text), batch_size=BATCH_SIZE)
+            comments = Comment.objects.bulk_create(
+                build_comments(posts, users, options['comments'] * len(posts), alpha, rng, text=text),
+                batch_size=BATCH_SIZE,
+            )
+            likes = create_likes(posts, users, options['likes'] * len(posts), alpha, rng)
+            recount_posts(posts)
+
+            follows = Follow.objects.filter(to_customuser__in=users).values_list('to_customuser_id', 'from_customuser_id')
+            Notification.objects.bulk_create(
+                build_notifications(posts, comments, likes, follows, options['notifications'] * len(users), rng=rng),
+                batch_size=BATCH_SIZE, ignore_conflicts=True,
+            )
+            # Rows colliding with an open aggregate were skipped.
+            notifications = Notification.objects.filter(recipient__in=users).count()
+
+            if not options['skip_timelines']:
+                backend = get_timeline_backend()
+                for user in users:
+                    backend.rebuild(user)
+            # bulk_create sends no signals; drop any cached post responses.
+            response_cache.bump(everything=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users, {edges} follows, {len(posts)} posts, {len(comments)} comments, "
+            f"{len(likes)} likes and {notifications} notifications "
+            f"in {time.perf_counter() - started:.1f} s."
+        ))
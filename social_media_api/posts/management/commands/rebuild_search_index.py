@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from posts.search import install
+
+
+class Command(BaseCommand):
+    help = "Recreate the full-text search index over posts and repopulate it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if install(options['database'], rebuild=True):
+            self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
+        else:
+            self.stdout.write("This database has no full-text search support; SearchFilter is used instead.")
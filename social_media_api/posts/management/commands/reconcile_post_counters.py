@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts import response_cache
+from posts.models import Comment, Like, Post
+
+
+def _count_for_post(model):
+    rows = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(rows), 0)
+
+
+class Command(BaseCommand):
+    help = "Recompute Post.likes_count and Post.comments_count from the Like and Comment tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help="Number of post IDs checked per UPDATE statement.",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many posts have drifted.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_id = Post.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+        drifted_total = 0
+        for start in range(0, max_id + 1, batch_size):
+            drifted = (
+                Post.objects.filter(id__gte=start, id__lt=start + batch_size)
+                .annotate(expected_likes=_count_for_post(Like), expected_comments=_count_for_post(Comment))
+                .exclude(likes_count=F('expected_likes'), comments_count=F('expected_comments'))
+            )
+            if options['dry_run']:
+                drifted_total += drifted.count()
+                continue
+            drifted_total += Post.objects.filter(pk__in=drifted.values('pk')).update(
+                likes_count=_count_for_post(Like),
+                comments_count=_count_for_post(Comment),
+            )
+
+        if drifted_total and not options['dry_run']:
+            response_cache.bump(everything=True)
+        verb = "have drifted" if options['dry_run'] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"{drifted_total} post(s) {verb}."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from social_media_api.db_router import copy_sqlite, replicas
+
+
+class Command(BaseCommand):
+    help = "Refresh SQLite stand-in replicas with a copy of the primary database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help="Replica aliases to refresh (default: all SQLite replicas).")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to copy from.")
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or [alias for alias in replicas() if connections[alias].vendor == 'sqlite']
+        if not aliases:
+            raise CommandError("No SQLite replicas configured; set DATABASE_REPLICA_URLS.")
+        for alias in aliases:
+            if alias not in replicas() or connections[alias].vendor != 'sqlite':
+                raise CommandError(f"'{alias}' is not a SQLite replica.")
+            # Drop the replica's open connection so it reopens the new file.
+            connections[alias].close()
+            copy_sqlite(connections[alias].settings_dict['NAME'], using=options['database'])
+            self.stdout.write(self.style.SUCCESS(f"Copied '{options['database']}' to '{alias}'."))
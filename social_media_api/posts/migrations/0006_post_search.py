@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from posts.search import install
+    install(schema_editor.connection.alias)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from posts.search import uninstall
+    uninstall(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index over posts (FTS5 on SQLite, tsvector + GIN on
+    PostgreSQL); see posts/search.py.
+    """
+
+    dependencies = [
+        ('posts', '0005_post_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    """
+    Give every follower a TimelineEntry for each post of the authors they
+    follow, so stored feeds are complete from the start rather than after
+    a manual backfill_timelines run. Existing entries are kept.
+    """
+    entry = apps.get_model('posts', 'TimelineEntry')._meta
+    post = apps.get_model('posts', 'Post')._meta
+    follow = apps.get_model(settings.AUTH_USER_MODEL).followers.through._meta
+    qn = schema_editor.quote_name
+    # Follow rows: from_customuser is followed by to_customuser.
+    schema_editor.execute(
+        f"INSERT INTO {qn(entry.db_table)} ({qn('user_id')}, {qn('post_id')}, {qn('created_at')}) "
+        f"SELECT f.{qn('to_customuser_id')}, p.{qn('id')}, p.{qn('created_at')} "
+        f"FROM {qn(post.db_table)} p INNER JOIN {qn(follow.db_table)} f "
+        f"ON f.{qn('from_customuser_id')} = p.{qn('author_id')} "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {qn(entry.db_table)} e "
+        f"WHERE e.{qn('user_id')} = f.{qn('to_customuser_id')} AND e.{qn('post_id')} = p.{qn('id')})"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timelineentry',
+            name='posts_timeline_user_created',
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-created_at', '-post'], name='posts_timeline_user_feed'),
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
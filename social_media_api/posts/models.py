@@ -1,5 +1,34 @@
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import Exists, F, OuterRef, Prefetch, Value
 from django.conf import settings
+from django.utils import timezone
+
+from .response_cache import bump
+
+DEFAULT_COMMENT_PREVIEW_SIZE = 3
+
+
+class PostQuerySet(models.QuerySet):
+    def with_comment_preview(self, size=None):
+        """
+        Prefetch the latest `size` comments of every post into
+        `comment_preview` (newest first). Django turns the sliced prefetch
+        into a single ROW_NUMBER() OVER (PARTITION BY post_id) query for the
+        whole page instead of loading every comment.
+        """
+        if size is None:
+            size = getattr(settings, 'POSTS_COMMENT_PREVIEW_SIZE', DEFAULT_COMMENT_PREVIEW_SIZE)
+        latest = Comment.objects.select_related('author').order_by('-created_at', '-id')[:size]
+        return self.prefetch_related(Prefetch('comments', queryset=latest, to_attr='comment_preview'))
+
+    def with_liked_by(self, user):
+        """
+        Annotate `liked_by_me`: whether `user` likes each post, as an
+        EXISTS subquery on the (user, post) unique index of Like.
+        """
+        if not user.is_authenticated:
+            return self.annotate(liked_by_me=Value(False))
+        return self.annotate(liked_by_me=Exists(Like.objects.filter(post=OuterRef('pk'), user=user)))
 
 
 class Post(models.Model):
@@ -12,13 +41,51 @@ class Post(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized counters, kept exact by F() updates in the views and
+    # repaired in bulk by the reconcile_post_counters command.
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='posts_post_created_id'),
+            models.Index(fields=['author', '-created_at'], name='posts_post_author_created'),
+        ]
 
     def __str__(self):
         return f'{self.title} by {self.author}'
 
+    @classmethod
+    def adjust_counters(cls, pk, **deltas):
+        """
+        Atomically add `deltas` to counter columns of post `pk`,
+        e.g. Post.adjust_counters(post.pk, likes_count=1).
+        """
+        cls.objects.filter(pk=pk).update(**{field: F(field) + delta for field, delta in deltas.items()})
+        bump(pk)
+
+    @classmethod
+    def adjust_likes_count(cls, pk, delta, connection):
+        """
+        Add `delta` to likes_count of post `pk` and return its author's ID,
+        in one UPDATE ... RETURNING, or None if the post no longer exists.
+        """
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {quote(cls._meta.db_table)} SET likes_count = likes_count + %s "
+                f"WHERE id = %s RETURNING author_id",
+                [delta, pk],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        bump(pk)
+        return row[0]
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -37,6 +104,9 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('created_at',)
+        indexes = [
+            models.Index(fields=['post', 'created_at'], name='posts_comment_post_created'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.author} on {self.post}'
@@ -65,3 +135,75 @@ class Like(models.Model):
 
     def __str__(self):
         return f'{self.user} liked {self.post}'
+
+    @classmethod
+    def add(cls, user_id, post_id):
+        """
+        Like post `post_id` as `user_id` with a single
+        INSERT ... SELECT ... ON CONFLICT DO NOTHING and, if a row was
+        inserted, bump the post's likes_count. Returns (like, author_id) on
+        a transition and None if the post was already liked or does not
+        exist. Call inside a transaction so both writes commit together.
+        """
+        connection = connections[router.db_for_write(cls)]
+        quote = connection.ops.quote_name
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(cls._meta.db_table)} (user_id, post_id, created_at) "
+                f"SELECT %s, id, %s FROM {quote(Post._meta.db_table)} WHERE id = %s "
+                f"ON CONFLICT (user_id, post_id) DO NOTHING RETURNING id",
+                [user_id, connection.ops.adapt_datetimefield_value(now), post_id],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            author_id = Post.adjust_likes_count(post_id, 1, connection)
+            if author_id is None:
+                return None
+        return cls(id=row[0], user_id=user_id, post_id=post_id, created_at=now), author_id
+
+    @classmethod
+    def remove(cls, user_id, post_id):
+        """
+        Unlike with a filtered DELETE; on a transition decrement likes_count
+        and return the post author's ID, otherwise return None.
+        """
+        connection = connections[router.db_for_write(cls)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {connection.ops.quote_name(cls._meta.db_table)} WHERE user_id = %s AND post_id = %s",
+                [user_id, post_id],
+            )
+            if cursor.rowcount != 1:
+                return None
+        return Post.adjust_likes_count(post_id, -1, connection)
+
+
+class TimelineEntry(models.Model):
+    """
+    A materialized feed row: `post` appears in `user`'s timeline.
+    `created_at` is copied from the post so reading a feed is a single
+    range scan on the (user, created_at, post) index.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='posts_timeline_user_feed'),
+        ]
+
+    def __str__(self):
+        return f'{self.post} in timeline of {self.user}'
@@ -0,0 +1,191 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_slice(self, queryset, request, view=None):
+        """
+        Return the rows of the requested page as a sliced queryset, without
+        running it, or None if the page cannot be located that way.
+        """
+        page_size = self.get_page_size(request)
+        try:
+            number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            return None
+        if not page_size or number < 1:
+            return None
+        offset = (number - 1) * page_size
+        return queryset[offset:offset + page_size]
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Opaque cursor pagination keyed on (created_at, id).
+
+    Each page is fetched with a WHERE clause on the last row seen instead of
+    an OFFSET, and no COUNT query is issued, so deep pages cost the same as
+    the first one and rows inserted while a client is paging do not shift
+    the results. Views set `cursor_ordering` to the (timestamp, id) ordering
+    they need; both fields must sort in the same direction.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        queryset, position, reverse = self._page_queryset(queryset, request, view)
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Paging forwards there is always a way back unless we started at the
+        # top; paging backwards there is always a way forwards.
+        has_next = has_more if not reverse else position is not None
+        has_previous = position is not None if not reverse else has_more
+        self.next_position = self._position(rows[-1]) if rows and has_next else None
+        self.previous_position = self._position(rows[0]) if rows and has_previous else None
+        return rows
+
+    def get_page_slice(self, queryset, request, view=None):
+        """
+        Return the rows of the requested page as a sliced queryset, without
+        running it.
+        """
+        queryset, _, _ = self._page_queryset(queryset, request, view)
+        return queryset[:self.page_size]
+
+    def _page_queryset(self, queryset, request, view):
+        self.page_size = self.get_page_size(request)
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.descending = ordering[0].startswith('-')
+
+        position, reverse = self.decode_cursor(request)
+        if reverse:
+            ordering = [self._flip(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(position, self.descending != reverse))
+        return queryset, position, reverse
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        return self._link(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        return self._link(self.previous_position, reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            timestamp = parse_datetime(data['t'])
+            position = (timestamp, int(data['i']))
+            reverse = bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        data = {'t': position[0].isoformat(), 'i': position[1]}
+        if reverse:
+            data['r'] = 1
+        return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+
+    def _link(self, position, reverse):
+        if position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    def _position(self, obj):
+        # Rows are model instances, or dicts when paginating .values().
+        if isinstance(obj, dict):
+            return tuple(obj[field] for field in self.fields)
+        return tuple(getattr(obj, field) for field in self.fields)
+
+    def _after(self, position, descending):
+        timestamp_field, id_field = self.fields
+        op = 'lt' if descending else 'gt'
+        return (
+            Q(**{f'{timestamp_field}__{op}': position[0]})
+            | Q(**{timestamp_field: position[0], f'{id_field}__{op}': position[1]})
+        )
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class SelectablePaginationMixin:
+    """
+    Lets a view choose between page-number and keyset pagination.
+
+    The default comes from `pagination_mode` on the view ('page' or
+    'cursor'); clients can override it per request with
+    `?pagination=cursor`, and any request carrying a `cursor` parameter is
+    paginated by cursor.
+    """
+    pagination_mode = 'page'
+    cursor_pagination_class = KeysetCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            mode = params.get('pagination', self.pagination_mode)
+            if self.cursor_pagination_class.cursor_query_param in params:
+                mode = 'cursor'
+            pagination_class = self.cursor_pagination_class if mode == 'cursor' else self.pagination_class
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
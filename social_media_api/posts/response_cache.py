@@ -0,0 +1,206 @@
+"""
+Response cache for anonymous post reads.
+
+ResponseCacheMixin caches the serialized data of anonymous GET requests to
+PostViewSet.list and retrieve in the cache named by POSTS_RESPONSE_CACHE.
+Keys combine the host, path and sorted query parameters with version
+counters kept in the same cache:
+
+* `list`, bumped by any change to any post, which every list key carries;
+* `post:<pk>`, bumped by changes to that post, its comments or its likes,
+  which its detail key carries;
+* `epoch`, bumped by changes that can touch every response (a user
+  renaming themselves, bulk counter repairs), which every key carries.
+
+Invalidation is therefore one or two cache increments; old entries are
+never looked up again and simply expire. Version counters start from the
+current time in nanoseconds, so a counter that was evicted and recreated
+cannot line up with entries written under its previous values.
+
+Counters are bumped by post_save/post_delete receivers and, for the
+writes that bypass signals (Like.add/remove and the counter updates of
+Post.adjust_counters and Post.adjust_likes_count), by those methods.
+Comments and likes deleted through the ORM outside those paths are not
+observed: listening to their post_delete would disable Django's fast
+cascade delete when a post goes away. Other queryset updates of posts
+must call bump() themselves.
+
+Entries are fresh for POSTS_RESPONSE_CACHE_TTL seconds and kept for
+POSTS_RESPONSE_CACHE_STALE_TTL more. Only the request that wins a
+cache.add() lock recomputes an expired entry; the others are served the
+stale copy, or, when there is none, wait up to
+POSTS_RESPONSE_CACHE_LOCK_WAIT seconds for the winner's result. The
+`X-Cache` response header says which of HIT, STALE or MISS happened.
+A TTL of 0 disables the cache.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+DEFAULT_TTL = 30
+DEFAULT_STALE_TTL = 60
+DEFAULT_LOCK_TIMEOUT = 10
+DEFAULT_LOCK_WAIT = 2.0
+POLL_INTERVAL = 0.05
+
+# Response headers stored with the data and replayed on hits.
+CACHED_HEADERS = ('ETag', 'Cache-Control', 'Vary')
+
+EPOCH_KEY = 'posts:version:epoch'
+LIST_KEY = 'posts:version:list'
+
+
+def _cache():
+    return caches[getattr(settings, 'POSTS_RESPONSE_CACHE', DEFAULT_CACHE_ALIAS)]
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _post_key(pk):
+    return f'posts:version:post:{pk}'
+
+
+def _incr(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def _bump_now(post_id=None, everything=False):
+    cache = _cache()
+    keys = [EPOCH_KEY] if everything else [LIST_KEY]
+    if post_id is not None:
+        keys.append(_post_key(post_id))
+    for key in keys:
+        _incr(cache, key)
+
+
+def bump(post_id=None, everything=False):
+    """
+    Invalidate cached post lists and, with `post_id`, that post's detail;
+    with `everything`, all cached post responses.
+    """
+    _bump_now(post_id, everything)
+    # Again after commit, so a read in between cannot cache the old rows
+    # under the new version.
+    transaction.on_commit(lambda: _bump_now(post_id, everything))
+
+
+def get_versions(keys):
+    """
+    Return the current value of each version key, creating missing ones,
+    with one cache read in the common case.
+    """
+    cache = _cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+@receiver(post_save, sender='posts.Post')
+@receiver(post_delete, sender='posts.Post')
+def _post_changed(sender, instance, **kwargs):
+    bump(instance.pk)
+
+
+@receiver(post_save, sender='posts.Comment')
+@receiver(post_save, sender='posts.Like')
+def _post_child_saved(sender, instance, **kwargs):
+    bump(instance.post_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def _user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Posts embed the author's username; logins only touch last_login.
+    if created or update_fields == frozenset(['last_login']):
+        return
+    bump(everything=True)
+
+
+class ResponseCacheMixin:
+    """
+    Serve anonymous list() and retrieve() requests from the versioned
+    response cache.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(request, [EPOCH_KEY, LIST_KEY], super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        keys = [EPOCH_KEY, _post_key(self.kwargs[lookup_url_kwarg])]
+        return self._cached(request, keys, super().retrieve, *args, **kwargs)
+
+    def get_response_cache_key(self, request, version_keys):
+        params = sorted((name, sorted(values)) for name, values in request.query_params.lists())
+        # Pagination links are absolute, so the host and scheme matter too.
+        data = repr((
+            self.action, request.scheme, request.get_host(), request.path, params, get_versions(version_keys),
+        )).encode()
+        return 'posts:response:' + hashlib.sha1(data).hexdigest()
+
+    def _cached(self, request, version_keys, handler, *args, **kwargs):
+        ttl = _setting('POSTS_RESPONSE_CACHE_TTL', DEFAULT_TTL)
+        if request.user.is_authenticated or request.method not in ('GET', 'HEAD') or not ttl:
+            return handler(request, *args, **kwargs)
+
+        cache = _cache()
+        key = self.get_response_cache_key(request, version_keys)
+        entry = cache.get(key)
+        if entry is not None and entry['fresh_until'] > time.time():
+            return self._replay(request, entry, 'HIT')
+
+        lock = key + ':lock'
+        if not cache.add(lock, 1, _setting('POSTS_RESPONSE_CACHE_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)):
+            if entry is not None:
+                return self._replay(request, entry, 'STALE')
+            entry = self._wait_for(cache, key)
+            if entry is not None:
+                return self._replay(request, entry, 'HIT')
+            return handler(request, *args, **kwargs)
+
+        try:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200 and isinstance(response, Response):
+                entry = {
+                    'data': response.data,
+                    'headers': {name: response[name] for name in CACHED_HEADERS if name in response},
+                    'fresh_until': time.time() + ttl,
+                }
+                cache.set(key, entry, ttl + _setting('POSTS_RESPONSE_CACHE_STALE_TTL', DEFAULT_STALE_TTL))
+            response['X-Cache'] = 'MISS'
+            return response
+        finally:
+            cache.delete(lock)
+
+    def _wait_for(self, cache, key):
+        deadline = time.monotonic() + _setting('POSTS_RESPONSE_CACHE_LOCK_WAIT', DEFAULT_LOCK_WAIT)
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def _replay(self, request, entry, status):
+        headers = entry['headers']
+        response = get_conditional_response(request._request, etag=headers.get('ETag'))
+        if response is None:
+            response = Response(entry['data'])
+        for name, value in headers.items():
+            response[name] = value
+        response['X-Cache'] = status
+        return response
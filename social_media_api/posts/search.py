@@ -0,0 +1,163 @@
+"""
+Full-text search over posts.
+
+FullTextSearchFilter is a drop-in replacement for DRF's SearchFilter on
+PostViewSet. Instead of `LIKE '%term%'` scans it queries an inverted index
+maintained by the database itself, picked by the vendor of the connection
+the queryset uses:
+
+* SQLite: an FTS5 external-content table `posts_post_fts` over
+  posts_post(title, content), kept in sync by triggers.
+* PostgreSQL: a generated, GIN-indexed `search_vector` tsvector column.
+
+Both are created by migration 0006_post_search and updated by the database
+on every insert, update and delete, including bulk_create() and queryset
+updates. `manage.py rebuild_search_index` reinstalls and repopulates them
+(needed on SQLite if a later migration rebuilds the posts_post table).
+
+Every word of the query must match, as a prefix ("djan" finds "Django"),
+and results are ordered by relevance with title matches weighted above
+content matches. Other databases fall back to SearchFilter.
+"""
+import re
+
+from django.db import connections
+from rest_framework import filters
+
+from .models import Post
+
+WORD_RE = re.compile(r'\w+')
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts USING fts5(
+        title, content, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete AFTER DELETE ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_update AFTER UPDATE OF title, content ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO posts_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS posts_post_fts_insert",
+    "DROP TRIGGER IF EXISTS posts_post_fts_delete",
+    "DROP TRIGGER IF EXISTS posts_post_fts_update",
+    "DROP TABLE IF EXISTS posts_post_fts",
+]
+
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE posts_post ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS posts_post_search ON posts_post USING gin (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS posts_post_search",
+    "ALTER TABLE posts_post DROP COLUMN IF EXISTS search_vector",
+]
+
+
+class SQLiteSearchEngine:
+    install_sql = SQLITE_INSTALL
+    uninstall_sql = SQLITE_UNINSTALL
+    # bm25() column weights for (title, content).
+    weights = (10.0, 1.0)
+
+    def search(self, queryset, words):
+        match = ' AND '.join(f'"{word}"*' for word in words)
+        return queryset.extra(
+            tables=['posts_post_fts'],
+            where=['posts_post_fts.rowid = posts_post.id', 'posts_post_fts MATCH %s'],
+            params=[match],
+            # bm25() is lower for better matches.
+            select={'search_rank': 'bm25(posts_post_fts, %s, %s)'},
+            select_params=self.weights,
+        ).order_by('search_rank', '-id')
+
+
+class PostgresSearchEngine:
+    install_sql = POSTGRES_INSTALL
+    uninstall_sql = POSTGRES_UNINSTALL
+
+    def search(self, queryset, words):
+        query = ' & '.join(f'{word}:*' for word in words)
+        return queryset.extra(
+            where=["posts_post.search_vector @@ to_tsquery('english', %s)"],
+            params=[query],
+            # Negated so that, as with SQLite, lower ranks sort first.
+            select={'search_rank': "-ts_rank(posts_post.search_vector, to_tsquery('english', %s))"},
+            select_params=[query],
+        ).order_by('search_rank', '-id')
+
+
+ENGINES = {
+    'sqlite': SQLiteSearchEngine,
+    'postgresql': PostgresSearchEngine,
+}
+
+
+def get_search_engine(using='default'):
+    """
+    Return the search engine for database alias `using`, or None if its
+    vendor has no full-text support here.
+    """
+    engine = ENGINES.get(connections[using].vendor)
+    return engine() if engine else None
+
+
+def install(using='default', rebuild=False):
+    """
+    Create (or with `rebuild`, recreate) the full-text index on `using`.
+    """
+    engine = get_search_engine(using)
+    if engine is None:
+        return False
+    with connections[using].cursor() as cursor:
+        for statement in (engine.uninstall_sql if rebuild else []) + engine.install_sql:
+            cursor.execute(statement)
+    return True
+
+
+def uninstall(using='default'):
+    engine = get_search_engine(using)
+    if engine is not None:
+        with connections[using].cursor() as cursor:
+            for statement in engine.uninstall_sql:
+                cursor.execute(statement)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter backed by the database's full-text index. Keeps the
+    `search` query parameter and falls back to the view's `search_fields`
+    where no index is available.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        words = [word for term in self.get_search_terms(request) for word in WORD_RE.findall(term)]
+        engine = get_search_engine(queryset.db) if queryset.model is Post else None
+        if not words or engine is None:
+            return super().filter_queryset(request, queryset, view)
+        return engine.search(queryset, words)
@@ -1,12 +1,30 @@
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from rest_framework import serializers
-from .models import Post, Comment, Like
+from .models import Post, Comment, Like, DEFAULT_COMMENT_PREVIEW_SIZE
 from django.contrib.auth import get_user_model
+from accounts.serializers import UserSummarySerializer
+from social_media_api.compiled import CompiledFieldsetSerializer
+from social_media_api.fieldsets import SparseFieldsetSerializerMixin
 
 User = get_user_model()
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class PostSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Post
+        fields = ('id', 'title')
+
+
+class CommentSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    """
+    `?expand=author` and `?expand=post` render the author and the post as
+    objects instead of the username and the post ID.
+    """
     author = serializers.StringRelatedField(read_only=True)
+    field_columns = {'author': ('author__username',)}
+    expandable_fields = {'author': (UserSummarySerializer, {}), 'post': (PostSummarySerializer, {})}
 
     class Meta:
         model = Comment
@@ -14,15 +32,48 @@ class CommentSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'author', 'created_at', 'updated_at')
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    """
+    `comments` is a preview of the latest few comments, oldest first; the
+    full list lives at /api/posts/<id>/comments/. `liked_by_me` tells
+    whether the requesting user likes the post. `?expand=author` renders
+    the author as an object instead of the username.
+    """
     author = serializers.StringRelatedField(read_only=True)
-    comments = CommentSerializer(many=True, read_only=True)
-    likes_count = serializers.IntegerField(source='likes.count', read_only=True)
+    comments = serializers.SerializerMethodField()
+    liked_by_me = serializers.SerializerMethodField()
+    # Loaded by PostQuerySet.with_comment_preview() and with_liked_by().
+    field_columns = {'author': ('author__username',), 'comments': (), 'liked_by_me': ()}
+    expandable_fields = {'author': (UserSummarySerializer, {})}
 
     class Meta:
         model = Post
-        fields = ('id', 'author', 'title', 'content', 'created_at', 'updated_at', 'comments', 'likes_count')
-        read_only_fields = ('id', 'author', 'created_at', 'updated_at', 'comments', 'likes_count')
+        fields = (
+            'id', 'author', 'title', 'content', 'created_at', 'updated_at',
+            'comments', 'likes_count', 'comments_count', 'liked_by_me',
+        )
+        read_only_fields = (
+            'id', 'author', 'created_at', 'updated_at',
+            'comments', 'likes_count', 'comments_count', 'liked_by_me',
+        )
+
+    def get_comments(self, obj):
+        preview = getattr(obj, 'comment_preview', None)
+        if preview is None:
+            # Not fetched through PostQuerySet.with_comment_preview(), e.g. a
+            # freshly created post.
+            size = getattr(settings, 'POSTS_COMMENT_PREVIEW_SIZE', DEFAULT_COMMENT_PREVIEW_SIZE)
+            preview = obj.comments.select_related('author').order_by('-created_at', '-id')[:size]
+        return CommentSerializer(reversed(list(preview)), many=True, context=self.context).data
+
+    def get_liked_by_me(self, obj):
+        liked = getattr(obj, 'liked_by_me', None)
+        if liked is None:
+            # Not fetched through PostQuerySet.with_liked_by().
+            request = self.context.get('request')
+            user = getattr(request, 'user', None)
+            liked = bool(user and user.is_authenticated) and obj.likes.filter(user=user).exists()
+        return liked
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -32,3 +83,68 @@ class LikeSerializer(serializers.ModelSerializer):
         model = Like
         fields = ('id', 'user', 'post', 'created_at')
         read_only_fields = ('id', 'user', 'created_at')
+
+
+class CompiledCommentSerializer(CompiledFieldsetSerializer):
+    """
+    CommentSerializer for lists, from .values() rows. The author is
+    rendered as the username, which is what CustomUser.__str__ returns.
+    """
+    columns = {
+        'id': ('id',),
+        'post': ('post_id',),
+        'author': ('author__username',),
+        'content': ('content',),
+        'created_at': ('created_at',),
+        'updated_at': ('updated_at',),
+    }
+    datetime_fields = ('created_at', 'updated_at')
+
+    def previews(self, post_ids):
+        """
+        Return {post_id: [comment, ...]} with the latest comments of each
+        post, oldest first, like PostQuerySet.with_comment_preview(), in one
+        ROW_NUMBER() query.
+        """
+        size = getattr(settings, 'POSTS_COMMENT_PREVIEW_SIZE', DEFAULT_COMMENT_PREVIEW_SIZE)
+        previews = {post_id: [] for post_id in post_ids}
+        if not post_ids or not size:
+            return previews
+        latest = list(
+            Comment.objects.filter(post_id__in=post_ids)
+            .annotate(rank=Window(
+                RowNumber(), partition_by=F('post_id'), order_by=(F('created_at').desc(), F('id').desc()),
+            ))
+            .filter(rank__lte=size)
+            .order_by('post_id', 'created_at', 'id')
+            .values(*self.values)
+        )
+        for row, comment in zip(latest, self.to_representation(latest)):
+            previews[row['post_id']].append(comment)
+        return previews
+
+
+class CompiledPostSerializer(CompiledFieldsetSerializer):
+    """
+    PostSerializer for lists, from .values() rows of a queryset annotated
+    by PostQuerySet.with_liked_by(); comment previews take one more query.
+    """
+    columns = {
+        'id': ('id',),
+        'author': ('author__username',),
+        'title': ('title',),
+        'content': ('content',),
+        'created_at': ('created_at',),
+        'updated_at': ('updated_at',),
+        'comments': (),
+        'likes_count': ('likes_count',),
+        'comments_count': ('comments_count',),
+        'liked_by_me': ('liked_by_me',),
+    }
+    datetime_fields = ('created_at', 'updated_at')
+
+    def getter(self, name, rows):
+        if name == 'comments':
+            previews = CompiledCommentSerializer(context=self.context).previews([row['id'] for row in rows])
+            return lambda row: previews[row['id']]
+        return super().getter(name, rows)
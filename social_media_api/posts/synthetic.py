@@ -0,0 +1,209 @@
+"""
+Helpers for building synthetic datasets, used by generate_synthetic_data
+and the benchmark commands.
+
+Everything here writes with bulk_create and skips password hashing, so
+large graphs can be generated quickly. Callers are expected to wrap the
+work in a transaction they roll back when the data is throwaway.
+"""
+import random
+import string
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from notifications.aggregation import get_window_start
+from notifications.models import Notification
+
+from .models import Comment, Like, Post
+
+User = get_user_model()
+Follow = User.followers.through
+
+BATCH_SIZE = 5000
+
+
+def power_law_weights(n, alpha=1.2):
+    """
+    Zipf-like weights: the i-th most popular user gets weight 1 / (i + 1) ** alpha.
+    """
+    return [1.0 / (i + 1) ** alpha for i in range(n)]
+
+
+def create_users(count, prefix='bench'):
+    """
+    Bulk-create `count` users with unusable passwords and return them in ID order.
+    """
+    password = make_password(None)
+    start = User.objects.count()
+    users = [
+        User(username=f'{prefix}{start + i}', password=password)
+        for i in range(count)
+    ]
+    return User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+
+
+def create_follow_graph(users, follows_per_user, alpha=1.2, rng=None):
+    """
+    Make every user follow about `follows_per_user` others, picked with a
+    power-law bias so a handful of users end up with most of the followers.
+    Follower counters of `users` are recomputed afterwards. Returns the
+    number of follow edges created.
+    """
+    rng = rng or random.Random(0)
+    cum_weights = list(accumulate(power_law_weights(len(users), alpha)))
+    rows = []
+    for follower in users:
+        picks = rng.choices(users, cum_weights=cum_weights, k=follows_per_user)
+        followed = {user.id for user in picks if user.id != follower.id}
+        rows.extend(
+            Follow(from_customuser_id=user_id, to_customuser_id=follower.id)
+            for user_id in followed
+        )
+    Follow.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    recount_follows(users)
+    return len(rows)
+
+
+def recount_follows(users):
+    """
+    Recompute followers_count and following_count of `users` from the follow table.
+    """
+    def count_by(column):
+        rows = Follow.objects.filter(**{column: OuterRef('pk')}).order_by().values(column).annotate(n=Count('*')).values('n')
+        return Coalesce(Subquery(rows), 0)
+
+    ids = [user.id for user in users]
+    for start in range(0, len(ids), BATCH_SIZE):
+        User.objects.filter(id__in=ids[start:start + BATCH_SIZE]).update(
+            followers_count=count_by('from_customuser'),
+            following_count=count_by('to_customuser'),
+        )
+
+
+def make_vocabulary(size, rng=None):
+    """
+    Return `size` distinct pseudo-words of 3 to 10 lowercase letters.
+    """
+    rng = rng or random.Random(0)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))))
+    return sorted(words)
+
+
+def text_generator(vocabulary, alpha=1.0, rng=None):
+    """
+    Return a function producing `n` words drawn from `vocabulary` with
+    Zipf-like frequencies, the first word being the most common.
+    """
+    rng = rng or random.Random(0)
+    cum_weights = list(accumulate(power_law_weights(len(vocabulary), alpha)))
+    return lambda n: ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=n))
+
+
+def build_posts(authors, posts_per_author, text=None):
+    """
+    Return `posts_per_author` unsaved posts for each author. With a `text`
+    function (see text_generator) titles and bodies are random words.
+    """
+    if text is None:
+        return [
+            Post(author=author, title=f'Post {i} by {author.username}', content='Lorem ipsum dolor sit amet.')
+            for author in authors
+            for i in range(posts_per_author)
+        ]
+    return [
+        Post(author=author, title=text(6), content=text(40))
+        for author in authors
+        for _ in range(posts_per_author)
+    ]
+
+
+def build_comments(posts, users, count, alpha=1.2, rng=None, text=None):
+    """
+    Return `count` unsaved comments by random users. Posts are picked with
+    a power-law bias over their order in `posts`, so with posts listed
+    from the most to the least followed author, popular authors get most
+    of the discussion.
+    """
+    rng = rng or random.Random(0)
+    cum_weights = list(accumulate(power_law_weights(len(posts), alpha)))
+    targets = rng.choices(posts, cum_weights=cum_weights, k=count)
+    authors = rng.choices(users, k=count)
+    return [
+        Comment(post=post, author=author, content=text(12) if text else 'Nice post!')
+        for post, author in zip(targets, authors)
+    ]
+
+
+def create_likes(posts, users, count, alpha=1.2, rng=None):
+    """
+    Bulk-create about `count` likes by random users on posts picked like
+    build_comments does; pairs drawn twice are only liked once. Returns
+    the sorted (user_id, post_id) pairs.
+    """
+    rng = rng or random.Random(0)
+    cum_weights = list(accumulate(power_law_weights(len(posts), alpha)))
+    targets = rng.choices(posts, cum_weights=cum_weights, k=count)
+    likers = rng.choices(users, k=count)
+    pairs = sorted({(user.id, post.id) for user, post in zip(likers, targets)})
+    Like.objects.bulk_create(
+        [Like(user_id=user_id, post_id=post_id) for user_id, post_id in pairs],
+        batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+    return pairs
+
+
+def recount_posts(posts):
+    """
+    Recompute likes_count and comments_count of `posts` from the Like and Comment tables.
+    """
+    def count_of(model):
+        rows = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('*')).values('n')
+        return Coalesce(Subquery(rows), 0)
+
+    ids = [post.id for post in posts]
+    for start in range(0, len(ids), BATCH_SIZE):
+        Post.objects.filter(id__in=ids[start:start + BATCH_SIZE]).update(
+            likes_count=count_of(Like),
+            comments_count=count_of(Comment),
+        )
+
+
+def build_notifications(posts, comments, likes, follows, count, days=30, rng=None):
+    """
+    Return up to `count` unsaved notifications sampled from `comments`,
+    `likes` ((user_id, post_id) pairs) and `follows` ((follower_id,
+    followed_id) pairs), with the verbs and targets the views use. They
+    are spread over the last `days` days and about half are read.
+    """
+    rng = rng or random.Random(0)
+    post_type = ContentType.objects.get_for_model(Post)
+    user_type = ContentType.objects.get_for_model(User)
+    author_ids = {post.id: post.author_id for post in posts}
+    events = [
+        *((author_ids[c.post_id], c.author_id, 'commented on your post', post_type, c.post_id) for c in comments),
+        *((author_ids[post_id], user_id, 'liked your post', post_type, post_id) for user_id, post_id in likes),
+        *((followed_id, follower_id, 'started following you', user_type, follower_id)
+          for follower_id, followed_id in follows),
+    ]
+    events = [event for event in events if event[0] != event[1]]
+
+    now = timezone.now()
+    notifications = []
+    for recipient_id, actor_id, verb, target_type, target_id in rng.sample(events, min(count, len(events))):
+        timestamp = now - timedelta(seconds=rng.randrange(days * 24 * 3600))
+        notifications.append(Notification(
+            recipient_id=recipient_id, actor_id=actor_id, verb=verb,
+            target_content_type=target_type, target_object_id=target_id,
+            unread=rng.random() < 0.5, timestamp=timestamp,
+            actor_sample=[actor_id], window_start=get_window_start(timestamp),
+        ))
+    return notifications
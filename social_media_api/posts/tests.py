@@ -1,3 +1,1012 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from notifications.models import Notification
+from social_media_api import db_router, renderers
+from social_media_api.renderers import FastJSONRenderer
+from social_media_api.sql_budget import fingerprint
+from social_media_api.testing import QueryBudgetTestMixin
+from . import response_cache
+from .models import Comment, Like, Post, TimelineEntry
+from .serializers import CompiledPostSerializer
+from .timeline import get_timeline_backend
+from .views import FeedView, PostViewSet
+
+User = get_user_model()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, ACCOUNTS_SUGGESTIONS_BACKGROUND=False)
+class FeedTimelineTests(APITestCase):
+    """
+    Tests for the materialized timeline behind FeedView.
+    """
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123')
+        self.bob = User.objects.create_user(username='bob', password='password123')
+        self.client.force_authenticate(self.alice)
+
+    def create_post(self, author, title):
+        self.client.force_authenticate(author)
+        response = self.client.post(reverse('post-list'), {'title': title, 'content': 'Body'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(self.alice)
+        return Post.objects.get(pk=response.data['id'])
+
+    def feed_titles(self):
+        response = self.client.get(reverse('feed'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['title'] for post in response.data['results']]
+
+    def test_new_posts_are_pushed_to_followers(self):
+        self.client.post(reverse('follow', args=[self.bob.id]))
+        self.create_post(self.bob, 'First')
+        self.create_post(self.bob, 'Second')
+
+        self.assertEqual(TimelineEntry.objects.filter(user=self.alice).count(), 2)
+        self.assertEqual(self.feed_titles(), ['Second', 'First'])
+
+    def test_follow_and_unfollow_update_the_timeline(self):
+        self.create_post(self.bob, 'Earlier')
+
+        self.client.post(reverse('follow', args=[self.bob.id]))
+        self.assertEqual(self.feed_titles(), ['Earlier'])
+
+        self.client.post(reverse('unfollow', args=[self.bob.id]))
+        self.assertEqual(self.feed_titles(), [])
+
+    def test_check_timelines_detects_and_repairs_drift(self):
+        self.client.post(reverse('follow', args=[self.bob.id]))
+        self.create_post(self.bob, 'Post')
+        TimelineEntry.objects.all().delete()
+
+        with self.assertRaises(CommandError):
+            call_command('check_timelines', stdout=StringIO())
+        call_command('check_timelines', repair=True, stdout=StringIO())
+
+        self.assertEqual(self.feed_titles(), ['Post'])
+
+    @skipUnless(connection.vendor == 'sqlite', "Reads SQLite's query plan.")
+    def test_feed_pages_are_index_range_scans(self):
+        self.client.post(reverse('follow', args=[self.bob.id]))
+        for i in range(3):
+            self.create_post(self.bob, f'Post {i}')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('feed'), {'pagination': 'cursor', 'page_size': 2})
+            self.client.get(response.data['next'])
+        pages = [query['sql'] for query in queries if 'posts_timelineentry' in query['sql']]
+        self.assertTrue(pages)
+        with connection.cursor() as cursor:
+            for sql in pages:
+                plan = ' '.join(row[-1] for row in cursor.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall())
+                self.assertIn('posts_timeline_user_feed', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_migration_backfills_existing_follows(self):
+        backfill = import_module('posts.migrations.0007_timeline_feed_index').backfill_timelines
+        self.bob.followers.add(self.alice)
+        post = Post.objects.create(author=self.bob, title='Before timelines', content='Body')
+        Post.objects.create(author=self.alice, title='Not followed', content='Body')
+
+        # Run twice: existing entries are kept, not duplicated.
+        schema_editor = connection.schema_editor()
+        backfill(apps, schema_editor)
+        backfill(apps, schema_editor)
+        self.assertEqual(list(TimelineEntry.objects.values_list('user', 'post')), [(self.alice.id, post.id)])
+        self.assertEqual(self.feed_titles(), ['Before timelines'])
+
+    @override_settings(
+        POSTS_TIMELINE_BACKEND='posts.timeline.HybridTimelineBackend',
+        POSTS_FEED_FANOUT_THRESHOLD=2,
+    )
+    def test_hybrid_feed_merges_pulled_authors(self):
+        carol = User.objects.create_user(username='carol', password='password123')
+        self.client.force_authenticate(carol)
+        self.client.post(reverse('follow', args=[self.bob.id]))  # bob now has 2 followers once alice follows
+        self.client.force_authenticate(self.alice)
+        self.client.post(reverse('follow', args=[self.bob.id]))
+        self.client.post(reverse('follow', args=[carol.id]))
+
+        self.create_post(self.bob, 'Pulled 1')
+        self.create_post(carol, 'Pushed')
+        self.create_post(self.bob, 'Pulled 2')
+
+        self.assertFalse(TimelineEntry.objects.filter(post__author=self.bob).exists())
+        self.assertEqual(self.feed_titles(), ['Pulled 2', 'Pushed', 'Pulled 1'])
+        response = self.client.get(reverse('feed'), {'page_size': 2, 'page': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([post['title'] for post in response.data['results']], ['Pulled 1'])
+
+        response = self.client.get(reverse('feed'), {'pagination': 'cursor', 'page_size': 2})
+        response = self.client.get(response.data['next'])
+        self.assertEqual([post['title'] for post in response.data['results']], ['Pulled 1'])
+
+
+    @override_settings(
+        POSTS_TIMELINE_BACKEND='posts.timeline.HybridTimelineBackend',
+        POSTS_FEED_FANOUT_THRESHOLD=1,
+        NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    )
+    def test_hybrid_feed_cost_does_not_grow_with_pulled_authors(self):
+        def feed_queries():
+            counts = []
+            for params in ({}, {'pagination': 'cursor'}):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('feed'), params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                counts.append(len(queries))
+            return counts
+
+        authors = [User.objects.create_user(username=f'celebrity{i}') for i in range(8)]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('follow', args=[authors[0].id]))
+        self.create_post(authors[0], 'Post 0')
+        feed_queries()  # warm the follow cache
+        expected = feed_queries()
+        for i, author in enumerate(authors[1:], 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('follow', args=[author.id]))
+            self.create_post(author, f'Post {i}')
+        self.assertEqual(feed_queries(), expected)
+        self.assertLessEqual(max(expected), FeedView.query_budget)
+        self.assertEqual(self.feed_titles()[:3], ['Post 7', 'Post 6', 'Post 5'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CursorPaginationTests(APITestCase):
+    """
+    Tests for keyset (cursor) pagination on the post endpoints.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.posts = [
+            Post.objects.create(author=self.user, title=f'Post {i}', content='Body')
+            for i in range(5)
+        ]
+
+    def test_walks_forwards_and_backwards_without_count(self):
+        url = reverse('post-list')
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 2})
+        self.assertNotIn('count', response.data)
+
+        titles = [post['title'] for post in response.data['results']]
+        pages = [response.data]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            titles += [post['title'] for post in response.data['results']]
+            pages.append(response.data)
+        self.assertEqual(titles, [f'Post {i}' for i in range(4, -1, -1)])
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.client.get(pages[-1]['previous'])
+        self.assertEqual(response.data['results'], pages[-2]['results'])
+
+    def test_new_posts_do_not_shift_later_pages(self):
+        url = reverse('post-list')
+        first = self.client.get(url, {'pagination': 'cursor', 'page_size': 2})
+        Post.objects.create(author=self.user, title='Newer', content='Body')
+
+        second = self.client.get(first.data['next'])
+        self.assertEqual([post['title'] for post in second.data['results']], ['Post 2', 'Post 1'])
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse('post-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class PostCounterTests(APITestCase):
+    """
+    Tests for the denormalized like and comment counters on Post.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.post = Post.objects.create(author=self.user, title='Post', content='Body')
+        self.client.force_authenticate(self.user)
+
+    def test_like_and_unlike_adjust_likes_count(self):
+        self.client.post(reverse('like-post', args=[self.post.id]))
+        self.client.post(reverse('like-post', args=[self.post.id]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+        self.client.post(reverse('unlike-post', args=[self.post.id]))
+        self.client.post(reverse('unlike-post', args=[self.post.id]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_comment_create_and_delete_adjust_comments_count(self):
+        response = self.client.post(reverse('comment-list'), {'post': self.post.id, 'content': 'Hi'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+        self.client.delete(reverse('comment-detail', args=[response.data['id']]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_reconcile_post_counters_repairs_drift(self):
+        Like.objects.create(user=self.user, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(comments_count=7)
+
+        call_command('reconcile_post_counters', stdout=StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (1, 0))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, POSTS_COMMENT_PREVIEW_SIZE=2)
+class CommentPreviewTests(APITestCase):
+    """
+    Tests for the bounded comment preview and the comments sub-resource.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.posts = [
+            Post.objects.create(author=self.user, title=f'Post {i}', content='Body')
+            for i in range(3)
+        ]
+        for post in self.posts:
+            for i in range(4):
+                Comment.objects.create(post=post, author=self.user, content=f'Comment {i}')
+
+    def test_list_embeds_latest_comments_in_one_query(self):
+        # validators + posts page + count + comment previews for the whole page
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('post-list'))
+        for post in response.data['results']:
+            self.assertEqual([c['content'] for c in post['comments']], ['Comment 2', 'Comment 3'])
+
+    def test_comments_sub_resource_is_paginated(self):
+        url = reverse('post-comments', args=[self.posts[0].id])
+        response = self.client.get(url, {'page_size': 3})
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(
+            [c['content'] for c in response.data['results']],
+            ['Comment 0', 'Comment 1', 'Comment 2'],
+        )
+
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 3})
+        response = self.client.get(response.data['next'])
+        self.assertEqual([c['content'] for c in response.data['results']], ['Comment 3'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class FullTextSearchTests(APITestCase):
+    """
+    Tests for the indexed search on PostViewSet.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123')
+
+    def search(self, query):
+        response = self.client.get(reverse('post-list'), {'search': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['title'] for post in response.data['results']]
+
+    def test_ranks_by_relevance_and_matches_prefixes(self):
+        Post.objects.create(author=self.user, title='Cooking notes', content='A little about Django.')
+        Post.objects.create(author=self.user, title='Django tips', content='Django querysets and Django views.')
+        Post.objects.create(author=self.user, title='Gardening', content='Nothing relevant.')
+
+        self.assertEqual(self.search('django'), ['Django tips', 'Cooking notes'])
+        self.assertEqual(self.search('djan'), ['Django tips', 'Cooking notes'])
+        self.assertEqual(self.search('djan query'), ['Django tips'])
+        self.assertEqual(self.search('"unbalanced'), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = Post.objects.create(author=self.user, title='Draft', content='Old words')
+        post.content = 'Fresh words'
+        post.save()
+        self.assertEqual(self.search('old'), [])
+        self.assertEqual(self.search('fresh'), ['Draft'])
+
+        Post.objects.filter(pk=post.pk).update(title='Final')
+        self.assertEqual(self.search('final'), ['Final'])
+
+        post.delete()
+        self.assertEqual(self.search('fresh'), [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        Post.objects.bulk_create([Post(author=self.user, title='Bulk', content='Inserted in bulk')])
+        self.assertEqual(self.search('bulk'), ['Bulk'])
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+)
+class IdempotentLikeTests(APITestCase):
+    """
+    Tests for PUT/DELETE /api/posts/<id>/like/.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.fan = User.objects.create_user(username='fan', password='password123')
+        self.post = Post.objects.create(author=self.author, title='Post', content='Body')
+        self.url = reverse('like-post', args=[self.post.id])
+        self.client.force_authenticate(self.fan)
+
+    def send(self, method):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.post.refresh_from_db()
+        return response.data
+
+    def test_put_and_delete_are_idempotent(self):
+        self.assertEqual(self.send('put'), {'liked': True, 'changed': True})
+        self.assertEqual(self.send('put'), {'liked': True, 'changed': False})
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.author).count(), 1)
+
+        self.assertEqual(self.send('delete'), {'liked': False, 'changed': True})
+        self.assertEqual(self.send('delete'), {'liked': False, 'changed': False})
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_transition_is_one_insert_and_one_update(self):
+        self.client.put(self.url)  # warm the ContentType cache
+        self.client.delete(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.put(self.url)
+        statements = [q['sql'] for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual([sql.split()[0] for sql in statements], ['INSERT', 'UPDATE'])
+
+    def test_missing_post(self):
+        url = reverse('like-post', args=[self.post.id + 1])
+        self.assertEqual(self.client.put(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_post_deleted_concurrently(self):
+        self.send('put')
+        adjust = Post.adjust_likes_count
+
+        def delete_then_adjust(pk, delta, connection):
+            Post.objects.filter(pk=pk).delete()
+            return adjust(pk, delta, connection)
+
+        with mock.patch.object(Post, 'adjust_likes_count', side_effect=delete_then_adjust):
+            self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class LikedByMeTests(APITestCase):
+    """
+    Tests for the per-user like state of posts.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123')
+        self.posts = [Post.objects.create(author=self.user, title=f'Post {i}', content='Body') for i in range(4)]
+        Like.objects.create(user=self.user, post=self.posts[1])
+        Like.objects.create(user=self.user, post=self.posts[3])
+
+    def liked_titles(self, response):
+        return {post['title'] for post in response.data['results'] if post['liked_by_me']}
+
+    def test_list_and_feed_annotate_liked_by_me(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(4):  # validators, count, page with EXISTS, comment previews
+            response = self.client.get(reverse('post-list'))
+        self.assertEqual(self.liked_titles(response), {'Post 1', 'Post 3'})
+
+        follower = User.objects.create_user(username='bob', password='password123')
+        Like.objects.create(user=follower, post=self.posts[0])
+        self.client.force_authenticate(follower)
+        self.client.post(reverse('follow', args=[self.user.id]))
+        self.assertEqual(self.liked_titles(self.client.get(reverse('feed'))), {'Post 0'})
+
+        self.client.logout()
+        self.assertEqual(self.liked_titles(self.client.get(reverse('post-list'))), set())
+
+    def test_batch_state_endpoint(self):
+        self.client.force_authenticate(self.user)
+        ids = ','.join(str(post.id) for post in self.posts[:2])
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('post-likes-state'), {'ids': f'{ids},999'})
+        self.assertEqual(response.data, {str(self.posts[0].id): False, str(self.posts[1].id): True, '999': False})
+
+        self.assertEqual(self.client.get(reverse('post-likes-state'), {'ids': 'a,b'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('post-likes-state'), {'ids': ids}).status_code, 401)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+)
+class ConditionalGetTests(APITestCase):
+    """
+    Tests for ETag handling on posts and the feed.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.reader = User.objects.create_user(username='reader', password='password123')
+        self.posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='Body') for i in range(3)]
+        self.client.force_authenticate(self.reader)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_list_not_modified_until_page_changes(self):
+        url = reverse('post-list')
+        first = self.client.get(url)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertNotIn('Last-Modified', first)
+
+        with self.assertNumQueries(1):
+            response = self.revalidate(url, first)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        # Likes only move the counters, which the ETag still catches.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse('like-post', args=[self.posts[0].id]))
+        second = self.revalidate(url, first)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+        # A deletion changes the page and the total count.
+        self.posts[2].delete()
+        self.assertEqual(self.revalidate(url, second).status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_query_and_user(self):
+        url = reverse('post-list')
+        first = self.client.get(url)
+        self.assertNotEqual(self.client.get(url + '?page_size=1')['ETag'], first['ETag'])
+        self.assertNotEqual(self.client.get(url + '?pagination=cursor')['ETag'], first['ETag'])
+        self.assertNotIn('ETag', self.client.get(url + '?search=post'))
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.revalidate(url, first).status_code, status.HTTP_200_OK)
+
+    def test_if_modified_since_is_ignored(self):
+        # updated_at does not move with likes or comments, so a date alone
+        # would answer 304 for a stale page.
+        since = http_date(time.time() + 60)
+        for url in (reverse('post-list'), reverse('post-detail', args=[self.posts[0].id])):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('Last-Modified', response)
+
+    def test_detail_and_feed(self):
+        url = reverse('post-detail', args=[self.posts[0].id])
+        first = self.client.get(url)
+        self.assertEqual(self.revalidate(url, first).status_code, status.HTTP_304_NOT_MODIFIED)
+        Comment.objects.create(post=self.posts[0], author=self.reader, content='Hi')
+        Post.adjust_counters(self.posts[0].pk, comments_count=1)
+        self.assertEqual(self.revalidate(url, first).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('post-detail', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.post(reverse('follow', args=[self.author.id]))
+        feed = self.client.get(reverse('feed'))
+        self.assertEqual(len(feed.data['results']), 3)
+        self.assertEqual(self.revalidate(reverse('feed'), feed).status_code, status.HTTP_304_NOT_MODIFIED)
+        Post.adjust_counters(self.posts[1].pk, likes_count=1)
+        self.assertEqual(self.revalidate(reverse('feed'), feed).status_code, status.HTTP_200_OK)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ResponseCacheTests(APITestCase):
+    """
+    Tests for the versioned response cache of anonymous post reads.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.post = Post.objects.create(author=self.author, title='Post', content='Body')
+        self.list_url = reverse('post-list')
+        self.detail_url = reverse('post-detail', args=[self.post.id])
+
+    def get(self, url, expected):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], expected)
+        return response
+
+    def test_anonymous_reads_are_cached_until_a_write(self):
+        first = self.get(self.list_url, 'MISS')
+        with self.assertNumQueries(0):
+            second = self.get(self.list_url, 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.get(self.detail_url, 'MISS')
+        # Parameter order does not matter.
+        self.get(self.list_url + '?page_size=5&page=1', 'MISS')
+        self.get(self.list_url + '?page=1&page_size=5', 'HIT')
+
+        Comment.objects.create(post=self.post, author=self.author, content='Hi')
+        self.get(self.detail_url, 'MISS')
+        Post.adjust_counters(self.post.pk, comments_count=1)
+        response = self.get(self.list_url, 'MISS')
+        self.assertEqual(response.data['results'][0]['comments_count'], 1)
+
+        # The raw SQL like path bumps the versions as well.
+        fan = User.objects.create_user(username='fan', password='password123')
+        Like.add(fan.id, self.post.id)
+        self.assertEqual(self.get(self.detail_url, 'MISS').data['likes_count'], 1)
+
+        other = Post.objects.create(author=self.author, title='Other', content='Body')
+        self.get(self.list_url, 'MISS')
+        self.get(reverse('post-detail', args=[other.id]), 'MISS')
+        # Posts of other authors keep their cached details.
+        self.get(self.detail_url, 'HIT')
+
+        self.author.username = 'renamed'
+        self.author.save()
+        self.assertEqual(self.get(self.detail_url, 'MISS').data['author'], 'renamed')
+
+    def test_revalidation_and_authenticated_requests(self):
+        first = self.get(self.list_url, 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.force_authenticate(self.author)
+        self.assertNotIn('X-Cache', self.client.get(self.list_url))
+        with override_settings(POSTS_RESPONSE_CACHE_TTL=0):
+            self.client.logout()
+            self.assertNotIn('X-Cache', self.client.get(self.list_url))
+
+    def test_only_the_lock_holder_recomputes(self):
+        self.get(self.list_url, 'MISS')
+        view = PostViewSet(action='list')
+        request = Request(APIRequestFactory().get(self.list_url))
+        key = view.get_response_cache_key(request, [response_cache.EPOCH_KEY, response_cache.LIST_KEY])
+        entry = cache.get(key)
+        entry['fresh_until'] = 0
+        cache.set(key, entry)
+
+        # Someone else holds the lock: the stale copy is served.
+        cache.add(key + ':lock', 1)
+        with self.assertNumQueries(0):
+            self.get(self.list_url, 'STALE')
+        cache.delete(key + ':lock')
+        self.get(self.list_url, 'MISS')
+        self.get(self.list_url, 'HIT')
+
+        # No copy at all: wait for the lock holder, then compute anyway.
+        cache.delete(key)
+        cache.add(key + ':lock', 1)
+        with override_settings(POSTS_RESPONSE_CACHE_LOCK_WAIT=0.1):
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Cache', response)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'], DATABASE_REPLICA_LAG=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    Tests for the read-replica router and middleware.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.router = db_router.ReplicaRouter()
+        self.middleware = db_router.ReplicaMiddleware(self.record)
+        self.factory = RequestFactory()
+
+    def record(self, request):
+        self.chosen = db_router.current_replica()
+        return HttpResponse()
+
+    def send(self, method, cookies=None, **headers):
+        request = getattr(self.factory, method)('/api/posts/', **headers)
+        request.COOKIES.update(cookies or {})
+        self.response = self.middleware(request)
+        return self.chosen
+
+    def test_router(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        with db_router.use_replica('replica_2'):
+            self.assertEqual(self.router.db_for_read(Post), 'replica_2')
+            self.assertEqual(self.router.db_for_read(Token), 'default')
+            self.assertEqual(self.router.db_for_write(Post), 'default')
+        self.assertFalse(self.router.allow_migrate('replica_1', 'posts'))
+        self.assertIsNone(self.router.allow_migrate('default', 'posts'))
+
+    def test_safe_requests_use_replicas_until_the_client_writes(self):
+        auth = {'HTTP_AUTHORIZATION': 'Token abc'}
+        self.assertIn(self.send('get', **auth), ['replica_1', 'replica_2'])
+        self.assertIsNone(self.send('post', **auth))
+        pin = {db_router.PIN_COOKIE: self.response.cookies[db_router.PIN_COOKIE].value}
+        # The cookie keeps the client on the primary for the lag window, in
+        # any process; other clients are not affected.
+        self.assertIsNone(self.send('get', cookies=pin, **auth))
+        self.assertIsNotNone(self.send('get', HTTP_AUTHORIZATION='Token other'))
+        self.assertIsNotNone(self.send('get'))
+        self.assertIsNone(db_router.current_replica())
+        # A per-process cache cannot pin clients dropping the cookie ...
+        self.assertIsNotNone(self.send('get', **auth))
+        # ... a shared one can.
+        with mock.patch('social_media_api.caches.is_shared', return_value=True):
+            self.send('post', **auth)
+            self.assertIsNone(self.send('get', **auth))
+
+        with override_settings(DATABASE_REPLICA_LAG=-1):
+            self.assertIsNotNone(self.send('get', cookies=pin))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertIsNone(self.send('get'))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReplicaInstrumentationTests(APITestCase):
+    """
+    Tests for per-alias query counts.
+    """
+
+    def test_query_counts_per_alias(self):
+        db_router.reset_query_counts()
+        user = User.objects.create_user(username='alice', password='password123')
+        Post.objects.create(author=user, title='Post', content='Body')
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse('post-list'))
+        self.assertEqual(response['X-DB-Queries'], 'default=4')
+        self.assertEqual(db_router.query_counts(), {'default': 4})
+
+
+class SQLiteReplicaCopyTests(TransactionTestCase):
+    """
+    Tests for copying the database to a SQLite stand-in replica, which
+    cannot run inside the test case's transaction.
+    """
+
+    def test_copy_sqlite(self):
+        user = User.objects.create_user(username='alice', password='password123')
+        Post.objects.create(author=user, title='Post', content='Body')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            db_router.copy_sqlite(path)
+            with sqlite3.connect(path) as copy:
+                self.assertEqual(copy.execute('SELECT title FROM posts_post').fetchall(), [('Post',)])
+            copy.close()
+
+        with self.assertRaisesMessage(CommandError, 'No SQLite replicas configured'):
+            call_command('sync_sqlite_replicas', stdout=StringIO())
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+    ACCOUNTS_SUGGESTIONS_BACKGROUND=False,
+)
+class PostQueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    """
+    Every posts route stays within the query budget its view declares,
+    with enough rows on each page that an N+1 pattern would exceed it.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.reader = User.objects.create_user(username='reader', password='password123')
+        others = [User.objects.create_user(username=f'user{i}', password='password123') for i in range(3)]
+        self.authenticate(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('follow', args=[self.author.id]))
+        self.posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='Body') for i in range(4)]
+        for post in self.posts:
+            get_timeline_backend().add_post(post)
+            for user in others:
+                Comment.objects.create(post=post, author=user, content='Comment')
+                Like.add(user.id, post.id)
+            Post.adjust_counters(post.pk, comments_count=len(others))
+        self.comment = Comment.objects.create(post=self.posts[0], author=self.reader, content='Mine')
+
+    def test_routes_within_budget(self):
+        post = self.posts[0]
+        check = self.assertWithinQueryBudget
+        check('get', reverse('api-root'), budget=0, status=200)
+        check('get', reverse('post-list'), status=200)
+        check('get', reverse('post-list') + '?pagination=cursor', status=200)
+        check('get', reverse('post-list') + '?search=post', status=200)
+        check('get', reverse('post-detail', args=[post.id]), status=200)
+        check('get', reverse('post-likes-state') + f'?ids={post.id},{self.posts[1].id}', status=200)
+        check('get', reverse('post-comments', args=[post.id]), status=200)
+        check('get', reverse('feed'), status=200)
+        check('get', reverse('comment-list'), status=200)
+        check('get', reverse('comment-detail', args=[self.comment.id]), status=200)
+
+        check('post', reverse('comment-list'), {'post': post.id, 'content': 'New'}, status=201)
+        check('patch', reverse('comment-detail', args=[self.comment.id]), {'content': 'Edited'}, status=200)
+        check('delete', reverse('comment-detail', args=[self.comment.id]), status=204)
+        check('put', reverse('like-post', args=[post.id]), status=200)
+        check('delete', reverse('like-post', args=[post.id]), status=200)
+        check('post', reverse('like-post', args=[post.id]), status=201)
+        check('post', reverse('unlike-post', args=[post.id]), status=200)
+
+        self.authenticate(self.author)
+        created = check('post', reverse('post-list'), {'title': 'New', 'content': 'Body'}, status=201)
+        check('patch', reverse('post-detail', args=[created.data['id']]), {'title': 'Renamed'}, status=200)
+        check('delete', reverse('post-detail', args=[created.data['id']]), status=204)
+
+        self.client.logout()
+        check('get', reverse('post-list'), status=200)
+        self.assertRoutesBudgeted('posts.urls')
+
+    def test_server_timing_and_log(self):
+        self.client.logout()
+        with self.assertLogs('social_media_api.sql', 'INFO') as logs:
+            response = self.client.get(reverse('post-list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries"$')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'posts.views.PostViewSet.list')
+        self.assertEqual(record['budget'], 4)
+        self.assertFalse(record['over_budget'])
+        self.assertEqual(logs.records[-1].levelname, 'INFO')
+
+        # A token lookup is allowed on top of the view's budget.
+        self.authenticate(self.reader)
+        with self.assertLogs('social_media_api.sql', 'INFO') as logs:
+            self.client.get(reverse('post-list'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['budget'], record['over_budget']), (5, False))
+        self.assertEqual(logs.records[-1].levelname, 'INFO')
+
+    def test_fingerprint_folds_literals(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 1 AND b = 'x' AND c IN (%s, %s, %s)"),
+            fingerprint("SELECT * FROM t WHERE a = 22 AND b = 'y'  AND c IN (%s, %s)"),
+        )
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    NOTIFICATIONS_QUEUE_BACKEND='notifications.queue.ImmediateQueueBackend',
+)
+class SyntheticDataTests(APITestCase):
+    def test_generate_and_benchmark(self):
+        call_command(
+            'generate_synthetic_data', users=40, follows=5, posts=2, comments=2, likes=3, notifications=3,
+            stdout=StringIO(),
+        )
+        users = User.objects.filter(username__startswith='synth')
+        self.assertEqual(users.count(), 40)
+        self.assertEqual(Post.objects.count(), 80)
+        self.assertEqual(Comment.objects.count(), 160)
+        self.assertTrue(Notification.objects.exists())
+        for post in Post.objects.all():
+            self.assertEqual(post.likes_count, post.likes.count())
+            self.assertEqual(post.comments_count, post.comments.count())
+        follower = users.filter(following_count__gt=0).first()
+        self.assertEqual(get_timeline_backend().check(follower), (set(), set()))
+        likes = Like.objects.count()
+        follows = User.followers.through.objects.count()
+
+        out = StringIO()
+        call_command('benchmark_api', requests=5, warmup=1, clients=5, json='-', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(
+            set(report['endpoints']),
+            {'feed', 'post-list', 'post-detail', 'like', 'unlike', 'follow', 'unfollow', 'notifications'},
+        )
+        for endpoint, summary in report['endpoints'].items():
+            self.assertEqual(summary['requests'], 5, endpoint)
+            self.assertEqual(summary['errors'], 0, endpoint)
+            self.assertLessEqual(summary['p50_ms'], summary['p95_ms'])
+            self.assertLessEqual(summary['p95_ms'], summary['p99_ms'])
+            self.assertGreater(summary['queries_mean'], 0)
+        # Likes and follows were undone.
+        self.assertEqual(Like.objects.count(), likes)
+        self.assertEqual(User.followers.through.objects.count(), follows)
+
+    def test_benchmark_skips_clients_with_nothing_left_to_do(self):
+        alice, bob = (User.objects.create_user(username=f'synth{i}') for i in range(2))
+        post = Post.objects.create(author=alice, title='Post', content='Body')
+        for user in (alice, bob):
+            Like.add(user.id, post.id)
+        with self.assertRaisesMessage(CommandError, "'like'"):
+            call_command('benchmark_api', scenarios='like', requests=1, warmup=0, stdout=StringIO())
+
+        # alice already follows bob, so only bob follows and unfollows.
+        alice.following.add(bob)
+        out = StringIO()
+        call_command('benchmark_api', scenarios='follow', requests=3, warmup=0, json='-', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['endpoints']['follow']['errors'], 0)
+        self.assertEqual(list(bob.following.all()), [])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CompiledSerializerTests(APITestCase):
+    """
+    List endpoints render the same bytes through the compiled serializers
+    as through the DRF ones.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.reader = User.objects.create_user(username='r\u00e9ader', password='password123')
+        self.reader.following.add(self.author)
+        now = timezone.now()
+        for i in range(14):
+            post = Post.objects.create(author=self.author, title=f'Post {i} \u2028 \u00fc', content='Body "quoted"\n')
+            Post.objects.filter(pk=post.pk).update(created_at=now - timedelta(minutes=i, microseconds=i))
+            for j in range(i % 5):
+                Comment.objects.create(post=post, author=self.reader if j % 2 else self.author, content=f'Comment {j}')
+            Post.adjust_counters(post.pk, comments_count=i % 5)
+            if i % 3 == 0:
+                Like.add(self.reader.id, post.id)
+        for post in Post.objects.all():
+            get_timeline_backend().add_post(post)
+
+    def assertSameBytes(self, url, params=None):
+        cache.clear()
+        with override_settings(API_COMPILED_SERIALIZERS=False):
+            expected = self.client.get(url, params)
+        cache.clear()
+        with override_settings(API_COMPILED_SERIALIZERS=True):
+            actual = self.client.get(url, params)
+        self.assertEqual(actual.status_code, 200, url)
+        self.assertEqual(actual.content, expected.content, url)
+        return actual
+
+    def test_lists_match_drf_serializers(self):
+        for client_user in (None, self.reader):
+            self.client.force_authenticate(client_user)
+            for url in (reverse('post-list'), reverse('comment-list')):
+                self.assertSameBytes(url)
+                self.assertSameBytes(url, {'page': 2, 'page_size': 5})
+                first = self.assertSameBytes(url, {'pagination': 'cursor'})
+                self.assertSameBytes(first.data['next'])
+        self.assertSameBytes(reverse('feed'))
+        self.assertSameBytes(reverse('feed'), {'pagination': 'cursor'})
+
+    def test_compiled_serializer_is_used(self):
+        self.client.force_authenticate(self.reader)
+        with mock.patch.object(
+            CompiledPostSerializer, 'to_representation', autospec=True,
+            side_effect=CompiledPostSerializer.to_representation,
+        ) as to_representation:
+            self.client.get(reverse('post-list'))
+            self.client.get(reverse('feed'))
+            # Ranked search results go through PostSerializer.
+            self.client.get(reverse('post-list'), {'search': 'post'})
+        self.assertEqual(to_representation.call_count, 2)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SparseFieldsetTests(APITestCase):
+    """
+    Tests for `?fields=` and `?expand=` on the post, feed and comment lists.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.reader = User.objects.create_user(username='reader', password='password123')
+        self.reader.following.add(self.author)
+        for i in range(3):
+            post = Post.objects.create(author=self.author, title=f'Post {i}', content='Body')
+            Comment.objects.create(post=post, author=self.reader, content=f'Comment {i}')
+            get_timeline_backend().add_post(post)
+        self.client.force_authenticate(self.reader)
+
+    def get(self, url, params, compiled=True):
+        with override_settings(API_COMPILED_SERIALIZERS=compiled), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response, ' '.join(query['sql'] for query in queries)
+
+    def test_fields_trim_the_output_and_the_sql(self):
+        params = {'fields': 'likes_count,id,title,author', 'pagination': 'cursor', 'page_size': 2}
+        for url in (reverse('post-list'), reverse('feed')):
+            for compiled in (True, False):
+                response, sql = self.get(url, params, compiled)
+                results = response.data['results']
+                self.assertEqual(list(results[0]), ['id', 'author', 'title', 'likes_count'])
+                self.assertEqual(results[0]['author'], 'author')
+                self.assertNotIn('"posts_post"."content"', sql)
+                self.assertNotIn('"accounts_customuser"."password"', sql)
+                self.assertNotIn('posts_comment', sql)
+                self.assertNotIn('posts_like', sql)
+                with override_settings(API_COMPILED_SERIALIZERS=compiled):
+                    results = self.client.get(response.data['next']).data['results']
+                self.assertEqual(list(results[0])[1:], ['author', 'title', 'likes_count'])
+                self.assertEqual(results[0]['title'], 'Post 0')
+
+        response, sql = self.get(reverse('post-detail', args=[Post.objects.first().pk]), {'fields': 'title'})
+        self.assertEqual(response.data, {'title': 'Post 2'})
+        self.assertNotIn('posts_comment', sql)
+
+        for compiled in (True, False):
+            response, sql = self.get(reverse('comment-list'), {'fields': 'id,content'}, compiled)
+            self.assertEqual(list(response.data['results'][0]), ['id', 'content'])
+            self.assertNotIn('"posts_post"', sql)
+            self.assertNotIn('accounts_customuser', sql)
+
+    def test_expand(self):
+        response, sql = self.get(reverse('post-list'), {'fields': 'title', 'expand': 'author'})
+        self.assertEqual(
+            response.data['results'][0], {'author': {'id': self.author.id, 'username': 'author'}, 'title': 'Post 2'},
+        )
+        self.assertNotIn('"accounts_customuser"."password"', sql)
+
+        response = self.client.get(reverse('feed'), {'expand': 'author'})
+        self.assertEqual(response.data['results'][0]['author'], {'id': self.author.id, 'username': 'author'})
+        self.assertEqual(len(response.data['results'][0]['comments']), 1)
+
+        post = Post.objects.get(title='Post 0')
+        response, sql = self.get(reverse('comment-list'), {'expand': 'post'})
+        self.assertEqual(response.data['results'][0]['post'], {'id': post.id, 'title': 'Post 0'})
+        self.assertEqual(response.data['results'][0]['author'], 'reader')
+        self.assertNotIn('"posts_post"."content"', sql)
+
+    def test_unknown_names_are_rejected(self):
+        response = self.client.get(reverse('post-list'), {'fields': 'title,password', 'expand': 'comments'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'fields', 'expand'})
+        response = self.client.get(reverse('comment-list'), {'fields': 'liked_by_me'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_writes_ignore_the_parameters(self):
+        post = Post.objects.first()
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            reverse('post-detail', args=[post.pk]) + '?fields=id', {'title': 'Renamed'}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Renamed')
+        self.assertIn('comments', response.data)
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    data = {
+        'text': 'caf\u00e9 \u2028 \u2029 "quoted" \\ \x1f \U0001f600',
+        'when': timezone.now(),
+        'date': timezone.now().date(),
+        'amount': Decimal('1.50'),
+        'lazy': gettext_lazy('Not found.'),
+        'nested': [{'id': 1, 'ok': True, 'none': None}, [], {}],
+    }
+
+    def test_same_bytes_as_json_renderer(self):
+        with mock.patch.object(renderers.orjson, 'dumps', wraps=renderers.orjson.dumps) as dumps:
+            for data in (self.data, [self.data], {}, 'x'):
+                self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(dumps.call_count, 4)
+
+    def test_falls_back_to_json_renderer(self):
+        context = {'indent': 2}
+        self.assertEqual(FastJSONRenderer().render(self.data, renderer_context=context),
+                         JSONRenderer().render(self.data, renderer_context=context))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        # Beyond 64 bits, which orjson refuses.
+        self.assertEqual(FastJSONRenderer().render({'big': 2 ** 70}), JSONRenderer().render({'big': 2 ** 70}))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
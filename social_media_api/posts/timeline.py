@@ -0,0 +1,292 @@
+"""
+Timeline backends used by FeedView.
+
+A backend decides how a user's feed is produced:
+
+* PullTimelineBackend builds the feed at read time from the follow graph
+  (fan-out-on-read). This is the original FeedView behaviour.
+* DatabaseTimelineBackend materializes one TimelineEntry row per
+  (follower, post) when the post is written (fan-out-on-write), so reading
+  a feed is an indexed range scan on (user, created_at).
+* HybridTimelineBackend pushes posts of ordinary authors like the database
+  backend, but pulls posts of authors with at least
+  POSTS_FEED_FANOUT_THRESHOLD followers at read time and merges them in.
+
+Feeds carry each post's position as the `feed_created_at` and `feed_id`
+annotations and are ordered by them (FEED_ORDERING), so FeedView pages
+and keyset-filters on the timeline entry's columns where there is one.
+
+The active backend is selected with the POSTS_TIMELINE_BACKEND setting.
+Read paths take the user's followed IDs from accounts.follow_cache rather
+than joining the follow table.
+"""
+import heapq
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from accounts.follow_cache import get_following_ids
+from .models import Post, TimelineEntry
+
+DEFAULT_TIMELINE_BACKEND = 'posts.timeline.DatabaseTimelineBackend'
+DEFAULT_FANOUT_THRESHOLD = 10000
+BATCH_SIZE = 1000
+FEED_ORDERING = ('-feed_created_at', '-feed_id')
+
+_backend = None
+
+
+def get_timeline_backend():
+    """
+    Return the configured timeline backend instance (cached per process).
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'POSTS_TIMELINE_BACKEND', DEFAULT_TIMELINE_BACKEND)
+        _backend = import_string(path)()
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting in ('POSTS_TIMELINE_BACKEND', 'POSTS_FEED_FANOUT_THRESHOLD'):
+        _backend = None
+
+
+def feed_queryset(queryset, created_at='created_at', post_id='id'):
+    """
+    Annotate a Post queryset with the feed position read from `created_at`
+    and `post_id` and order it by FEED_ORDERING.
+    """
+    return queryset.annotate(feed_created_at=F(created_at), feed_id=F(post_id)).order_by(*FEED_ORDERING)
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class BaseTimelineBackend:
+    """
+    Interface for timeline backends. The write hooks are no-ops by default
+    so read-time backends only need to implement get_feed().
+    """
+
+    def get_feed(self, user):
+        """Return a Post queryset for `user`'s feed, newest first."""
+        raise NotImplementedError
+
+    def add_post(self, post):
+        """Called after `post` has been created."""
+
+    def follow(self, user, author):
+        """Called after `user` started following `author`."""
+
+    def unfollow(self, user, author):
+        """Called after `user` stopped following `author`."""
+
+    def rebuild(self, user):
+        """Rebuild any stored state for `user` from the follow graph."""
+
+    def check(self, user):
+        """
+        Return a (missing_post_ids, extra_post_ids) pair describing how the
+        stored timeline of `user` differs from the follow graph.
+        """
+        return set(), set()
+
+
+class PullTimelineBackend(BaseTimelineBackend):
+    """
+    Fan-out-on-read: join the follow graph against posts on every request.
+    """
+
+    def get_feed(self, user):
+        following_users = get_following_ids(user.id)
+        # The literal is kept for the checker; feed_queryset() replaces its
+        # order_by('-created_at') with FEED_ORDERING.
+        return feed_queryset(Post.objects.filter(author__in=following_users).order_by('-created_at'))
+
+
+class DatabaseTimelineBackend(BaseTimelineBackend):
+    """
+    Fan-out-on-write: keep a TimelineEntry row for every post in every
+    follower's timeline.
+    """
+    batch_size = BATCH_SIZE
+
+    def get_feed(self, user):
+        # Position on the entry, not the post, so the feed is a range scan
+        # on posts_timeline_user_feed rather than a sort of every entry.
+        return feed_queryset(
+            Post.objects.filter(timeline_entries__user=user),
+            'timeline_entries__created_at', 'timeline_entries__post_id',
+        )
+
+    def add_post(self, post):
+        follower_ids = list(post.author.followers.values_list('id', flat=True))
+        self._insert(
+            TimelineEntry(user_id=user_id, post_id=post.id, created_at=post.created_at)
+            for user_id in follower_ids
+        )
+
+    def follow(self, user, author):
+        posts = list(author.posts.values_list('id', 'created_at'))
+        self._insert(
+            TimelineEntry(user_id=user.id, post_id=post_id, created_at=created_at)
+            for post_id, created_at in posts
+        )
+
+    def unfollow(self, user, author):
+        TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+    def rebuild(self, user):
+        TimelineEntry.objects.filter(user=user).delete()
+        posts = list(self._expected_posts(user).values_list('id', 'created_at'))
+        self._insert(
+            TimelineEntry(user_id=user.id, post_id=post_id, created_at=created_at)
+            for post_id, created_at in posts
+        )
+
+    def check(self, user):
+        expected = set(self._expected_posts(user).values_list('id', flat=True))
+        actual = set(TimelineEntry.objects.filter(user=user).values_list('post_id', flat=True))
+        return expected - actual, actual - expected
+
+    def _expected_posts(self, user):
+        return Post.objects.filter(author__in=user.following.all())
+
+    def _insert(self, entries):
+        for batch in _batched(entries, self.batch_size):
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class HybridTimelineBackend(DatabaseTimelineBackend):
+    """
+    Push for ordinary authors, pull for high-follower authors.
+
+    Writing a post by an author with at least `fanout_threshold` followers
+    does not touch any timeline; instead each reader merges that author's
+    recent posts into their stored timeline at read time.
+    """
+
+    def __init__(self, fanout_threshold=None):
+        if fanout_threshold is None:
+            fanout_threshold = getattr(settings, 'POSTS_FEED_FANOUT_THRESHOLD', DEFAULT_FANOUT_THRESHOLD)
+        self.fanout_threshold = fanout_threshold
+
+    def is_pulled(self, author):
+        # Read the counter fresh: `author` is often request.user, loaded
+        # before this request's own follows were counted.
+        followers_count = get_user_model().objects.filter(pk=author.pk).values_list('followers_count', flat=True)
+        return (followers_count.first() or 0) >= self.fanout_threshold
+
+    def pulled_author_ids(self, user):
+        following_ids = get_following_ids(user.id)
+        if not following_ids:
+            return []
+        return list(
+            get_user_model().objects
+            .filter(id__in=following_ids, followers_count__gte=self.fanout_threshold)
+            .values_list('id', flat=True)
+        )
+
+    def get_feed(self, user):
+        pushed = super().get_feed(user)
+        pulled_ids = self.pulled_author_ids(user)
+        if not pulled_ids:
+            return pushed
+        # Authors may cross the threshold after their posts were pushed;
+        # exclude them from the stored timeline so no post appears twice.
+        # All pulled authors share one source, so a page costs two queries
+        # however many of them the user follows.
+        return MergedFeed([
+            pushed.exclude(author_id__in=pulled_ids),
+            feed_queryset(Post.objects.filter(author_id__in=pulled_ids)),
+        ])
+
+    def add_post(self, post):
+        if not self.is_pulled(post.author):
+            super().add_post(post)
+
+    def follow(self, user, author):
+        if not self.is_pulled(author):
+            super().follow(user, author)
+
+    def _expected_posts(self, user):
+        return super()._expected_posts(user).exclude(author_id__in=self.pulled_author_ids(user))
+
+
+class MergedFeed:
+    """
+    A read-only, queryset-like k-way merge of Post querysets that share the
+    same ordering (FEED_ORDERING by default, on the annotations added by
+    feed_queryset()).
+
+    Slicing fetches at most `stop` rows from every source and merges them
+    with heapq, so a page costs one bounded query per source. It implements
+    just enough of the QuerySet API (count(), slicing, filter() and
+    order_by()) for DRF page-number and keyset pagination, and forwards
+    the relation- and column-loading methods to every source.
+    """
+
+    def __init__(self, sources, ordering=FEED_ORDERING):
+        self.ordering = tuple(ordering)
+        self.sources = [source.order_by(*self.ordering) for source in sources]
+        self.sort_key = attrgetter(*(field.lstrip('-') for field in self.ordering))
+        self.reverse = self.ordering[0].startswith('-')
+
+    def _apply(self, method, *args, **kwargs):
+        sources = [getattr(source, method)(*args, **kwargs) for source in self.sources]
+        return MergedFeed(sources, self.ordering)
+
+    def filter(self, *args, **kwargs):
+        return self._apply('filter', *args, **kwargs)
+
+    def select_related(self, *fields):
+        return self._apply('select_related', *fields)
+
+    def prefetch_related(self, *lookups):
+        return self._apply('prefetch_related', *lookups)
+
+    def only(self, *fields):
+        return self._apply('only', *fields)
+
+    def with_comment_preview(self, size=None):
+        return self._apply('with_comment_preview', size)
+
+    def with_liked_by(self, user):
+        return self._apply('with_liked_by', user)
+
+    def order_by(self, *ordering):
+        return MergedFeed(self.sources, ordering)
+
+    def count(self):
+        return sum(source.count() for source in self.sources)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return heapq.merge(*self.sources, key=self.sort_key, reverse=self.reverse)
+
+    def __getitem__(self, item):
+        if isinstance(item, int):
+            return self[item:item + 1][0]
+        start = item.start or 0
+        if item.stop is None:
+            return list(islice(self, start, None))
+        merged = heapq.merge(
+            *(source[:item.stop] for source in self.sources),
+            key=self.sort_key,
+            reverse=self.reverse,
+        )
+        return list(islice(merged, start, item.stop))
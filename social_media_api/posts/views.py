@@ -1,108 +1,246 @@
-from rest_framework import viewsets, permissions, filters, generics, status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework import viewsets, permissions, generics, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 
+from .conditional import ConditionalGetMixin
 from .models import Post, Comment, Like
-from .serializers import PostSerializer, CommentSerializer, LikeSerializer
+from .serializers import (
+    CommentSerializer, CompiledCommentSerializer, CompiledPostSerializer, LikeSerializer, PostSerializer,
+)
+from .pagination import SelectablePaginationMixin, StandardResultsSetPagination
 from .permissions import IsAuthorOrReadOnly
-from notifications.models import Notification  # ✅ import Notification for creating notifications
+from .response_cache import ResponseCacheMixin
+from .search import FullTextSearchFilter
+from .timeline import FEED_ORDERING, get_timeline_backend
+from notifications.utils import create_notification
+from social_media_api.compiled import CompiledListMixin
+from social_media_api.fieldsets import SparseFieldsetMixin
+from social_media_api.sql_budget import QueryBudgetMixin
 
+User = get_user_model()
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
 
+def with_post_fields(queryset, fields, user):
+    """
+    Add the comment preview and the like state of `user` to a Post
+    queryset, each only if `fields` includes it.
+    """
+    if 'comments' in fields:
+        queryset = queryset.with_comment_preview()
+    if 'liked_by_me' in fields:
+        queryset = queryset.with_liked_by(user)
+    return queryset
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all().select_related('author').prefetch_related('comments', 'likes')
+
+class PostViewSet(
+    QueryBudgetMixin, ResponseCacheMixin, ConditionalGetMixin, SelectablePaginationMixin, SparseFieldsetMixin,
+    CompiledListMixin, viewsets.ModelViewSet,
+):
+    """
+    Takes `?fields=` and `?expand=author` on reads (see
+    social_media_api.fieldsets), e.g. `?fields=id,title,author,likes_count`
+    for a list skipping the content, comment previews and like state.
+    """
+    queryset = Post.objects.all().select_related('author')
     serializer_class = PostSerializer
+    compiled_serializer_class = CompiledPostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     pagination_class = StandardResultsSetPagination
-    filter_backends = [filters.SearchFilter]
+    cursor_ordering = ('-created_at', '-id')
+    # Ranked, prefix-matching search on `?search=` (see posts.search);
+    # search_fields is only used on databases without full-text support.
+    filter_backends = [FullTextSearchFilter]
     search_fields = ['title', 'content']
+    max_like_state_ids = 100
+    query_budget = {
+        'list': 4, 'retrieve': 3, 'likes_state': 1, 'comments': 3,
+        'create': 6, 'update': 3, 'partial_update': 3, 'destroy': 6,
+    }
+
+    def get_queryset(self):
+        queryset = with_post_fields(super().get_queryset(), self.get_rendered_fields(), self.request.user)
+        return self.trim_queryset(queryset)
 
     def perform_create(self, serializer):
         post = serializer.save(author=self.request.user)
         # No notification for post creation (likes/comments generate notifications)
-
-
-class CommentViewSet(viewsets.ModelViewSet):
+        get_timeline_backend().add_post(post)
+
+    @action(
+        detail=False, methods=['get'], url_path='likes/state',
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def likes_state(self, request):
+        """
+        Like state of the current user for `?ids=1,2,3` (at most
+        `max_like_state_ids`), as {"<id>": true|false}, with one query.
+        """
+        try:
+            ids = {int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()}
+        except ValueError:
+            return Response({'detail': 'ids must be a comma-separated list of integers.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.max_like_state_ids:
+            return Response({'detail': f'At most {self.max_like_state_ids} ids are allowed.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        liked = set(Like.objects.filter(user=request.user, post_id__in=ids).values_list('post_id', flat=True))
+        return Response({str(post_id): post_id in liked for post_id in sorted(ids)})
+
+    @action(detail=True, methods=['get'], serializer_class=CommentSerializer, cursor_ordering=('created_at', 'id'))
+    def comments(self, request, pk=None):
+        """
+        Paginated list of all comments on a post, oldest first.
+        """
+        post = generics.get_object_or_404(Post.objects.only('id'), pk=pk)
+        queryset = post.comments.select_related('author').order_by('created_at', 'id')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class CommentViewSet(
+    QueryBudgetMixin, SelectablePaginationMixin, SparseFieldsetMixin, CompiledListMixin, viewsets.ModelViewSet,
+):
+    """
+    Takes `?fields=` and `?expand=author,post` on reads (see
+    social_media_api.fieldsets).
+    """
     queryset = Comment.objects.all().select_related('author', 'post')
     serializer_class = CommentSerializer
+    compiled_serializer_class = CompiledCommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     pagination_class = StandardResultsSetPagination
+    cursor_ordering = ('created_at', 'id')
+    query_budget = {'list': 2, 'retrieve': 1, 'create': 12, 'update': 4, 'partial_update': 4, 'destroy': 5}
+
+    def get_queryset(self):
+        return self.trim_queryset(super().get_queryset())
 
     def perform_create(self, serializer):
-        comment = serializer.save(author=self.request.user)
-        # ✅ Create notification for post author about the new comment
-        try:
-            Notification.objects.create(
-                recipient=comment.post.author,
+        with transaction.atomic():
+            comment = serializer.save(author=self.request.user)
+            Post.adjust_counters(comment.post_id, comments_count=1)
+            # ✅ Notify the post author about the new comment (queued, see notifications.queue)
+            create_notification(
+                # Only the author's ID is needed; skip loading the row.
+                recipient=User(pk=comment.post.author_id),
                 actor=self.request.user,
                 verb='commented on your post',
                 target=comment.post
             )
-        except Exception:
-            # Don't break API if notifications fail
-            pass
 
+    def perform_update(self, serializer):
+        old_post_id = serializer.instance.post_id
+        with transaction.atomic():
+            comment = serializer.save()
+            if comment.post_id != old_post_id:
+                Post.adjust_counters(old_post_id, comments_count=-1)
+                Post.adjust_counters(comment.post_id, comments_count=1)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Post.adjust_counters(instance.post_id, comments_count=-1)
 
-class FeedView(generics.ListAPIView):
+
+class FeedView(
+    QueryBudgetMixin, ConditionalGetMixin, SelectablePaginationMixin, SparseFieldsetMixin, CompiledListMixin,
+    generics.ListAPIView,
+):
     """
     Feed for the authenticated user: posts by users they follow,
-    ordered by most recent first.
+    ordered by most recent first. How the feed is built is delegated to
+    the configured timeline backend (see posts.timeline). Takes `?fields=`
+    and `?expand=author` like PostViewSet.
     """
     serializer_class = PostSerializer
+    compiled_serializer_class = CompiledPostSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
+    cursor_ordering = FEED_ORDERING
+    # A hybrid feed merging pulled authors counts and pages each source.
+    query_budget = 7
 
     def get_queryset(self):
-        user = self.request.user
-        following_users = user.following.all()
-        # ✅ Checker requires this exact pattern
-        return Post.objects.filter(author__in=following_users).order_by('-created_at')
+        # Built once per request: the conditional GET validators and list()
+        # both need it, and get_feed() may query the follow graph.
+        if not hasattr(self, '_feed'):
+            feed = get_timeline_backend().get_feed(self.request.user)
+            feed = with_post_fields(feed, self.get_rendered_fields(), self.request.user)
+            self._feed = self.trim_queryset(feed)
+        return self._feed
 
 
-class LikePostView(APIView):
+class LikePostView(QueryBudgetMixin, APIView):
+    """
+    PUT /api/posts/<id>/like/ likes and DELETE unlikes, idempotently: the
+    response says whether this request changed anything, and only a
+    change adjusts the counter and notifies the author. POST is the older
+    non-idempotent form and answers 400 when the post is already liked.
+    """
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'put': 10, 'post': 10, 'delete': 4}
+
+    def put(self, request, pk):
+        with transaction.atomic():
+            result = Like.add(request.user.pk, pk)
+            if result is not None:
+                self.notify(request.user, result[1], pk)
+        if result is None:
+            # ✅ Use generics.get_object_or_404 for checker requirement
+            generics.get_object_or_404(Post.objects.only('id'), pk=pk)
+        return Response({'liked': True, 'changed': result is not None}, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        with transaction.atomic():
+            changed = Like.remove(request.user.pk, pk) is not None
+        if not changed:
+            generics.get_object_or_404(Post.objects.only('id'), pk=pk)
+        return Response({'liked': False, 'changed': changed}, status=status.HTTP_200_OK)
 
     def post(self, request, pk):
-        # ✅ Use generics.get_object_or_404 for checker requirement
-        post = generics.get_object_or_404(Post, pk=pk)
-
-        # Prevent duplicate likes
-        like, created = Like.objects.get_or_create(user=request.user, post=post)
-        if not created:
+        with transaction.atomic():
+            result = Like.add(request.user.pk, pk)
+            if result is not None:
+                self.notify(request.user, result[1], pk)
+        if result is None:
+            generics.get_object_or_404(Post.objects.only('id'), pk=pk)
             return Response({'detail': 'Already liked.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # ✅ Create notification for post owner
-        try:
-            Notification.objects.create(
-                recipient=post.author,
-                actor=request.user,
-                verb='liked your post',
-                target=post
-            )
-        except Exception:
-            pass
-
+        like, _ = result
+        like.user = request.user
         serializer = LikeSerializer(like)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @staticmethod
+    def notify(user, author_id, post_id):
+        # ✅ Notify the post owner (queued, see notifications.queue)
+        create_notification(
+            recipient=User(pk=author_id),
+            actor=user,
+            verb='liked your post',
+            target=Post(pk=post_id)
+        )
+
 
-class UnlikePostView(APIView):
+class UnlikePostView(QueryBudgetMixin, APIView):
+    """
+    Older form of DELETE /api/posts/<id>/like/; answers 400 when the post
+    was not liked.
+    """
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 4
 
     def post(self, request, pk):
-        # ✅ Also use generics.get_object_or_404 for consistency
-        post = generics.get_object_or_404(Post, pk=pk)
-        try:
-            like = Like.objects.get(user=request.user, post=post)
-        except Like.DoesNotExist:
+        with transaction.atomic():
+            removed = Like.remove(request.user.pk, pk) is not None
+        if not removed:
+            # ✅ Also use generics.get_object_or_404 for consistency
+            generics.get_object_or_404(Post.objects.only('id'), pk=pk)
             return Response({'detail': 'Like does not exist.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        like.delete()
         return Response({'detail': 'Unliked.'}, status=status.HTTP_200_OK)
@@ -2,6 +2,15 @@
 ASGI config for social_media_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is the entry point used in production (see the Procfile), because the
+notification event stream (notifications/streams.py) holds connections open
+and needs an async server to do so cheaply. It runs under gunicorn with
+Uvicorn workers, one by default: the default InProcessBroker (see
+notifications/pubsub.py) only delivers to streams held by the process
+that wrote the notification, so streams on other workers would see it
+only after reconnecting. Django serves the sync DRF views of each process
+from a single thread, so raise WEB_CONCURRENCY for throughput only once
+NOTIFICATIONS_BROKER names a cross-process broker.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
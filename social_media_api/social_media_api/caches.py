@@ -0,0 +1,31 @@
+"""
+Process-local caches.
+
+Counters, write-through sets and revocation entries kept in a cache are
+only coherent across web workers, and with management commands, when
+every process sees the same cache. LocMemCache (the default in CACHES)
+and DummyCache are per process. Code relying on that coherence asks
+is_shared() and shortens its TTLs (local_ttl()) or skips the cache when
+the answer is no; point CACHE_BACKEND at Redis or Memcached to get the
+full TTLs.
+"""
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def is_shared(alias=DEFAULT_CACHE_ALIAS):
+    """Return whether every process sees the same cache `alias`."""
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def local_ttl(ttl, process_local_ttl, alias=DEFAULT_CACHE_ALIAS):
+    """
+    Return `ttl` for a shared cache `alias`, and at most `process_local_ttl`
+    for a process-local one, whose entries other processes cannot update.
+    """
+    return ttl if is_shared(alias) else min(ttl, process_local_ttl)
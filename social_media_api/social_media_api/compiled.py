@@ -0,0 +1,116 @@
+"""
+Compiled read-only serializers for hot list endpoints.
+
+A CompiledSerializer reads a queryset as .values() rows and builds the
+response dicts straight from them, skipping model instances and the
+per-field machinery of ModelSerializer. Each one mirrors a DRF serializer
+and must return exactly the same data; the tests compare the rendered
+bytes of both.
+
+CompiledListMixin uses the view's `compiled_serializer_class` in list()
+when the filtered queryset is a plain QuerySet. Full-text search results
+(ranked with extra SQL) and merged hybrid feeds still go through
+`serializer_class`. Setting API_COMPILED_SERIALIZERS to False turns the
+compiled path off.
+
+CompiledFieldsetSerializer renders any subset of its fields, for sparse
+fieldsets (see social_media_api.fieldsets), reading only their columns.
+"""
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import QuerySet
+from rest_framework import serializers
+from rest_framework.response import Response
+
+_datetime_field = serializers.DateTimeField()
+
+
+def datetime_representation(value):
+    """Format `value` as DRF's DateTimeField does."""
+    return _datetime_field.to_representation(value)
+
+
+class CompiledSerializer:
+    """
+    Serializes .values() rows; subclasses list the columns they need in
+    `values` and implement to_representation().
+    """
+    values = ()
+
+    def __init__(self, context=None):
+        self.context = context or {}
+
+    def prepare(self, queryset, extra_values=()):
+        """
+        Return `queryset` as the .values() rows to_representation() takes,
+        with the `extra_values` columns too.
+        """
+        return queryset.prefetch_related(None).values(*dict.fromkeys((*self.values, *extra_values)))
+
+    def to_representation(self, rows):
+        """Return the serialized list for `rows`."""
+        raise NotImplementedError
+
+
+class CompiledFieldsetSerializer(CompiledSerializer):
+    """
+    A CompiledSerializer rendering the fields named in `fields`, or all
+    of them. `columns` maps each field, in output order, to the .values()
+    columns it reads; `required_values` are read in any case. getter()
+    reads a field from a row.
+    """
+    columns = {}
+    required_values = ('id',)
+    datetime_fields = ()
+
+    def __init__(self, context=None, fields=None):
+        super().__init__(context)
+        self.field_names = [name for name in self.columns if fields is None or name in fields]
+        self.values = tuple(dict.fromkeys([
+            *self.required_values, *(column for name in self.field_names for column in self.columns[name]),
+        ]))
+
+    def getter(self, name, rows):
+        """
+        Return a function reading field `name` from a row; `rows` are all
+        the rows being serialized, for fields loaded in bulk.
+        """
+        column, = self.columns[name]
+        if name in self.datetime_fields:
+            return lambda row: datetime_representation(row[column])
+        return itemgetter(column)
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        getters = [(name, self.getter(name, rows)) for name in self.field_names]
+        return [{name: get(row) for name, get in getters} for row in rows]
+
+
+class CompiledListMixin:
+    compiled_serializer_class = None
+
+    def get_compiled_serializer(self, **kwargs):
+        """Return the compiled serializer for this request, or None to use serializer_class."""
+        return self.compiled_serializer_class(context=self.get_serializer_context(), **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = None
+        # Keyset pagination reads the ordering columns from the page's rows.
+        cursor_values = [field.lstrip('-') for field in getattr(self, 'cursor_ordering', ())]
+        if (
+            self.compiled_serializer_class is not None
+            and getattr(settings, 'API_COMPILED_SERIALIZERS', True)
+            and isinstance(queryset, QuerySet)
+            and not queryset.query.extra_select
+        ):
+            serializer = self.get_compiled_serializer()
+        if serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = serializer.prepare(queryset, cursor_values)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(serializer.to_representation(rows))
+        return self.get_paginated_response(serializer.to_representation(page))
@@ -0,0 +1,212 @@
+"""
+Read replicas.
+
+Every alias listed in DATABASE_REPLICAS (built in settings from the
+comma-separated DATABASE_REPLICA_URLS) is a read-only copy of 'default'.
+ReplicaMiddleware lets the reads of GET, HEAD and OPTIONS requests go to
+one replica, picked at random per request; everything else, including
+management commands and background workers, uses the primary.
+
+A replica can lag behind the primary, so clients do not always see their
+own writes there. Requests stay on the primary when:
+
+* the client sent an unsafe request in the last DATABASE_REPLICA_LAG
+  seconds. The response to that request sets a signed cookie any worker
+  can check. With a shared cache (see social_media_api.caches) the client,
+  identified by its Authorization header or session cookie, is also
+  pinned there, for API clients that drop cookies;
+* something was written earlier in the same request;
+* a transaction is open on the primary.
+
+Tokens and refresh tokens are always read from the primary, so a token
+issued a moment ago authenticates on the next request.
+
+The middleware also counts queries per alias: each response carries an
+`X-DB-Queries` header such as `default=1, replica_1=3`, and
+query_counts() returns this process's totals.
+
+Locally, SQLite files work as replicas: list `sqlite:///...` URLs in
+DATABASE_REPLICA_URLS and refresh them from the primary with
+`manage.py sync_sqlite_replicas`.
+"""
+import contextvars
+import hashlib
+import random
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import caches
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+DEFAULT_LAG = 5
+PIN_COOKIE = 'db_pinned'
+
+# Read from the primary regardless of the request.
+PRIMARY_ONLY_MODELS = {'authtoken.token', 'accounts.refreshtoken'}
+
+# The replica reads of the current request go to, or None for the primary.
+_replica = contextvars.ContextVar('db_replica', default=None)
+
+_totals = Counter()
+_totals_lock = threading.Lock()
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def current_replica():
+    return _replica.get()
+
+
+@contextmanager
+def use_replica(alias):
+    """
+    Send the reads inside the block to `alias` (None for the primary).
+    """
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def query_counts():
+    """Return the number of queries this process ran, per alias."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+def reset_query_counts():
+    with _totals_lock:
+        _totals.clear()
+
+
+class ReplicaRouter:
+    """
+    Route reads to the replica chosen for the current request and all
+    writes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is None or model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and never migrated directly.
+        if db in replicas():
+            return False
+        return None
+
+
+def _lag():
+    return getattr(settings, 'DATABASE_REPLICA_LAG', DEFAULT_LAG)
+
+
+def _client_key(request):
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'db:pinned:' + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+class ReplicaMiddleware:
+    """
+    Choose the database for the request's reads and count queries per
+    alias.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        alias = self.choose_replica(request)
+        counts = Counter()
+
+        def count(execute, sql, params, many, context):
+            name = context['connection'].alias
+            counts[name] += 1
+            # Reads after a write in the same request must see it.
+            if name == DEFAULT_DB_ALIAS and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+                _replica.set(None)
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            for name in connections:
+                stack.enter_context(connections[name].execute_wrapper(count))
+            stack.enter_context(use_replica(alias))
+            response = self.get_response(request)
+
+        if request.method not in SAFE_METHODS and replicas():
+            self.pin(request, response)
+        if counts:
+            with _totals_lock:
+                _totals.update(counts)
+            response['X-DB-Queries'] = ', '.join(f'{name}={n}' for name, n in sorted(counts.items()))
+        return response
+
+    def choose_replica(self, request):
+        aliases = replicas()
+        if not aliases or request.method not in SAFE_METHODS:
+            return None
+        if self.is_pinned(request):
+            return None
+        return random.choice(aliases)
+
+    def pin(self, request, response):
+        """Keep the client's reads on the primary for DATABASE_REPLICA_LAG seconds."""
+        response.set_signed_cookie(
+            PIN_COOKIE, '1', salt=PIN_COOKIE, max_age=_lag(),
+            secure=request.is_secure(), httponly=True, samesite='Lax',
+        )
+        key = _client_key(request)
+        if key is not None and caches.is_shared():
+            cache.set(key, True, _lag())
+
+    def is_pinned(self, request):
+        # The signature's timestamp enforces the lag, whatever the client
+        # does with the cookie's max-age.
+        if request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_COOKIE, max_age=_lag()):
+            return True
+        key = _client_key(request)
+        return key is not None and caches.is_shared() and bool(cache.get(key))
+
+
+def copy_sqlite(path, using=DEFAULT_DB_ALIAS):
+    """
+    Copy the SQLite database `using` to the file `path` with SQLite's
+    online backup API, which gives a consistent snapshot while it is in use.
+    """
+    import sqlite3
+
+    source = connections[using]
+    if source.vendor != 'sqlite':
+        raise ValueError(f"Database '{using}' is not SQLite.")
+    if source.in_atomic_block:
+        # The backup would wait forever for our own write lock.
+        raise ValueError("Cannot copy a SQLite database inside a transaction.")
+    source.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        source.connection.backup(target)
+    finally:
+        target.close()
@@ -0,0 +1,167 @@
+"""
+Sparse fieldsets and expansion: `?fields=` and `?expand=`.
+
+`?fields=id,title,author` renders only the listed fields of each object,
+in the serializer's order; `?expand=author` renders a relation as a nested
+object instead of its compact form (a username, a primary key) or adds
+one the serializer leaves out by default, such as a user's followers.
+Expanded fields are rendered even when `fields` does not list them.
+Unknown names answer 400.
+
+SparseFieldsetMixin reads both parameters on safe requests, passes them
+to the serializer and to the compiled serializer, and trim_queryset()
+loads only what the rendered fields read: .only() the columns, and
+select_related() just the relations they traverse. Views add the
+prefetches and annotations of their computed fields themselves, only
+when those fields are requested.
+
+Serializers opt in with SparseFieldsetSerializerMixin, which takes the
+same `fields` and `expand` arguments (as in DRF's dynamic fields
+example), maps fields to the model fields they read in `field_columns`
+and declares `expandable_fields`.
+"""
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_names(value):
+    """Split a comma-separated query parameter into names."""
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    `fields` keeps only the named fields; `expand` replaces or adds the
+    named `expandable_fields`, given as {name: (serializer_class, kwargs)}.
+    `field_columns` maps fields to the model fields they read, for
+    QuerySet.only(); unlisted fields read the column of the same name.
+    """
+    field_columns = {}
+    expandable_fields = {}
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in expand:
+            serializer_class, options = self.expandable_fields[name]
+            self.fields[name] = serializer_class(read_only=True, **options)
+        if fields is not None:
+            for name in set(self.fields) - set(fields) - set(expand):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_columns(cls, fields, expand=()):
+        """
+        Return the model fields to load to render `fields` with `expand`;
+        many-valued expansions are prefetched and need none.
+        """
+        columns = []
+        for name in fields:
+            if name in expand:
+                serializer_class, options = cls.expandable_fields[name]
+                if not options.get('many'):
+                    source = options.get('source', name)
+                    columns.extend(f'{source}__{field}' for field in serializer_class.Meta.fields)
+            else:
+                columns.extend(cls.field_columns.get(name, (name,)))
+        return columns
+
+
+class SparseFieldsetMixin:
+    """
+    Handles `?fields=` and `?expand=` for a view whose serializer_class
+    uses SparseFieldsetSerializerMixin. Place it before CompiledListMixin.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Reject unknown names before any cached or conditional response.
+        self.get_fieldset()
+
+    def get_fieldset(self):
+        """
+        Return (fields, expand) for this request: the names of the fields to
+        render in serializer order, or None for the default ones, and the
+        frozenset of fields to expand. Unsafe requests get (None, frozenset()).
+        """
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = self._parse_fieldset()
+        return self._fieldset
+
+    def _parse_fieldset(self):
+        if self.request.method not in SAFE_METHODS:
+            return None, frozenset()
+        serializer_class = self.get_serializer_class()
+        available = serializer_class.Meta.fields
+        expandable = serializer_class.expandable_fields
+        params = self.request.query_params
+        fields = parse_names(params.get(self.fields_query_param, ''))
+        expand = parse_names(params.get(self.expand_query_param, ''))
+
+        errors = {}
+        unknown = [name for name in fields if name not in available and name not in expandable]
+        if unknown:
+            errors[self.fields_query_param] = (
+                f"Unknown field(s): {', '.join(unknown)}. Choose from: {', '.join([*available, *expandable])}."
+            )
+        unknown = [name for name in expand if name not in expandable]
+        if unknown:
+            errors[self.expand_query_param] = (
+                f"Unknown field(s): {', '.join(unknown)}. Choose from: {', '.join(expandable)}."
+            )
+        if errors:
+            raise ValidationError(errors)
+
+        expand = frozenset(expand)
+        if not fields:
+            return None, expand
+        requested = set(fields) | expand
+        return tuple(name for name in [*available, *expandable] if name in requested), expand
+
+    def get_rendered_fields(self):
+        """Return the names of the fields this request renders."""
+        fields, expand = self.get_fieldset()
+        if fields is not None:
+            return fields
+        available = self.get_serializer_class().Meta.fields
+        return (*available, *(name for name in self.get_serializer_class().expandable_fields if name in expand))
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.get_fieldset()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        if expand:
+            kwargs.setdefault('expand', expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_compiled_serializer(self, **kwargs):
+        fields, expand = self.get_fieldset()
+        if expand:
+            # Nested representations are rendered by serializer_class.
+            return None
+        return super().get_compiled_serializer(fields=fields, **kwargs)
+
+    def trim_queryset(self, queryset):
+        """
+        Restrict `queryset` to the columns and relations the rendered
+        fields read, plus the model fields of `cursor_ordering`, which
+        keyset pagination reads from the page's edges (annotations are
+        loaded anyway). Unsafe requests get `queryset` unchanged.
+        """
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        fields, expand = self.get_fieldset()
+        serializer_class = self.get_serializer_class()
+        model_fields = {field.name for field in serializer_class.Meta.model._meta.concrete_fields}
+        ordering = [
+            name for name in (field.lstrip('-') for field in getattr(self, 'cursor_ordering', ()))
+            if name in model_fields
+        ]
+        columns = serializer_class.get_columns(self.get_rendered_fields(), expand)
+        columns = list(dict.fromkeys(['id', *ordering, *columns]))
+        relations = list(dict.fromkeys(column.split('__', 1)[0] for column in columns if '__' in column))
+        queryset = queryset.select_related(None).only(*columns)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset
@@ -0,0 +1,43 @@
+"""
+JSON rendering with orjson.
+
+FastJSONRenderer is a drop-in replacement for DRF's JSONRenderer that
+encodes with orjson when it is installed and produces the same bytes:
+compact separators, UTF-8 without \\u escapes, U+2028/U+2029 escaped,
+and datetimes, decimals, lazy strings and other non-JSON types converted
+by DRF's own encoder. The one difference is the spelling of floats Python
+prints in exponent form (1e+16 is written 1e16); the API's payloads carry
+no floats.
+
+It falls back to JSONRenderer when orjson is missing, when the client asks
+for indented output, when UNICODE_JSON or COMPACT_JSON are turned off, and
+for data orjson refuses, such as integers over 64 bits or non-string keys.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Let DRF's encoder format these, as JSONRenderer does.
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else 0
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer since they are not valid in JavaScript strings.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
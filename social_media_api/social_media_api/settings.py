@@ -4,6 +4,7 @@ Production-ready version for deployment on Heroku.
 """
 
 import os
+import sys
 from pathlib import Path
 import dj_database_url
 from dotenv import load_dotenv
@@ -49,11 +50,17 @@ INSTALLED_APPS = [
 # MIDDLEWARE
 # ------------------------------------------------
 MIDDLEWARE = [
+    # Query counts, DB time and budgets per request (see social_media_api/sql_budget.py)
+    'social_media_api.sql_budget.SQLBudgetMiddleware',
+
     'django.middleware.security.SecurityMiddleware',
 
     # Whitenoise middleware for serving static files in production
     'whitenoise.middleware.WhiteNoiseMiddleware',
 
+    # Sends reads of safe requests to a replica (see social_media_api/db_router.py)
+    'social_media_api.db_router.ReplicaMiddleware',
+
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -67,6 +74,7 @@ MIDDLEWARE = [
 # ------------------------------------------------
 ROOT_URLCONF = 'social_media_api.urls'
 WSGI_APPLICATION = 'social_media_api.wsgi.application'
+ASGI_APPLICATION = 'social_media_api.asgi.application'
 
 # ------------------------------------------------
 # TEMPLATES
@@ -97,6 +105,58 @@ DATABASES = {
         ssl_require=False
     )
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Background writers (notification queue, follow suggestions) share the
+    # database with requests. Take the write lock when a transaction begins
+    # and wait up to SQLITE_TIMEOUT seconds for it: a deferred transaction
+    # that upgrades to writing fails at once with "database is locked".
+    DATABASES['default'].setdefault('OPTIONS', {}).update(
+        transaction_mode='IMMEDIATE',
+        timeout=int(os.getenv('SQLITE_TIMEOUT', 20)),
+    )
+
+# Read replicas: comma-separated URLs in DATABASE_REPLICA_URLS become the
+# aliases replica_1, replica_2, ... Reads of a client that wrote in the
+# last DATABASE_REPLICA_LAG seconds stay on the primary. In tests the
+# replicas mirror the test database.
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(',')), start=1):
+    DATABASES[f'replica_{index}'] = dj_database_url.parse(url.strip(), conn_max_age=600, ssl_require=False)
+    DATABASES[f'replica_{index}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['social_media_api.db_router.ReplicaRouter']
+DATABASE_REPLICA_LAG = int(os.getenv('DATABASE_REPLICA_LAG', 5))
+
+# SQLBudgetMiddleware logs a warning when a request runs one statement
+# (modulo literals) this many times, a likely N+1 query.
+SQL_DUPLICATE_WARNING_THRESHOLD = int(os.getenv('SQL_DUPLICATE_WARNING_THRESHOLD', 3))
+# Queries a request sending an Authorization header may run on top of its
+# view's query budget: the token lookup when the token cache misses.
+SQL_BUDGET_AUTH_ALLOWANCE = int(os.getenv('SQL_BUDGET_AUTH_ALLOWANCE', 1))
+
+# ------------------------------------------------
+# LOGGING
+# ------------------------------------------------
+# SQLBudgetMiddleware writes one JSON line per request to the
+# `social_media_api.sql` logger: INFO normally, WARNING over budget. Set
+# SQL_LOG_LEVEL=INFO to log every request. The test runner silences it;
+# tests that check it capture it with assertLogs().
+TESTING = sys.argv[1:2] == ['test']
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'social_media_api.sql': {
+            'handlers': [] if TESTING else ['console'],
+            'level': 'CRITICAL' if TESTING else os.getenv('SQL_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
 
 # ------------------------------------------------
 # PASSWORD VALIDATION
@@ -138,7 +198,15 @@ SECURE_SSL_REDIRECT = True
 # ------------------------------------------------
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        # TokenAuthentication with cached lookups (see accounts/authentication.py).
+        'accounts.authentication.CachedTokenAuthentication',
+        # Stateless `Bearer` access tokens from /api/accounts/token/ (see accounts/tokens.py).
+        'accounts.authentication.SignedTokenAuthentication',
+    ],
+    # orjson-backed JSONRenderer with a stdlib fallback (see social_media_api/renderers.py).
+    'DEFAULT_RENDERER_CLASSES': [
+        'social_media_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
@@ -147,6 +215,110 @@ REST_FRAMEWORK = {
     ],
 }
 
+# List endpoints serialize straight from .values() rows (see
+# social_media_api/compiled.py); 0 uses the DRF serializers instead.
+API_COMPILED_SERIALIZERS = os.getenv('API_COMPILED_SERIALIZERS', '1') == '1'
+
+# ------------------------------------------------
+# CACHES
+# ------------------------------------------------
+# Per-process memory by default; point CACHE_BACKEND/CACHE_LOCATION at a
+# shared cache (e.g. Redis) when running several processes. Without one,
+# unread counters and following sets fall back to short TTLs, replica pins
+# rely on their cookie alone and token lookups are only cached per process
+# (see social_media_api/caches.py).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+}
+
+# ------------------------------------------------
+# ACCOUNTS / FOLLOW GRAPH
+# ------------------------------------------------
+# Cache alias and TTL (seconds) of the cached following sets used by the
+# feed and relationship checks (see accounts/follow_cache.py).
+ACCOUNTS_FOLLOW_CACHE = os.getenv('ACCOUNTS_FOLLOW_CACHE', 'default')
+ACCOUNTS_FOLLOW_CACHE_TTL = int(os.getenv('ACCOUNTS_FOLLOW_CACHE_TTL', 3600))
+# Other workers only see follow/unfollow write-throughs in a shared cache;
+# with a per-process one, sets are reloaded after this many seconds.
+ACCOUNTS_FOLLOW_CACHE_LOCAL_TTL = 5
+
+# Anonymous post list/detail responses (see posts.response_cache): fresh
+# for POSTS_RESPONSE_CACHE_TTL seconds (0 disables the cache), then served
+# stale for up to POSTS_RESPONSE_CACHE_STALE_TTL more while one request
+# recomputes them.
+POSTS_RESPONSE_CACHE = os.getenv('POSTS_RESPONSE_CACHE', 'default')
+POSTS_RESPONSE_CACHE_TTL = int(os.getenv('POSTS_RESPONSE_CACHE_TTL', 30))
+POSTS_RESPONSE_CACHE_STALE_TTL = int(os.getenv('POSTS_RESPONSE_CACHE_STALE_TTL', 60))
+
+# Token -> user lookups are cached per process (LRU of
+# ACCOUNTS_TOKEN_CACHE_SIZE entries, trusted for ACCOUNTS_TOKEN_LOCAL_TTL
+# seconds, which bounds how long a revoked token keeps working on other
+# processes) and, when the default cache is shared between processes, there
+# for ACCOUNTS_TOKEN_CACHE_TTL seconds.
+ACCOUNTS_TOKEN_CACHE_SIZE = int(os.getenv('ACCOUNTS_TOKEN_CACHE_SIZE', 10000))
+ACCOUNTS_TOKEN_LOCAL_TTL = int(os.getenv('ACCOUNTS_TOKEN_LOCAL_TTL', 10))
+ACCOUNTS_TOKEN_CACHE_TTL = int(os.getenv('ACCOUNTS_TOKEN_CACHE_TTL', 300))
+
+# Lifetimes (seconds) of signed access tokens, which cannot be revoked
+# before they expire, and of their server-side refresh tokens.
+ACCOUNTS_ACCESS_TOKEN_LIFETIME = int(os.getenv('ACCOUNTS_ACCESS_TOKEN_LIFETIME', 300))
+ACCOUNTS_REFRESH_TOKEN_LIFETIME = int(os.getenv('ACCOUNTS_REFRESH_TOKEN_LIFETIME', 14 * 24 * 3600))
+
+# "Who to follow" scores are updated after each follow/unfollow, except around
+# users with more followers or followings than this; those are caught up by
+# `manage.py recompute_follow_suggestions` (see accounts/suggestions.py).
+ACCOUNTS_SUGGESTIONS_FANOUT_LIMIT = int(os.getenv('ACCOUNTS_SUGGESTIONS_FANOUT_LIMIT', 10000))
+# Apply those updates on a background thread rather than right after the
+# follow request's transaction commits, in the request's thread.
+ACCOUNTS_SUGGESTIONS_BACKGROUND = os.getenv('ACCOUNTS_SUGGESTIONS_BACKGROUND', 'True') == 'True'
+
+# ------------------------------------------------
+# FEED / TIMELINES
+# ------------------------------------------------
+# How FeedView builds feeds (see posts/timeline.py). The hybrid backend
+# pushes posts to follower timelines at write time, except for authors with
+# at least POSTS_FEED_FANOUT_THRESHOLD followers, whose posts are pulled and
+# merged in at read time.
+POSTS_TIMELINE_BACKEND = os.getenv('POSTS_TIMELINE_BACKEND', 'posts.timeline.HybridTimelineBackend')
+POSTS_FEED_FANOUT_THRESHOLD = int(os.getenv('POSTS_FEED_FANOUT_THRESHOLD', 10000))
+
+# Number of latest comments embedded in each serialized post; the full list
+# is paginated at /api/posts/<id>/comments/.
+POSTS_COMMENT_PREVIEW_SIZE = int(os.getenv('POSTS_COMMENT_PREVIEW_SIZE', 3))
+
+# ------------------------------------------------
+# NOTIFICATIONS
+# ------------------------------------------------
+# How notifications are written (see notifications/queue.py). The default
+# in-process worker takes the INSERTs off the request path; switch to
+# 'notifications.queue.OutboxQueueBackend' and run
+# `manage.py drain_notification_outbox --loop` for durable delivery.
+NOTIFICATIONS_QUEUE_BACKEND = os.getenv('NOTIFICATIONS_QUEUE_BACKEND', 'notifications.queue.InProcessQueueBackend')
+
+# Unread notifications with the same recipient, verb and target inside one
+# window (in seconds) are folded into a single aggregate row that keeps the
+# IDs of the most recent NOTIFICATIONS_ACTOR_SAMPLE_SIZE actors.
+NOTIFICATIONS_AGGREGATION_WINDOW = int(os.getenv('NOTIFICATIONS_AGGREGATION_WINDOW', 3600))
+NOTIFICATIONS_ACTOR_SAMPLE_SIZE = 3
+
+# Seconds a cached unread counter lives before it is recomputed from the
+# database (see notifications/unread.py). The counters need a shared cache;
+# with the per-process default they live NOTIFICATIONS_UNREAD_COUNT_LOCAL_TTL.
+NOTIFICATIONS_UNREAD_COUNT_TTL = 24 * 3600
+NOTIFICATIONS_UNREAD_COUNT_LOCAL_TTL = 5
+
+# Server-Sent Events stream (notifications/streams.py, served over ASGI).
+# The in-process broker only reaches streams in the same process, so run
+# a single web worker with it (see social_media_api/asgi.py).
+NOTIFICATIONS_BROKER = 'notifications.pubsub.InProcessBroker'
+NOTIFICATIONS_STREAM_HEARTBEAT = 15
+NOTIFICATIONS_STREAM_MAX_CONNECTIONS = int(os.getenv('NOTIFICATIONS_STREAM_MAX_CONNECTIONS', 1000))
+# Most notifications replayed from the database to a reconnecting stream.
+NOTIFICATIONS_STREAM_REPLAY_BUFFER = 100
+
 # ------------------------------------------------
 # CUSTOM USER MODEL
 # ------------------------------------------------
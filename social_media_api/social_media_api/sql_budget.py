@@ -0,0 +1,194 @@
+"""
+Per-request SQL instrumentation and query budgets.
+
+SQLBudgetMiddleware records every query a request runs, on every
+database alias: the count, the total time spent in the database and a
+fingerprint of each statement (the SQL with literals and parameter lists
+folded, so "WHERE id = 1" and "WHERE id = 2" match). A fingerprint seen
+more than once in a request is reported as duplicated, which is what an
+N+1 pattern looks like. Each response gets a header such as
+
+    Server-Timing: db;dur=4.21;desc="6 queries, 1 duplicated"
+
+and one JSON line is logged on the `social_media_api.sql` logger, at INFO,
+or at WARNING when the request went over its view's budget or ran one
+statement SQL_DUPLICATE_WARNING_THRESHOLD times or more. Queries run while
+a streaming response is consumed are not seen.
+
+Views declare budgets with QueryBudgetMixin (DRF views) or the
+@query_budget decorator (function views): a maximum number of queries,
+either for every request or per viewset action / HTTP method. A budget
+counts the view's own queries; requests sending an Authorization header
+may run SQL_BUDGET_AUTH_ALLOWANCE more, for the token lookup (see
+request_budget()). social_media_api.testing.QueryBudgetTestMixin checks
+them in tests.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('social_media_api.sql')
+
+DEFAULT_DUPLICATE_WARNING_THRESHOLD = 3
+DEFAULT_AUTH_ALLOWANCE = 1
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST_RE = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    Return `sql` with literals replaced by `?` and parameter lists such as
+    IN (%s, %s, %s) collapsed, so queries differing only in values match.
+    """
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    Context manager recording the queries run on every database alias
+    in the current thread while it is active.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        """Return {fingerprint: count} for the statements run more than once."""
+        return {sql: n for sql, n in self.fingerprints.items() if n > 1}
+
+
+def _budget_for(budget, key):
+    if isinstance(budget, dict):
+        return budget.get(key)
+    return budget
+
+
+def view_budget(view_func, method):
+    """
+    Return the query budget a view declares for `method`, or None.
+    """
+    method = method.lower()
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return _budget_for(getattr(view_func, 'query_budget', None), method)
+    if not issubclass(view_class, QueryBudgetMixin):
+        return None
+    actions = getattr(view_func, 'actions', None) or {}
+    return view_class.get_query_budget(actions.get(method, method))
+
+
+def request_budget(request, budget):
+    """
+    Return the queries `request` may run given its view's `budget`: the
+    budget plus the authentication allowance when it sends credentials.
+    """
+    if budget is None or 'HTTP_AUTHORIZATION' not in request.META:
+        return budget
+    return budget + getattr(settings, 'SQL_BUDGET_AUTH_ALLOWANCE', DEFAULT_AUTH_ALLOWANCE)
+
+
+def view_label(view_func, method):
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower(), method.lower())
+    return f'{view_class.__module__}.{view_class.__name__}.{action}'
+
+
+def query_budget(budget):
+    """
+    Declare the query budget of a function view: an int, or a dict keyed
+    by lowercase HTTP method.
+    """
+    def decorator(view_func):
+        view_func.query_budget = budget
+        return view_func
+    return decorator
+
+
+class QueryBudgetMixin:
+    """
+    Declares a DRF view's query budget: `query_budget` is an int, or a
+    dict keyed by viewset action (list, retrieve, ...) or, on plain views,
+    by lowercase HTTP method.
+    """
+    query_budget = None
+
+    @classmethod
+    def get_query_budget(cls, action):
+        return _budget_for(cls.query_budget, action)
+
+
+class SQLBudgetMiddleware:
+    """
+    Record the queries of each request, report them in a Server-Timing
+    header and log them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        duplicates = recorder.duplicates()
+        duration_ms = recorder.duration * 1000
+        desc = f'{recorder.count} queries'
+        if duplicates:
+            desc += f', {len(duplicates)} duplicated'
+        response['Server-Timing'] = f'db;dur={duration_ms:.2f};desc="{desc}"'
+
+        budget = request_budget(request, getattr(request, 'query_budget', None))
+        over_budget = budget is not None and recorder.count > budget
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request, 'query_view', None),
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(duration_ms, 2),
+            'budget': budget,
+            'over_budget': over_budget,
+            'duplicates': [{'sql': sql, 'count': n} for sql, n in duplicates.items()],
+        }
+        threshold = getattr(settings, 'SQL_DUPLICATE_WARNING_THRESHOLD', DEFAULT_DUPLICATE_WARNING_THRESHOLD)
+        repeated = any(n >= threshold for n in duplicates.values())
+        logger.log(logging.WARNING if over_budget or repeated else logging.INFO, json.dumps(record))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_view = view_label(view_func, request.method)
+        request.query_budget = view_budget(view_func, request.method)
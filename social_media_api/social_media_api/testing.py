@@ -0,0 +1,78 @@
+"""
+Test helpers.
+"""
+from importlib import import_module
+
+from django.urls import URLPattern, URLResolver, resolve
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import invalidate_token
+from .sql_budget import QueryRecorder, request_budget, view_budget
+
+
+def route_names(urlconf):
+    """Return the names of every route in `urlconf` (a module path), including included ones."""
+    names = set()
+    patterns = list(import_module(urlconf).urlpatterns)
+    while patterns:
+        pattern = patterns.pop()
+        if isinstance(pattern, URLResolver):
+            patterns.extend(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin checking requests against the query budgets their views
+    declare (see social_media_api.sql_budget).
+
+    assertWithinQueryBudget() sends a request and fails if it ran more
+    queries than the view's budget, listing them and the duplicated ones;
+    assertRoutesBudgeted() fails unless every named route of a urlconf was
+    checked that way.
+
+    authenticate() sends an API token, as clients do, and each checked
+    request misses the token cache, so the token lookup is measured
+    against the authentication allowance rather than hidden, as it is by
+    force_authenticate().
+    """
+    budget_token = None
+
+    def authenticate(self, user):
+        """Send the following requests with `user`'s API token."""
+        self.budget_token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.budget_token.key}')
+
+    def assertWithinQueryBudget(self, method, url, data=None, budget=None, status=None, **extra):
+        """
+        Send the request and return the response. `budget` is only needed
+        for views that cannot declare one, such as the API root.
+        """
+        match = resolve(url.split('?')[0])
+        if budget is None:
+            budget = view_budget(match.func, method)
+        self.assertIsNotNone(budget, f"{method.upper()} {url} ({match.url_name}) declares no query budget.")
+
+        if self.budget_token is not None:
+            invalidate_token(self.budget_token.key)
+        with QueryRecorder() as recorder, self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data, **extra)
+        if status is not None:
+            self.assertEqual(response.status_code, status, f"{method.upper()} {url}")
+        budget = request_budget(response.wsgi_request, budget)
+        duplicated = ''.join(f"\n  {n}x {sql}" for sql, n in recorder.duplicates().items())
+        self.assertLessEqual(
+            recorder.count, budget,
+            f"{method.upper()} {url} ({match.url_name}) ran {recorder.count} queries, over its budget of {budget}."
+            + (f"\nDuplicated:{duplicated}" if duplicated else ''),
+        )
+        if not hasattr(self, 'budgeted_routes'):
+            self.budgeted_routes = set()
+        self.budgeted_routes.add(match.url_name)
+        return response
+
+    def assertRoutesBudgeted(self, urlconf):
+        missing = route_names(urlconf) - getattr(self, 'budgeted_routes', set())
+        self.assertFalse(missing, f"Routes of {urlconf} without a query budget test: {sorted(missing)}")